@@ -1,46 +1,230 @@
-from flask import (
-    Flask,
+from quart import (
+    Quart,
     Response,
+    g,
     jsonify,
     render_template,
     request,
-    stream_with_context,
     send_from_directory
 )
-from flask_cors import CORS
+from quart_cors import cors
+from concurrent.futures import ThreadPoolExecutor
 from queue import Queue
 import threading
+import signal
+import asyncio
 import time
 import json
 import sys
 import requests
 import re
+import os
 import logging
 
-from src.utils.logger import setup_logging, pprint, print
-from src.models.action import ensemble_get_action_params
-from src.models.intention_detector import dectect_user_intention
-from src.models.ask_assistant import ask_assistant, match_question
+from src.utils.logger import setup_logging, start_prompt_capture, stop_logging, pprint, print
+from src.models.action import aensemble_get_action_params, ensemble_get_action_params
+from src.models.intention_detector import adectect_user_intention, dectect_user_intention, guess_user_intention
+from src.models.ask_assistant import aask_assistant, amatch_question, ask_assistant, stream_ask_assistant, stream_match_question
 from src.models.response_message import get_response_message
-from src.models.translator import convert_answer_language_to_same_as_question, answer_I_dont_know_multilingual, batch_convert_answer_language_to_same_as_question
+from src.models.translator import answer_I_dont_know_multilingual, detect_user_language
+from src.models import intent_classifier, language_detection, translation_memory
+from src.utils import executor, http_session, metrics, tracing
 
 from src.charts.chart import chart
 
-app = Flask(__name__)
+app = Quart(__name__)
 app.config["JSON_AS_ASCII"] = False
 app.json.ensure_ascii = False
 app.register_blueprint(chart, url_prefix='/chart')
 
-CORS(app)
-setup_logging('app.log')
+app = cors(app, allow_origin='*', expose_headers=['Server-Timing'])
+# empty to log to the console only, e.g. with several worker processes
+setup_logging(os.getenv("LOG_FILE", "app.log"))
+
+# start parameter extraction together with intention detection when keyword rules predict an action
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "false").lower() == "true"
+SPECULATIVE_INTENTIONS = ['TRANSFER', 'TRANSFER_TO_EACH_USERS', 'CREATE_CHAT_GROUP']
+metrics.describe('speculative_action_params_total', 'Speculative parameter extractions, by result (hit or miss).')
+metrics.describe('speculative_action_params_head_start_seconds_total', 'Time speculative parameter extractions were already running when the intention was known.')
+
+# threads for the blocking work of the requests (streamed answers, `asyncio.to_thread`, sync views),
+# the requests themselves are served by the event loop of the worker without a thread each
+WEB_THREADS = int(os.getenv("WEB_THREADS") or 32)
+
+# request hooks are async, so that the context variables they set are the ones of the request's task
+@app.before_request
+async def start_request_state():
+    start_prompt_capture()
+    language_detection.start_request_cache()
+    http_session.use_async_session()
+
+@app.before_request
+async def start_request_trace():
+    # a trace is only kept when the per-stage timings are returned to the client
+    if tracing.TRACE_RESPONSE_HEADER or 'X-Trace' in request.headers:
+        g.trace = tracing.start_trace()
+
+@app.after_request
+async def add_server_timing(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        # streamed responses are still being generated, their stages are only in the metrics
+        if response.mimetype != 'text/event-stream':
+            response.headers['Server-Timing'] = trace.server_timing()
+        tracing.end_trace()
+    return response
+
+# set once the worker serves requests (see `start_serving`), cleared as soon as it is asked to stop
+ready = threading.Event()
 
 # check health
 @app.route('/health', methods=['GET'])
 def health():
     return "OK", 200
 
+# check the process accepts traffic, unlike /health it fails while loading and shutting down
+@app.route('/ready', methods=['GET'])
+def readiness():
+    if not ready.is_set():
+        return "Not ready", 503
+    return "OK", 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def start_speculative_action_params(messages):
+    """
+    Start parameter extraction in the background if the cheap keyword rules predict an action intention.
+    Returns (guessed intention, task, start time), or None when nothing was started.
+    """
+    if not SPECULATIVE_MODE:
+        return None
+    guessed_intention = guess_user_intention(messages)
+    if guessed_intention not in SPECULATIVE_INTENTIONS:
+        return None
+    logging.info(f"Speculatively extracting params for {guessed_intention}")
+    task = asyncio.ensure_future(aensemble_get_action_params(messages, action=guessed_intention))
+    return guessed_intention, task, time.perf_counter()
+
+def resolve_speculative_action_params(speculation, intention):
+    """
+    Keep the speculative task if the guessed intention matches the detected one, cancel it otherwise.
+    """
+    if speculation is None:
+        return None
+    guessed_intention, task, started_at = speculation
+    if guessed_intention == intention:
+        logging.info(f"Speculative params hit: {intention}")
+        metrics.increment('speculative_action_params_total', result='hit')
+        metrics.increment('speculative_action_params_head_start_seconds_total', time.perf_counter() - started_at)
+        return task
+    logging.info(f"Speculative params miss: guessed {guessed_intention}, detected {intention}")
+    metrics.increment('speculative_action_params_total', result='miss')
+    task.cancel()
+    return None
+
+def get_action_response(payload, action, messages):
+    """
+    Response of an action intention: the action when its params are complete, otherwise the question asking for the missing ones.
+    The confirmation is in the language of the user.
+    """
+    if isinstance(payload, dict):
+        return {
+            'action': {
+                'command': action,
+                'params': payload
+            },
+            'message': {
+                'role': 'assistant', 'content': get_response_message(payload, action=action, language=detect_user_language(messages))
+            },
+        }
+    return {
+        'action': {
+            'command': 'ASK_ASSISTANT',
+            'params': {}
+        },
+        'message': {
+            'role': 'assistant', 'content': payload
+        },
+        'suggestions': []
+    }
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(res):
+    """
+    Events of a whole (non-streamed) response.
+    """
+    for event in ['action', 'message', 'suggestions']:
+        if event in res:
+            yield sse(event, res[event])
+
+def sse_deltas(deltas, first_events):
+    """
+    Forward text deltas as `delta` events, `first_events` are sent right before the first delta.
+    Returns the result of the `deltas` generator, and the `first_events` left unsent.
+    """
+    while True:
+        try:
+            delta = next(deltas)
+        except StopIteration as stop:
+            return stop.value, first_events
+        yield from first_events
+        first_events = []
+        yield sse('delta', {'content': delta})
+
+def stream_chat(messages):
+    """
+    Server-sent events of /api/chat in stream mode, in order:
+        action: {command, params}, as soon as it is known
+        delta: {content}, response tokens, repeated
+        message: {role, content}, the whole response, replacing the deltas (it may be post-processed, e.g. translated)
+        suggestions: [...]
+        done: {}, or error: {error}
+    """
+    try:
+        ask_assistant_action = sse('action', {'command': 'ASK_ASSISTANT', 'params': {}})
+        if not messages or messages[-1]['content'].strip() == '':
+            bot_response, suggestions = ask_assistant(messages)
+            yield ask_assistant_action
+            yield sse('message', {'role': 'assistant', 'content': bot_response})
+            yield sse('suggestions', suggestions)
+            yield sse('done', {})
+            return
+
+        intention = dectect_user_intention(messages)
+        logging.info(f"Intention: {intention}")
+        if intention == 'NO_SYSTEM_ACTION':
+            (bot_response, suggestions), unsent = yield from sse_deltas(stream_match_question(messages), [ask_assistant_action])
+            if bot_response:
+                yield from unsent
+                yield sse('message', {'role': 'assistant', 'content': bot_response})
+                yield sse('suggestions', suggestions)
+            else:
+                yield sse('action', {'command': 'NO_ACTION', 'params': {}})
+                yield sse('message', {'role': 'assistant', 'content': answer_I_dont_know_multilingual(messages)})
+        elif intention == 'ASK_ASSISTANT':
+            yield ask_assistant_action
+            (bot_response, suggestions), _ = yield from sse_deltas(stream_ask_assistant(messages), [])
+            logging.info(f"Bot_response: {bot_response}")
+            yield sse('message', {'role': 'assistant', 'content': bot_response})
+            yield sse('suggestions', suggestions)
+        elif intention in ['CHECK_BALANCE', 'VIEW_USER_ACCOUNT_REPORT']:
+            yield sse('action', {'command': intention, 'params': {'user': messages[-1]['user']}})
+        elif intention in ['TRANSFER', 'TRANSFER_TO_EACH_USERS', 'CREATE_CHAT_GROUP']:
+            payload = ensemble_get_action_params(messages, action=intention)
+            yield from sse_response(get_action_response(payload, action=intention, messages=messages))
+        else:
+            raise Exception(f"Unknown intention: {intention}")
+        yield sse('done', {})
+    except Exception as e:
+        logging.exception(e)
+        yield sse('error', {'error': str(e)})
+
 @app.route('/api/chat', methods=['POST'])
-def chat():
+async def chat():
     """
     Endpoint: /api/chat
     Content-Type: application/json
@@ -49,7 +233,8 @@ def chat():
         Body: {
             messages: [
                 {"user": "Cuong", "content": "Hi, I want to transfer 300k to Minh."},
-            ]
+            ],
+            stream: false, # true for server-sent events, see `stream_chat`
         }
     Response:
         {
@@ -172,11 +357,12 @@ def chat():
         'suggestions': []
     }
     """
-    logging.info(f"Received request: {request.json}")
-    _ = request.json.get('model', 'gpt4all')
-    messages = request.json.get('messages', [])
-    stream = request.json.get('stream', False)
-    userInfo = request.json.get('userInfo', {"status": None})
+    body = await request.get_json()
+    logging.info(f"Received request: {body}")
+    _ = body.get('model', 'gpt4all')
+    messages = body.get('messages', [])
+    stream = body.get('stream', False)
+    userInfo = body.get('userInfo', {"status": None})
     for message in messages:
         if 'role' in message:
             return jsonify({'error': 'Role is not allowed. Deprecated.'}), 400
@@ -190,9 +376,14 @@ def chat():
 
     
     if stream:
-        return jsonify({'error': 'Stream mode is not supported.'}), 400
+        # the generator blocks on the completion APIs, each step runs in a thread of the default executor
+        return Response(
+            stream_chat(messages),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
     if not messages or messages[-1]['content'].strip() == '':
-        bot_response, suggestions = ask_assistant(messages)
+        bot_response, suggestions = await aask_assistant(messages)
         return jsonify({
             'message': {
                 'role': 'assistant', 'content': bot_response
@@ -207,12 +398,19 @@ def chat():
     logging.info(f"All Messages: {messages}")
     print(f'====================')
 
-    intention = dectect_user_intention(messages)
+    speculation = start_speculative_action_params(messages)
+    try:
+        intention = await adectect_user_intention(messages)
+    except Exception:
+        if speculation is not None:
+            speculation[1].cancel()
+        raise
 
     logging.info(f"Intention: {intention}")
+    speculative_payload = resolve_speculative_action_params(speculation, intention)
 
     if intention == 'NO_SYSTEM_ACTION':
-        bot_response, suggestions = match_question(messages)
+        bot_response, suggestions = await amatch_question(messages)
 
         if bot_response:
             return jsonify({
@@ -233,12 +431,12 @@ def chat():
             },
             'message': {
                 'role': 'assistant',
-                'content': answer_I_dont_know_multilingual(messages)
+                'content': await asyncio.to_thread(answer_I_dont_know_multilingual, messages)
             }
         })
     
     elif intention == 'ASK_ASSISTANT':
-        bot_response, suggestions = ask_assistant(messages)
+        bot_response, suggestions = await aask_assistant(messages)
         
         logging.info(f"Bot_response: {bot_response}")
 
@@ -262,74 +460,14 @@ def chat():
             }
         }
     elif intention == 'TRANSFER':
-        payload = ensemble_get_action_params(messages, action='TRANSFER')
-        if isinstance(payload, dict):
-            res = {
-                'action': {
-                    'command': 'TRANSFER',
-                    'params': payload
-                },
-                'message': {
-                    'role': 'assistant', 'content': get_response_message(payload, action='TRANSFER')
-                },
-            }
-        else:
-            res = {
-                'action': {
-                    'command': 'ASK_ASSISTANT',
-                    'params': {}
-                },
-                'message': {
-                    'role': 'assistant', 'content': payload
-                },
-                'suggestions': []
-            }
+        payload = await (speculative_payload or aensemble_get_action_params(messages, action='TRANSFER'))
+        res = get_action_response(payload, action='TRANSFER', messages=messages)
     elif intention == 'TRANSFER_TO_EACH_USERS':
-        payload = ensemble_get_action_params(messages, action='TRANSFER_TO_EACH_USERS')
-        if isinstance(payload, dict):
-            res = {
-                'action': {
-                    'command': 'TRANSFER_TO_EACH_USERS',
-                    'params': payload
-                },
-                'message': {
-                    'role': 'assistant', 'content': get_response_message(payload, action='TRANSFER_TO_EACH_USERS')
-                },
-            }
-        else:
-            res = {
-                'action': {
-                    'command': 'ASK_ASSISTANT',
-                    'params': {}
-                },
-                'message': {
-                    'role': 'assistant', 'content': payload
-                },
-                'suggestions': []
-            }
+        payload = await (speculative_payload or aensemble_get_action_params(messages, action='TRANSFER_TO_EACH_USERS'))
+        res = get_action_response(payload, action='TRANSFER_TO_EACH_USERS', messages=messages)
     elif intention == 'CREATE_CHAT_GROUP':
-        payload = ensemble_get_action_params(messages, action='CREATE_CHAT_GROUP')
-        if isinstance(payload, dict):
-            res = {
-                'action': {
-                    'command': 'CREATE_CHAT_GROUP',
-                    'params': payload
-                },
-                'message': {
-                    'role': 'assistant', 'content': get_response_message(payload, action='CREATE_CHAT_GROUP')
-                },
-            }
-        else:
-            res = {
-                'action': {
-                    'command': 'ASK_ASSISTANT',
-                    'params': {}
-                },
-                'message': {
-                    'role': 'assistant', 'content': payload
-                },
-                'suggestions': []
-            }
+        payload = await (speculative_payload or aensemble_get_action_params(messages, action='CREATE_CHAT_GROUP'))
+        res = get_action_response(payload, action='CREATE_CHAT_GROUP', messages=messages)
     elif intention == 'VIEW_USER_ACCOUNT_REPORT':
         res = {
             'action': {
@@ -345,5 +483,57 @@ def chat():
     logging.info(f"Response: {res}")
     return jsonify(res)
 
+def warm_up():
+    """
+    Build the lazily initialized language detector, intent classifier, translation memory and LangChain agent before the first request.
+    Called by gunicorn before forking the workers, see gunicorn.conf.py.
+    """
+    from src.models.langchain import advisor
+
+    start = time.perf_counter()
+    language_detection.get_detector()
+    intent_classifier.get_classifier()
+    translation_memory.get_translation_memory()
+    advisor.get_agent()
+    logging.info(f"Warmed up in {time.perf_counter() - start:.2f}s")
+
+@app.before_serving
+async def start_serving():
+    """
+    Set up the event loop of the worker and mark the process ready, and not ready any more when it receives SIGTERM,
+    while the server drains the requests in flight.
+    """
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=WEB_THREADS, thread_name_prefix="request"))
+    await http_session.open_async_session()
+
+    # the server handles SIGTERM while it serves, wrap its handler
+    handle_exit = signal.getsignal(signal.SIGTERM)
+
+    def drain(signum, frame):
+        ready.clear()
+        logging.info("Draining the requests in flight")
+        if callable(handle_exit):
+            handle_exit(signum, frame)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, drain)
+    ready.set()
+
+@app.after_serving
+async def stop_serving():
+    ready.clear()
+    await http_session.close_async_session()
+
+def shutdown():
+    """
+    Let the running fan-out tasks finish and flush the logs.
+    Called by the gunicorn worker on exit, see gunicorn.conf.py.
+    """
+    ready.clear()
+    logging.info("Shutting down")
+    executor.shutdown(wait=True)
+    stop_logging()
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # development server only, see gunicorn.conf.py for serving
+    app.run(debug=os.getenv("QUART_DEBUG", "true").lower() == "true", host='0.0.0.0', port=5000)
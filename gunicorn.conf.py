@@ -0,0 +1,69 @@
+"""
+Production server configuration, used by the Dockerfile:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Requests mostly wait on the completion APIs, so each worker process serves them on an asyncio event loop (uvicorn),
+without holding a thread per request. Blocking work runs in a pool of WEB_THREADS threads, see app.py.
+"""
+import os
+import shutil
+import tempfile
+from dotenv import load_dotenv
+load_dotenv()
+
+bind = f"0.0.0.0:{os.getenv('PORT') or 5000}"
+workers = int(os.getenv("WEB_WORKERS") or 2)
+worker_class = "uvicorn.workers.UvicornWorker"
+# seconds a worker may stay silent before it is restarted, streamed answers keep it alive
+timeout = int(os.getenv("WEB_TIMEOUT") or 120)
+# seconds in-flight requests get to finish after SIGTERM
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT") or 60)
+keepalive = 5
+# import the app once in the master, the workers share its memory copy-on-write
+preload_app = True
+# also build the language detector and the LangChain agent in the master, instead of on the first request of each worker
+WARM_UP = (os.getenv("WARM_UP") or "true").lower() == "true"
+accesslog = "-"
+# each worker writes its metrics there, so that /metrics renders the sum over the workers whichever one is scraped
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), f"app-metrics-{os.getpid()}")
+os.environ["METRICS_DIR"] = METRICS_DIR
+
+
+def on_starting(server):
+    # counters of a previous run would be added to the new ones
+    if os.path.isdir(METRICS_DIR):
+        for file_name in os.listdir(METRICS_DIR):
+            os.remove(os.path.join(METRICS_DIR, file_name))
+
+
+def pre_fork(server, worker):
+    from src.utils import metrics
+
+    # the workers start counting from zero, the metrics of the master are in its own file
+    metrics.flush()
+
+
+def when_ready(server):
+    if WARM_UP:
+        import app
+
+        app.warm_up()
+
+
+def worker_exit(server, worker):
+    import app
+    from src.utils import metrics
+
+    app.shutdown()
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    from src.utils import metrics
+
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
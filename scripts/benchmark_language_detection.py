@@ -0,0 +1,102 @@
+"""
+Cost of language detection per text: lingua alone, against `language_detection.detect_language` without cache
+(script and diacritics pre-check, lingua fallback) and with its caches, and how often both agree.
+
+The corpus is a set of user messages and answers of the app, or the messages of a JSONL file of logged
+conversations (INTENT_LOG_PATH, one `{"messages": [...]}` per line).
+
+Usage:
+    python scripts/benchmark_language_detection.py [--data intents.jsonl] [--repeat 20]
+"""
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tabulate import tabulate
+from src.models import language_detection
+from src.models.intent_classifier import load_samples
+
+CORPUS = [
+    "Hi, I want to transfer 300k to Minh.",
+    "Tao muốn chuyển mỗi đứa 800k tiền mừng năm mới.",
+    "Tao muốn tạo nhóm chat với Nam và Lan.",
+    "Tài khoản của tao còn bao nhiêu tiền?",
+    "Ủa mày thích ăn đấm không?",
+    "Tôi muốn được tư vấn về việc lên kế hoạch quản lý tài chính.",
+    "I want to ask for financial advice",
+    "Compare Bank of America, Coca Cola, and Apple",
+    "I own Amazon. What is their earning per share?",
+    "Tạo kế hoạch ngân sách hàng tháng.",
+    "Mình muốn biết nếu mình tiết kiệm 20 năm thì sẽ có bao nhiêu",
+    "I want to create a chat group with Cuong, Minh, and Tuan.",
+    "chuyen cho Nam 500k",
+    "so du tai khoan",
+    "ok",
+    "Saya ingin mentransfer uang ke Budi.",
+    "我想给明转账三十万。",
+    "東京の株を買いたいです。",
+    "내 계좌 잔액이 얼마인가요?",
+    "ฉันต้องการโอนเงิน",
+    "Xin lỗi, tôi không hiểu ý bạn. Bạn có thể nói rõ hơn được không?",
+    "I'm sorry, but I do not understand what you mean. Can you rephrase your question?",
+    "Theo mình thì bạn nên dành 55% thu nhập cho các chi tiêu cần thiết, 10% cho từng quỹ: tiết kiệm dài hạn, giáo dục, "
+    "hưởng thụ và tự do tài chính. Và dành 5% cho việc từ thiện. " * 4,
+    "To create a monthly budget plan, start by listing your income and your fixed expenses, then set aside "
+    "a share of what remains for savings, investments and emergencies. " * 4,
+]
+
+
+def time_per_text(detect, texts, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            detect(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=None, help="JSONL file of logged conversations, the built-in corpus if not set")
+    parser.add_argument("--repeat", type=int, default=20, help="Passes over the corpus")
+    args = parser.parse_args()
+
+    if args.data:
+        texts = [message['content'] for sample in load_samples(args.data) for message in sample['messages']]
+    else:
+        texts = CORPUS
+    detector = language_detection.get_detector()
+
+    def lingua(text):
+        language = detector.detect_language_of(text)
+        return language.name if language is not None else language_detection.DEFAULT_LANGUAGE
+
+    def uncached(text):
+        return language_detection._detect(text[:language_detection.LANGUAGE_DETECTION_MAX_CHARS])
+
+    # warm up
+    time_per_text(lingua, texts, 1)
+    rows = [
+        ["lingua", f"{time_per_text(lingua, texts, args.repeat):.1f}"],
+        ["pre-check + lingua", f"{time_per_text(uncached, texts, args.repeat):.1f}"],
+        ["pre-check + lingua, cached", f"{time_per_text(language_detection.detect_language, texts, args.repeat):.1f}"],
+    ]
+    print(f"{len(texts)} texts")
+    print(tabulate(rows, headers=["method", "µs per text"]))
+
+    methods = Counter(
+        "lingua" if language_detection.detect_by_script(text[:language_detection.LANGUAGE_DETECTION_MAX_CHARS]) is None else "pre-check"
+        for text in texts
+    )
+    disagreements = [(text, lingua(text), uncached(text)) for text in texts if lingua(text) != uncached(text)]
+    print(f"Decided by the pre-check: {methods['pre-check'] / len(texts):.0%}")
+    print(f"Agreement with lingua: {1 - len(disagreements) / len(texts):.0%}")
+    for text, expected, detected in disagreements:
+        print(f"  {expected} != {detected}: {text[:80]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold start of the app: time to import `app` in a fresh interpreter, the slowest imports (`python -X importtime`),
+and the time of the warm-up that builds the language detector and the LangChain agent.
+
+Usage:
+    python scripts/benchmark_startup.py [--module app] [--runs 3] [--top 15] [--warm-up]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+from tabulate import tabulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    # importing does not call any API, placeholder keys are enough
+    env = {"OPENAI_API_KEYS": "sk-benchmark", "SERPAPI_API_KEY": "benchmark", "LOG_FILE": "", **os.environ}
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", code]
+    return subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def parse_importtime(stderr: str):
+    """
+    Example:
+        >>> parse_importtime("import time: self [us] | cumulative | imported package\\nimport time: 120 | 4560 | lingua")
+        [('lingua', 120, 4560)]
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="Module to import")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to show, by cumulative time")
+    parser.add_argument("--warm-up", action="store_true", help="Also time `app.warm_up()` after the import")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        run(f"import {args.module}")
+        timings.append(time.perf_counter() - start)
+    print(f"import {args.module}: {statistics.median(timings):.2f}s (median of {args.runs}, including interpreter startup)")
+
+    imports = parse_importtime(run(f"import {args.module}", importtime=True).stderr)
+    imports.sort(key=lambda item: item[2], reverse=True)
+    rows = [[name, f"{self_us / 1000:.1f}", f"{cumulative_us / 1000:.1f}"] for name, self_us, cumulative_us in imports[:args.top]]
+    print(tabulate(rows, headers=["module", "self ms", "cumulative ms"]))
+
+    if args.warm_up:
+        output = run(
+            "import time, app\n"
+            "start = time.perf_counter()\n"
+            "app.warm_up()\n"
+            "print(time.perf_counter() - start)"
+        ).stdout
+        print(f"app.warm_up(): {float(output.strip().splitlines()[-1]):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Fill the response template catalog (RESPONSE_TEMPLATES_PATH) for every supported language, by translating the
+FALLBACK_LANGUAGE template of each response with the model, once.
+Templates already in the catalog are skipped, and translations which lose or add a placeholder are left out,
+so the script can be re-run after adding languages or templates.
+
+Usage:
+    python scripts/build_response_templates.py [--languages ENGLISH VIETNAMESE] [--overwrite]
+"""
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models import translator
+from src.models.language_detection import LANGUAGES
+from src.models.response_templates import FALLBACK_LANGUAGE, RESPONSE_TEMPLATES_PATH, get_placeholders, get_templates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--languages", nargs="+", default=[language.name for language in LANGUAGES], help="Destination languages")
+    parser.add_argument("--overwrite", action="store_true", help="Translate again the templates already in the catalog")
+    args = parser.parse_args()
+
+    templates = get_templates()
+    translated = 0
+    rejected = []
+    for template_id, languages in templates.items():
+        source = languages[FALLBACK_LANGUAGE]
+        for dest in args.languages:
+            if dest == FALLBACK_LANGUAGE or (dest in languages and not args.overwrite):
+                continue
+            translation = translator.translate(source, src=FALLBACK_LANGUAGE, dest=dest, memory=False)
+            if get_placeholders(translation) != get_placeholders(source):
+                rejected.append((template_id, dest, translation))
+                continue
+            languages[dest] = translation
+            translated += 1
+        # keep the progress if a call fails
+        with open(RESPONSE_TEMPLATES_PATH, "w", encoding="utf-8") as f:
+            json.dump(templates, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    print(f"{len(templates)} templates, {translated} new translations in {RESPONSE_TEMPLATES_PATH}")
+    for template_id, dest, translation in rejected:
+        print(f"  rejected {template_id} in {dest}, placeholders changed: {translation}")
+
+
+if __name__ == "__main__":
+    main()
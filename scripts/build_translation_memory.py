@@ -0,0 +1,43 @@
+"""
+Translate the static texts of the app (scripted answers, suggestions, introduction) into every supported language
+with the model, once, and store them in the translation memory loaded by the app (TRANSLATION_MEMORY_PATH).
+Texts already in the memory are skipped, so the script can be re-run after adding static texts.
+
+Usage:
+    python scripts/build_translation_memory.py [--languages ENGLISH VIETNAMESE] [--overwrite]
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# importing the modules registers their static texts
+from src.models import ask_assistant, translator  # noqa: F401
+from src.models.language_detection import LANGUAGES
+from src.models.translation_memory import TranslationMemory, get_static_texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--languages", nargs="+", default=[language.name for language in LANGUAGES], help="Destination languages")
+    parser.add_argument("--overwrite", action="store_true", help="Translate again the texts already in the memory")
+    args = parser.parse_args()
+
+    memory = TranslationMemory()
+    static_texts = get_static_texts()
+    translated = 0
+    for text, src in static_texts:
+        for dest in args.languages:
+            if dest == src or (memory.get(text, src, dest) is not None and not args.overwrite):
+                continue
+            memory.set(text, src, dest, translator.translate(text, src=src, dest=dest, memory=False))
+            translated += 1
+        # keep the progress if a call fails
+        memory.save()
+
+    print(f"{len(static_texts)} static texts, {translated} new translations, {len(memory)} in {memory.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Offline evaluation of the local intent classifier against the model's labels.
+
+For each confidence threshold, reports how many model calls the fast path saves (reduction rate)
+and how often the local answer agrees with the model on the messages it answers.
+
+Usage:
+    python scripts/evaluate_intent_classifier.py --data intents.jsonl [--model PATH] [--thresholds 0.7 0.8 0.9 0.95]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import joblib
+from tabulate import tabulate
+from src.models import intent_classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", required=True, help="JSONL file of conversations labeled by the model, held out from training")
+    parser.add_argument("--model", default=intent_classifier.INTENT_CLASSIFIER_PATH)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95])
+    args = parser.parse_args()
+
+    classifier = joblib.load(args.model)
+    samples = intent_classifier.load_samples(args.data)
+
+    predictions = []
+    start = time.perf_counter()
+    for sample in samples:
+        predictions.append(intent_classifier.predict(sample['messages'], classifier=classifier))
+    elapsed = time.perf_counter() - start
+
+    labels = [sample['intent'] for sample in samples]
+    print(f"{len(samples)} samples, {elapsed / max(len(samples), 1) * 1000:.2f} ms per prediction")
+    print(f"Agreement without threshold: {sum(p == l for (p, _), l in zip(predictions, labels)) / max(len(samples), 1):.2%}")
+
+    rows = []
+    for threshold in args.thresholds:
+        answered = [
+            (intent, label) for (intent, confidence), label, sample in zip(predictions, labels, samples)
+            if confidence >= threshold and intent != "VIEW_USER_ACCOUNT_REPORT" and not intent_classifier.is_reply_to_assistant(sample['messages'])
+        ]
+        agreed = sum(intent == label for intent, label in answered)
+        rows.append([
+            threshold,
+            len(answered),
+            f"{len(answered) / max(len(samples), 1):.2%}",
+            f"{agreed / max(len(answered), 1):.2%}",
+            len(answered) - agreed,
+        ])
+    print(tabulate(rows, headers=["threshold", "answered locally", "LLM-call reduction", "agreement", "disagreements"]))
+
+
+if __name__ == "__main__":
+    main()
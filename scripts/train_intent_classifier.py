@@ -0,0 +1,41 @@
+"""
+Train the local intent classifier from conversations labeled by the model.
+
+Usage:
+    python scripts/train_intent_classifier.py --data intents.jsonl [--data more.jsonl] [--no-seed] [--output PATH]
+
+Labeled conversations are written by `dectect_user_intention` when INTENT_LOG_PATH is set.
+"""
+import os
+import sys
+import argparse
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models import intent_classifier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", action="append", default=[], help="JSONL file of labeled conversations, can be repeated")
+    parser.add_argument("--no-seed", action="store_true", help="do not include the bundled seed examples")
+    parser.add_argument("--output", default=intent_classifier.INTENT_CLASSIFIER_PATH)
+    args = parser.parse_args()
+
+    samples = []
+    if not args.no_seed:
+        samples += intent_classifier.load_samples(intent_classifier.SEED_DATA_PATH)
+    for path in args.data:
+        samples += intent_classifier.load_samples(path)
+    if len(samples) == 0:
+        sys.exit("No training samples.")
+
+    print(f"Training on {len(samples)} samples: {dict(Counter(sample['intent'] for sample in samples))}")
+    classifier = intent_classifier.train(samples)
+    intent_classifier.save(classifier, args.output)
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from flask import (
+import asyncio
+from quart import (
     Blueprint,
     render_template,
     request
@@ -11,23 +12,23 @@ chart = Blueprint('chart', __name__)
 
 
 @chart.route('/compare', methods=['GET'])
-def compare():
+async def compare():
     symbols = request.args.get('symbols').split(',')
 
     metrics = {}
     for symbol in symbols:
-        metrics[symbol] = get_compare_metrics(symbol)
+        metrics[symbol] = await asyncio.to_thread(get_compare_metrics, symbol)
 
     print(metrics)
 
-    return render_template('iframe.html')
+    return await render_template('iframe.html')
 
 
 @chart.route('/earning', methods=['GET'])
-def earning():
+async def earning():
     symbol = request.args.get('symbol')
 
-    earning_data = get_earning_data(symbol)
+    earning_data = await asyncio.to_thread(get_earning_data, symbol)
 
     # map to each element become reportedEPS - estimatedEPS
     data = list(map(lambda x: float(
@@ -35,4 +36,4 @@ def earning():
     chart_title = 'My Chart Title'
     labels = list(map(lambda x: x['fiscalDateEnding'], earning_data))
 
-    return render_template('iframe.html', data=data, labels=labels, chart_title=chart_title)
+    return await render_template('iframe.html', data=data, labels=labels, chart_title=chart_title)
@@ -1,5 +1,8 @@
 import os
 from alpha_vantage.timeseries import TimeSeries
+from src.utils import http_session
+
+http_session.install()
 
 def get_compare_metrics(symbol):
 	ts = TimeSeries(
@@ -1,4 +1,4 @@
-import requests
+from src.utils.http_session import get_session
 import os
 
 API_KEY = os.environ.get('ALPHA_VANTAGE_API_KEY')
@@ -7,7 +7,7 @@ LIMIT = 10
 def get_earning_data(symbol):
 	endpoint = f'https://www.alphavantage.co/query?function=EARNINGS&symbol={symbol}&apikey={API_KEY}'
 	
-	response = requests.get(endpoint)
+	response = get_session().get(endpoint)
 	data = response.json()
 	
 	quarterlyEarnings = data['quarterlyEarnings']
@@ -3,20 +3,32 @@ import sys
 
 sys.path.append("/home/thaiminhpv/Workspace/Code/FUNiX-ChatGPT-Hackathon/Chatbot/Chatbot/src/")
 
-from typing import Dict, List, Tuple, Union, Literal, Any, Optional
+from typing import Dict, List, Tuple, Union, Literal, Any, Optional, Generator
 from utils.logger import print, setup_logging_display_only
-from utils.model_api import generate_general_call_chatgpt_api
+from utils.model_api import generate_general_call_chatgpt_api, stream_general_call_chatgpt_api
+from src.utils.prompt_prefix import register_prompt_prefix
+from src.utils import tracing
+from src.utils.logger import log_prompt
+from src.models.translation_memory import register_static_texts
 from utils.logger import print
-from expert_system.utils.stage import get_current_stage
+from expert_system.utils.stage import get_current_stage, stream_stage_response
 from expert_system.utils import calculator
 from expert_system.utils import spreadsheet
 import re
 import logging
 
+STAGE1_SUGGESTIONS = register_static_texts([
+    'Mình muốn được biết rằng trong bao lâu thì mình có thể tiết kiệm được 100 triệu đồng',
+    'Mình muốn biết nếu mình tiết kiệm 20 năm thì sẽ có bao nhiêu',
+], language="VIETNAMESE")
+STAGE2_SUGGESTIONS = register_static_texts(['5 triệu'], language="VIETNAMESE")
+
+@tracing.traced("match_question_scan")
 def is_economical_question(messages: List[Dict[str, str]]) -> bool:
     # return "tiết kiệm" in message
     return any(["tiết kiệm" in message['content'] for message in messages])
 
+@tracing.traced("economical")
 def economical_suggestion(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
     """
     Args:
@@ -33,11 +45,38 @@ def economical_suggestion(messages: List[Dict[str, str]]) -> Tuple[str, List[str
         'Mình muốn biết nếu mình tiết kiệm 20 năm thì sẽ có bao nhiêu'
     ])
     """
-    messages = messages[-7:]
-    
-    conversation = "\n".join([f"- {' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
-    last_user = messages[-1]['user']
-    model_input = f"""This is a Personal Finance Assistant system. There are 3 stages in total. After user's request, system will display the current stage of the conversation, followed by "Analyzing: " no more than 100 words. Finally, system will response to the user as in pre-defined script. If user's message intention is not match the response expectation in the pre-defined script, system display the current stage as "BREAK" and end the conversation. If user include their income, system can jump straight through stage 3.
+    model_input, last_user = _get_economical_model_input(messages)
+    log_prompt("Model input", model_input)
+    output = generate_general_call_chatgpt_api(
+        inputs=model_input,
+        temperature=0,
+        max_tokens=1024,
+        stop=(f'- {last_user}:',)
+    )
+    log_prompt("Model output", output)
+    return _parse_economical_output(output)
+
+def stream_economical_suggestion(messages: List[Dict[str, str]]) -> Generator[str, None, Tuple[str, List[str]]]:
+    """
+    Streaming variant of `economical_suggestion`. Yields the assistant response while it is generated for Stage 1 and Stage 2,
+    the responses of other stages need post-processing and are only returned.
+    """
+    model_input, last_user = _get_economical_model_input(messages)
+    log_prompt("Model input", model_input)
+    output = yield from stream_stage_response(
+        stream_general_call_chatgpt_api(
+            inputs=model_input,
+            temperature=0,
+            max_tokens=1024,
+            stop=(f'- {last_user}:',)
+        ),
+        streamed_stages=('Stage 1', 'Stage 2'),
+    )
+    log_prompt("Model output", output)
+    return _parse_economical_output(output)
+
+# static part of the prompt, its attention cache is reused by the self-hosted model
+ECONOMICAL_SCRIPT = register_prompt_prefix("""This is a Personal Finance Assistant system. There are 3 stages in total. After user's request, system will display the current stage of the conversation, followed by "Analyzing: " no more than 100 words. Finally, system will response to the user as in pre-defined script. If user's message intention is not match the response expectation in the pre-defined script, system display the current stage as "BREAK" and end the conversation. If user include their income, system can jump straight through stage 3.
 
 ## Script:
 ### Stage 1:
@@ -72,17 +111,18 @@ Case 2:
 
 ## Real conversation:
 ...
-{conversation}
+""")
+
+def _get_economical_model_input(messages: List[Dict[str, str]]) -> Tuple[str, str]:
+    messages = messages[-7:]
+    
+    conversation = "\n".join([f"- {' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
+    last_user = messages[-1]['user']
+    model_input = ECONOMICAL_SCRIPT + f"""{conversation}
 Analyzing:"""
-    logging.info(f"Model input: \n{model_input}")
-    output = generate_general_call_chatgpt_api(
-        inputs=model_input,
-        temperature=0,
-        max_tokens=1024,
-        stop=(f'- {last_user}:',)
-    )
-    logging.info(f"Model output: \n{output}")
+    return model_input, last_user
 
+def _parse_economical_output(output: str) -> Tuple[str, List[str]]:
     current_stage = get_current_stage(output)
     
     if current_stage == 'BREAK':
@@ -92,12 +132,9 @@ Analyzing:"""
     response_message = " ".join(response_message.split())
     
     if current_stage == 'Stage 1':
-        return response_message, [
-            'Mình muốn được biết rằng trong bao lâu thì mình có thể tiết kiệm được 100 triệu đồng',
-            'Mình muốn biết nếu mình tiết kiệm 20 năm thì sẽ có bao nhiêu'
-        ]  
+        return response_message, STAGE1_SUGGESTIONS
     if current_stage == 'Stage 2':
-        return response_message, ['5 triệu']
+        return response_message, STAGE2_SUGGESTIONS
     if current_stage == 'Stage 3':
         income = calculator.get_income(output)
         print(f"income: {income}")
@@ -1,4 +1,4 @@
-from typing import Literal, Dict, List, Tuple, Union, Any, Optional
+from typing import Literal, Dict, List, Tuple, Union, Any, Optional, Iterable, Generator
 from utils.logger import setup_logging_display_only, print
 import logging
 import re
@@ -35,6 +35,58 @@ def get_current_stage(model_output: str) -> Literal['Stage 1', 'Stage 2', 'Stage
     return current_stage
 
 
+RESPONSE_START = re.compile(r"Current stage: (Stage \d|BREAK)\s*- Assistant:\s*")
+RESPONSE_END = "Current stage:"
+
+def stream_stage_response(chunks: Iterable[str], streamed_stages: Tuple[str, ...]) -> Generator[str, None, str]:
+    """
+    Forward the assistant response of a scripted model output ("Current stage: ...\n- Assistant: ...") while it is generated,
+    only for the stages whose response is used without post-processing.
+
+    Args:
+        chunks (Iterable[str]): Model output deltas.
+        streamed_stages (Tuple[str, ...]): Stages to forward, e.g. ('Stage 1',).
+
+    Returns:
+        model_output (str): Whole model output.
+
+    Examples:
+    >>> list(stream_stage_response([" Asking.\nCurrent stage: Stage 1\n- Assis", "tant: Thu nhập của", " bạn?"], ('Stage 1',)))
+    ['Thu nhập của', ' bạn?']
+    """
+    output = ""
+    sent = 0
+    for chunk in chunks:
+        output += chunk
+        start = RESPONSE_START.search(output)
+        if start is None or start.group(1) not in streamed_stages:
+            continue
+        response = output[start.end():]
+        end = _get_safe_response_end(response)
+        if end > sent:
+            yield response[sent:end]
+            sent = end
+
+    start = RESPONSE_START.search(output)
+    if start is not None and start.group(1) in streamed_stages:
+        response = output[start.end():]
+        end = response.find(RESPONSE_END)
+        end = end if end >= 0 else len(response)
+        if end > sent:
+            yield response[sent:end]
+    return output
+
+def _get_safe_response_end(response: str) -> int:
+    # do not forward what may be the beginning of the next "Current stage:"
+    end = response.find(RESPONSE_END)
+    if end >= 0:
+        return end
+    for size in range(min(len(RESPONSE_END) - 1, len(response)), 0, -1):
+        if RESPONSE_END.startswith(response[-size:]):
+            return len(response) - size
+    return len(response)
+
+
 if __name__ == "__main__":
     print(get_current_stage(" User is asking about the Current stage: BREAK"))
     print(get_current_stage(" User is asking about the Current stage: Stage 2"))
\ No newline at end of file
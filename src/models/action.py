@@ -3,59 +3,141 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from typing import List, Literal, Dict, Union, Any, Tuple
-from utils.model_api import generate_general_call_chatgpt_api
+from utils.model_api import generate_general_call_chatgpt_api, agenerate_general_call_chatgpt_api, is_cached
 from utils.logger import setup_logging_display_only, pprint, print
-import threading
+from src.utils.executor import submit
+from src.utils import metrics, tracing
+from src.utils.logger import log_prompt
+from src.utils.prompt_prefix import register_prompt_prefix
+import concurrent.futures
+import asyncio
 import logging
 import re
 import json
 
+metrics.describe('action_params_ensemble_total', 'Action params ensembles, by exit (early majority, full majority or no majority).')
+
 def ensemble_get_action_params(
         messages: List[Dict[str, str]],
         action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
         ensemble_size: int = 3,
     ) -> Union[Dict[str, str], str]:
+    """
+    Extract action parameters with an ensemble of model calls and majority voting, because the extraction sometimes fails.
+    Returns as soon as a strict majority of the ensemble agrees, the stragglers are cancelled or ignored.
+    The transaction category is then detected once, for the winning parameters only.
+    """
+    ensemble_size = _get_ensemble_size(messages, action, ensemble_size)
+    vote = MajorityVote(ensemble_size)
+    futures = [submit(_extract_action_params, messages, action) for _ in range(ensemble_size)]
+    pending = set(futures)
+    while pending and vote.winner is None:
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            vote.add_done(future)
+    for future in pending:
+        future.cancel()
+
+    params = vote.result()
+    if _needs_category(params, action):
+        params["category"] = _categorize(messages, params)
+    return params
+
+
+async def aensemble_get_action_params(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+        ensemble_size: int = 3,
+    ) -> Union[Dict[str, str], str]:
+    """
+    Async variant of `ensemble_get_action_params`, all ensemble members run concurrently on the event loop.
+    """
+    ensemble_size = _get_ensemble_size(messages, action, ensemble_size)
+    vote = MajorityVote(ensemble_size)
+    pending = {asyncio.ensure_future(_aextract_action_params(messages, action)) for _ in range(ensemble_size)}
+    try:
+        while pending and vote.winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                vote.add_done(task)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    params = vote.result()
+    if _needs_category(params, action):
+        params["category"] = await _acategorize(messages, params)
+    return params
+
+
+class MajorityVote:
+    """
+    Collect ensemble results, and know as soon as a strict majority of the ensemble agrees.
+
+    Example:
+        >>> vote = MajorityVote(ensemble_size=3)
+        >>> vote.add({"members": ["Nam"]})
+        >>> vote.winner
+        >>> vote.add({"members": ["Nam"]})
+        >>> vote.winner
+        {'members': ['Nam']}
+    """
+
+    def __init__(self, ensemble_size: int):
+        self.ensemble_size = ensemble_size
+        self.hash_results: List[str] = []
+        self.winner: Union[Dict[str, str], str, None] = None
+
+    def add(self, result: Union[Dict[str, str], str, None]) -> None:
+        if result is None or self.winner is not None:
+            return
+        # make sure results hashable using json
+        hash_result = json.dumps(result, sort_keys=True)
+        self.hash_results.append(hash_result)
+        if self.hash_results.count(hash_result) > self.ensemble_size // 2:
+            self.winner = json.loads(hash_result)
+            logging.info(f"Majority reached after {len(self.hash_results)}/{self.ensemble_size} results: {self.winner}")
+            metrics.increment('action_params_ensemble_total', exit='early' if len(self.hash_results) < self.ensemble_size else 'full')
+
+    def add_done(self, future: Union[concurrent.futures.Future, asyncio.Future]) -> None:
+        """
+        Add the result of a finished ensemble member, a failed member does not vote.
+        """
+        try:
+            self.add(future.result())
+        except Exception as e:
+            logging.error(e)
+
+    def result(self) -> Union[Dict[str, str], str]:
+        if self.winner is not None:
+            return self.winner
+        if len(self.hash_results) == 0:
+            raise Exception("Cannot get action params")
+        # no majority, get most common result
+        logging.info(f"All {self.ensemble_size} results: {self.hash_results}")
+        result = json.loads(max(set(self.hash_results), key=self.hash_results.count))
+        logging.info(f"Most common result: {result}")
+        metrics.increment('action_params_ensemble_total', exit='no_majority')
+        return result
+
+
+def _needs_category(params: Union[Dict[str, str], str], action: str) -> bool:
+    # a str asks the user for the missing parameters, chat groups have no transaction category
+    return not isinstance(params, str) and action != "CREATE_CHAT_GROUP"
+
+
+def _get_ensemble_size(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+        ensemble_size: int,
+    ) -> int:
+    # a cached extraction would be returned to every member of the ensemble, one is enough
+    model_input, max_tokens = _get_action_model_input(messages, action)
+    if is_cached(model_input, temperature=0, max_tokens=max_tokens):
+        logging.info("Action params extraction is cached, ensemble size reduced to 1")
+        return 1
+    return ensemble_size
 
-    # try 3 times, because there will be time will raise error
-    # results = []
-    # for i in range(ensemble_size):
-    #     try:
-    #         results.append(get_action_params(messages, action))
-    #     except Exception as e:
-    #         logging.error(e)
-    #         continue
-    # if len(results) == 0:
-    #     raise Exception("Cannot get action params")
-    results = []
-    threads = []
-    for i in range(ensemble_size):
-        def _get_action_params():
-            try:
-                results.append(get_action_params(messages, action))
-            except Exception as e:
-                logging.error(e)
-        thread = threading.Thread(target=_get_action_params)
-        thread.start()
-        threads.append(thread)
-    for thread in threads:
-        thread.join()
-
-    # filter out None
-    results = [result for result in results if result is not None]
-
-    if len(results) == 0:
-        raise Exception("Cannot get action params")
-    
-    # get most common result
-    # make sure results hashable using json
-    logging.info(f"All {ensemble_size} results: {results}")
-    hash_results = [json.dumps(result, sort_keys=True) for result in results]
-    result = max(set(hash_results), key=hash_results.count)
-    result = json.loads(result)
-    logging.info(f"Most common result: {result}")
-    
-    return result
-    
 
 def get_action_params(
         messages: List[Dict[str, str]],
@@ -102,13 +184,90 @@ def get_action_params(
             "group_name": None, # group name can be None
         }
     """
+    params = _extract_action_params(messages, action)
+    if _needs_category(params, action):
+        params["category"] = _categorize(messages, params)
+    return params
+
+
+async def aget_action_params(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+    ) -> Union[Dict[str, str], str]:
+    """
+    Async variant of `get_action_params`.
+    """
+    params = await _aextract_action_params(messages, action)
+    if _needs_category(params, action):
+        params["category"] = await _acategorize(messages, params)
+    return params
+
+
+@tracing.traced("action_params")
+def _extract_action_params(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+    ) -> Union[Dict[str, str], str]:
+    """
+    Extract action parameters, without the transaction category.
+    """
     assert action in ["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"], f"Invalid action: {action}"
-    messages = messages[-5:]
-    params = {}
-    if action == "TRANSFER":
-        conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
-        last_user = messages[-1]['user']
-        model_input = f"""This is a financial assistant system that can TRANSFER money when user request. English and Vietnamese are supported. System's action syntax is: TRANSFER[<receiver>,<amount>|<message>]. Note that money abbreviation should be expanded without comma or dot. E.g. (30k=30000, 24tr=24000000, 5 nghìn=5000, tám chục nghìn=80000).
+    model_input, max_tokens = _get_action_model_input(messages, action)
+    log_prompt("Model input", model_input)
+    output = generate_general_call_chatgpt_api(
+        inputs=model_input,
+        temperature=0,
+        max_tokens=max_tokens,
+    )
+    log_prompt("Model output", output)
+    return _parse_action_output(output, action)
+
+
+@tracing.traced("action_params")
+async def _aextract_action_params(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+    ) -> Union[Dict[str, str], str]:
+    assert action in ["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"], f"Invalid action: {action}"
+    model_input, max_tokens = _get_action_model_input(messages, action)
+    log_prompt("Model input", model_input)
+    output = await agenerate_general_call_chatgpt_api(
+        inputs=model_input,
+        temperature=0,
+        max_tokens=max_tokens,
+    )
+    log_prompt("Model output", output)
+    return _parse_action_output(output, action)
+
+
+@tracing.traced("category")
+def _categorize(messages: List[Dict[str, str]], params: Dict[str, str]) -> str:
+    model_input = _get_category_model_input(messages[-1], params)
+    log_prompt("Model input", model_input)
+    output = generate_general_call_chatgpt_api(
+        inputs=model_input,
+        temperature=0,
+        max_tokens=4,
+    )
+    log_prompt("Model output", output)
+    return _parse_category(output)
+
+
+@tracing.traced("category")
+async def _acategorize(messages: List[Dict[str, str]], params: Dict[str, str]) -> str:
+    model_input = _get_category_model_input(messages[-1], params)
+    log_prompt("Model input", model_input)
+    output = await agenerate_general_call_chatgpt_api(
+        inputs=model_input,
+        temperature=0,
+        max_tokens=4,
+    )
+    log_prompt("Model output", output)
+    return _parse_category(output)
+
+
+# static instructions of the prompts, their attention cache is reused by the self-hosted model
+TRANSFER_INSTRUCTIONS = register_prompt_prefix("""This is a financial assistant system that can TRANSFER money when user request. English and Vietnamese are supported. System's action syntax is: TRANSFER[<receiver>,<amount>|<message>]. Note that money abbreviation should be expanded without comma or dot. E.g. (30k=30000, 24tr=24000000, 5 nghìn=5000, tám chục nghìn=80000).
 System will first output "REASONING: <thinking about user's intention, between 3 to 5 sentences, and analyze each param 'receiver', 'amount', and 'message'>". Then, system will output "CHECKLIST: " and then including reason with a tick to the checklist for each param:
 receiver (need to be real username) [ ]
 amount (need to be number) [ ]
@@ -117,17 +276,68 @@ Then, if any of the above param is missing, e.g. user did not explicitly mention
 If RESULT is NOT_ENOUGH_PARAMS, then system will output a response "RESPONSE: ..." asking user to provide more information. Note that system should response in the same language as User's question.
 If RESULT is ENOUGH_PARAMS, then system will output the system action "ACTION: TRANSFER[...]"
 -- Conversation --
-{conversation}
+""")
+CREATE_CHAT_GROUP_INSTRUCTIONS = register_prompt_prefix("""This is an assistant system that can CREATE_CHAT_GROUP when user request. English and Vietnamese are supported. System's action syntax is: CREATE_CHAT_GROUP[<user_comma_separated>|<group_name (nullable)>]. System will first output "REASONING: <thinking about user's intention, between 30-50 words, and analyze each param 'user_comma_separated' and 'group_name'>". Then, system will output "CHECKLIST: " and then including reason with a tick to the checklist for each param: 
+user_comma_separated (need to be a list of username with comma separated) [ ]
+group_name (Did user explicitly mention the group name?) [ ]
+Then, if user did not explicitly mention the list of users, then system will follows with "RESULT: NO_USERS". "OK" otherwise.
+If RESULT is NO_USERS, then system will output a response "RESPONSE: ..." asking user to provide user list. Note that system should response in the same language as User's question.
+If RESULT is OK, then system will output the system action "ACTION: CREATE_CHAT_GROUP[...]"
+-- Conversation --
+""")
+TRANSFER_TO_EACH_USERS_INSTRUCTIONS = register_prompt_prefix("""This is a financial assistant system that can TRANSFER_TO_EACH_USERS money when user request. English and Vietnamese are supported. System's action syntax is: TRANSFER_TO_EACH_USERS[<amount>|<message>]. Note that money abbreviation should be expanded without comma or dot. E.g. (30k=30000, 24tr=24000000, 5 nghìn=5000, tám chục nghìn=80000).
+System will first output "REASONING: <thinking about user's intention, between 30-50 words, and analyze each param 'amount' and 'message'>". Then, system will output "CHECKLIST: " and then including reason with a tick to the checklist for each param:
+amount (need to be number) [ ]
+message (Is the purpose of the transaction specified?) [ ]
+Then, if any of the param is missing, e.g. user did not explicitly mention the transaction purpose, then system will follows with "RESULT: NOT_ENOUGH_PARAMS". "ENOUGH_PARAMS" otherwise.
+If RESULT is NOT_ENOUGH_PARAMS, then system will output a response "RESPONSE: ..." asking user to provide more information. Note that system should response in the same language as User's question.
+If RESULT is ENOUGH_PARAMS, then system will output the system action "ACTION: TRANSFER_TO_EACH_USERS[...]"
+REASONING:-- Conversation --
+""")
+
+
+def _get_action_model_input(
+        messages: List[Dict[str, str]],
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+    ) -> Tuple[str, int]:
+    """
+    Build the model input of the parameter extraction call.
+
+    Returns:
+        model_input (str): Prompt to send to the model.
+        max_tokens (int): Max tokens of the completion.
+    """
+    messages = messages[-5:]
+    conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
+    last_user = messages[-1]['user']
+    if action == "TRANSFER":
+        model_input = TRANSFER_INSTRUCTIONS + f"""{conversation}
+-- System analyzing {last_user}'s request --
+REASONING:"""
+        return model_input, 512
+    elif action == "CREATE_CHAT_GROUP":
+        model_input = CREATE_CHAT_GROUP_INSTRUCTIONS + f"""{conversation}
 -- System analyzing {last_user}'s request --
 REASONING:"""
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            max_tokens=512,
-        )
-        logging.info(f"Model output: \n{output}")
+        return model_input, 256
+    elif action == "TRANSFER_TO_EACH_USERS":
+        model_input = TRANSFER_TO_EACH_USERS_INSTRUCTIONS + f"""{conversation}
+-- System analyzing {last_user}'s request --
+REASONING:"""
+        return model_input, 256
+    raise ValueError(f"Invalid action: {action}")
+
 
+def _parse_action_output(
+        output: str,
+        action: Literal["TRANSFER", "CREATE_CHAT_GROUP", "TRANSFER_TO_EACH_USERS"],
+    ) -> Union[Dict[str, str], str]:
+    """
+    Parse the output of the parameter extraction call, without the transaction category.
+    Return the response message (str) asking for more information if the parameters are not enough.
+    """
+    params = {}
+    if action == "TRANSFER":
         result = re.search(r"RESULT: (.*)", output).group(1)
         if result == "NOT_ENOUGH_PARAMS":   
             return re.search(r"RESPONSE: (.*)", output).group(1)
@@ -145,49 +355,9 @@ REASONING:"""
             # return "Bạn cần nhập thêm nội dung chuyển khoản."
         else:
             params["msg"] = msg
-        
-        message = messages[-1]
-        # category
-        model_input = f"""This is a financial assistant system that can detect the category of transaction when user request. System should devide transaction into 5 categories: Food, Shopping, Entertainment, Utility, and Other.
-        User: {message['content']}
-        System action: {params}
-        Category: """
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            max_tokens=4,
-        )
-        logging.info(f"Model output: \n{output}")
-        category = " ".join(output.split())
-        params["category"] = category
-        logging.info(f"Categorize transaction: {category}")
-        if category not in ["Food", "Shopping", "Entertainment", "Utility", "Other"]:
-            logging.warning(f"Invalid category: {category}")
-            params["category"] = "Other"
         return params
 
     elif action == "CREATE_CHAT_GROUP":
-        conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
-        last_user = messages[-1]['user']
-        model_input = f"""This is an assistant system that can CREATE_CHAT_GROUP when user request. English and Vietnamese are supported. System's action syntax is: CREATE_CHAT_GROUP[<user_comma_separated>|<group_name (nullable)>]. System will first output "REASONING: <thinking about user's intention, between 30-50 words, and analyze each param 'user_comma_separated' and 'group_name'>". Then, system will output "CHECKLIST: " and then including reason with a tick to the checklist for each param: 
-user_comma_separated (need to be a list of username with comma separated) [ ]
-group_name (Did user explicitly mention the group name?) [ ]
-Then, if user did not explicitly mention the list of users, then system will follows with "RESULT: NO_USERS". "OK" otherwise.
-If RESULT is NO_USERS, then system will output a response "RESPONSE: ..." asking user to provide user list. Note that system should response in the same language as User's question.
-If RESULT is OK, then system will output the system action "ACTION: CREATE_CHAT_GROUP[...]"
--- Conversation --
-{conversation}
--- System analyzing {last_user}'s request --
-REASONING:"""
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            max_tokens=256,
-        )
-        logging.info(f"Model output: \n{output}")
-
         result = re.search(r"RESULT: (.*)", output).group(1)
         if result == "NO_USERS":   
             return re.search(r"RESPONSE: (.*)", output).group(1)
@@ -203,29 +373,9 @@ REASONING:"""
             params["group_name"] = None
         else:
             params["group_name"] = group_name
+        return params
 
     elif action == "TRANSFER_TO_EACH_USERS":
-        conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
-        last_user = messages[-1]['user']
-        model_input = f"""This is a financial assistant system that can TRANSFER_TO_EACH_USERS money when user request. English and Vietnamese are supported. System's action syntax is: TRANSFER_TO_EACH_USERS[<amount>|<message>]. Note that money abbreviation should be expanded without comma or dot. E.g. (30k=30000, 24tr=24000000, 5 nghìn=5000, tám chục nghìn=80000).
-System will first output "REASONING: <thinking about user's intention, between 30-50 words, and analyze each param 'amount' and 'message'>". Then, system will output "CHECKLIST: " and then including reason with a tick to the checklist for each param:
-amount (need to be number) [ ]
-message (Is the purpose of the transaction specified?) [ ]
-Then, if any of the param is missing, e.g. user did not explicitly mention the transaction purpose, then system will follows with "RESULT: NOT_ENOUGH_PARAMS". "ENOUGH_PARAMS" otherwise.
-If RESULT is NOT_ENOUGH_PARAMS, then system will output a response "RESPONSE: ..." asking user to provide more information. Note that system should response in the same language as User's question.
-If RESULT is ENOUGH_PARAMS, then system will output the system action "ACTION: TRANSFER_TO_EACH_USERS[...]"
-REASONING:-- Conversation --
-{conversation}
--- System analyzing {last_user}'s request --
-REASONING:"""
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            max_tokens=256,
-        )
-        logging.info(f"Model output: \n{output}")
-
         result = re.search(r"RESULT: (.*)", output).group(1)
         if result == "NOT_ENOUGH_PARAMS":   
             return re.search(r"RESPONSE: (.*)", output).group(1)
@@ -239,28 +389,25 @@ REASONING:"""
             raise Exception("Transaction message is empty")
         else:
             params["msg"] = msg
+        return params
+    return params
+
 
-        message = messages[-1]
-        # category
-        model_input = f"""This is a financial assistant system that can detect the category of transaction when user request. System should devide transaction into 5 categories: Food, Shopping, Entertainment, Utility, and Other.
+def _get_category_model_input(message: Dict[str, str], params: Dict[str, str]) -> str:
+    model_input = f"""This is a financial assistant system that can detect the category of transaction when user request. System should devide transaction into 5 categories: Food, Shopping, Entertainment, Utility, and Other.
         User: {message['content']}
         System action: {params}
         Category: """
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            max_tokens=4,
-        )
-        logging.info(f"Model output: \n{output}")
-        category = " ".join(output.split())
-        params["category"] = category
-        logging.info(f"Categorize transaction: {category}")
-        if category not in ["Food", "Shopping", "Entertainment", "Utility", "Other"]:
-            logging.warning(f"Invalid category: {category}")
-            params["category"] = "Other"
-        return params
-    return params
+    return model_input
+
+
+def _parse_category(output: str) -> str:
+    category = " ".join(output.split())
+    logging.info(f"Categorize transaction: {category}")
+    if category not in ["Food", "Shopping", "Entertainment", "Utility", "Other"]:
+        logging.warning(f"Invalid category: {category}")
+        category = "Other"
+    return category
 
 
 if __name__ == "__main__":
@@ -3,13 +3,14 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import re
-from typing import List, Literal, Dict, Union, Any, Tuple
+from typing import List, Literal, Dict, Union, Any, Tuple, Generator
 from utils.model_api import generate_general_call_chatgpt_api
 from utils.logger import setup_logging_display_only, print
-from models.translator import convert_answer_language_to_same_as_question, batch_convert_answer_language_to_same_as_question
+from src.models.translation_memory import register_static_texts
+from src.models.translator import detect_language_of, convert_answer_language_to_same_as_question, batch_convert_answer_language_to_same_as_question, aconvert_answer_language_to_same_as_question, abatch_convert_answer_language_to_same_as_question
+import asyncio
 import logging
 from expert_system import loan, money_management, economical
-from models.langchain import advisor
 
 VIETNAMESE_MODE = True
 
@@ -43,6 +44,13 @@ How can I help you today?
 
 Tôi có thể giúp gì cho bạn hôm nay?
 """
+INTRODUCTION_SUGGESTIONS = [
+    "Tôi muốn kiểm tra số dư tài khoản",
+    "Tôi muốn chuyển 30k cho Minh",
+    "Tôi muốn tạo nhóm chat với Hùng và Cường",
+    "Tôi muốn được tư vấn tài chính"
+]
+register_static_texts([INTRODUCTION, *INTRODUCTION_SUGGESTIONS], language="VIETNAMESE" if VIETNAMESE_MODE else "ENGLISH")
 
 def match_question(messages) -> Tuple[Union[str, None], List[str]]:
     response = None
@@ -68,6 +76,54 @@ def match_question(messages) -> Tuple[Union[str, None], List[str]]:
 
     return response, suggestions
 
+async def amatch_question(messages) -> Tuple[Union[str, None], List[str]]:
+    """
+    Async variant of `match_question`. The response and the suggestions are translated concurrently.
+    """
+    response = None
+    suggestions = None
+
+    if money_management.is_money_management_question(messages):
+        logging.info("Money management question detected")
+        response, suggestions = await asyncio.to_thread(money_management.money_management_suggestion, messages)
+    elif economical.is_economical_question(messages):
+        logging.info("Economical question detected")
+        response, suggestions = await asyncio.to_thread(economical.economical_suggestion, messages)
+
+    logging.info("No pre-defined question matched")
+    if response is not None:
+        response, suggestions = await asyncio.gather(
+            aconvert_answer_language_to_same_as_question(question=messages[-1]['content'], answer=response),
+            abatch_convert_answer_language_to_same_as_question(question=messages[-1]['content'], answers=suggestions),
+        )
+
+    return response, suggestions
+
+def stream_match_question(messages) -> Generator[str, None, Tuple[Union[str, None], List[str]]]:
+    """
+    Streaming variant of `match_question`. The pre-defined scripts answer in Vietnamese, so the response is
+    only streamed to Vietnamese questions; other questions wait for the translated response.
+    """
+    if detect_language_of(messages[-1]['content']) != 'VIETNAMESE':
+        return match_question(messages)
+
+    response = None
+    suggestions = None
+
+    if money_management.is_money_management_question(messages):
+        logging.info("Money management question detected")
+        response, suggestions = yield from money_management.stream_money_management_suggestion(messages)
+    elif economical.is_economical_question(messages):
+        logging.info("Economical question detected")
+        response, suggestions = yield from economical.stream_economical_suggestion(messages)
+
+    logging.info("No pre-defined question matched")
+    if response is not None:
+        response = convert_answer_language_to_same_as_question(question=messages[-1]['content'], answer=response)
+        suggestions = batch_convert_answer_language_to_same_as_question(question=messages[-1]['content'], answers=suggestions)
+
+    return response, suggestions
+
 def ask_assistant(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
     """
     Ask assistant for help.
@@ -111,12 +167,7 @@ def ask_assistant(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
         >>> print(response)
     """
     if len(messages) == 0:
-        return INTRODUCTION, [
-            "Tôi muốn kiểm tra số dư tài khoản",
-            "Tôi muốn chuyển 30k cho Minh",
-            "Tôi muốn tạo nhóm chat với Hùng và Cường",
-            "Tôi muốn được tư vấn tài chính"
-        ]
+        return INTRODUCTION, INTRODUCTION_SUGGESTIONS
     
     response, suggestions = match_question(messages)
 
@@ -127,13 +178,71 @@ def ask_assistant(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
         return general_suggestion(messages)
 
 
+async def aask_assistant(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
+    """
+    Async variant of `ask_assistant`.
+    """
+    if len(messages) == 0:
+        return ask_assistant(messages)
+
+    response, suggestions = await amatch_question(messages)
+
+    if response is not None:
+        return response, suggestions
+    else:
+        # above cases all failed
+        return await ageneral_suggestion(messages)
+
+
+def stream_ask_assistant(messages: List[Dict[str, str]]) -> Generator[str, None, Tuple[str, List[str]]]:
+    """
+    Streaming variant of `ask_assistant`, yields the response deltas and returns the whole response and the suggestions.
+    The whole response may differ from the concatenated deltas after post-processing (e.g. translation), and replaces them.
+    """
+    if len(messages) == 0:
+        return ask_assistant(messages)
+
+    response, suggestions = yield from stream_match_question(messages)
+
+    if response is not None:
+        return response, suggestions
+    else:
+        # above cases all failed
+        return (yield from stream_general_suggestion(messages))
+
+
 def general_suggestion(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
     """
     Suggest general advice
     """
     messages = messages[-4:]
+    # imported on first use, LangChain alone takes seconds to import
+    from src.models.langchain import advisor
+
     output = advisor.ask(messages)
     return output, []
+
+
+async def ageneral_suggestion(messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
+    """
+    Async variant of `general_suggestion`. The LangChain agent runs in a worker thread, since its tools are synchronous.
+    """
+    messages = messages[-4:]
+    from src.models.langchain import advisor
+
+    output = await asyncio.to_thread(advisor.ask, messages)
+    return output, []
+
+
+def stream_general_suggestion(messages: List[Dict[str, str]]) -> Generator[str, None, Tuple[str, List[str]]]:
+    """
+    Streaming variant of `general_suggestion`, yields the tokens of the advisor's final answer.
+    """
+    messages = messages[-4:]
+    from src.models.langchain import advisor
+
+    output = yield from advisor.stream_ask(messages)
+    return output, []
     
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+import threading
+from typing import List, Dict, Tuple, Optional, Any
+from dotenv import load_dotenv
+load_dotenv()
+
+INTENT_CLASSIFIER_PATH = os.getenv("INTENT_CLASSIFIER_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_classifier.joblib")
+INTENT_CLASSIFIER_THRESHOLD = float(os.getenv("INTENT_CLASSIFIER_THRESHOLD") or 0.9)
+SEED_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_seed.jsonl")
+
+_classifier = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def get_features(messages: List[Dict[str, str]]) -> str:
+    """
+    Text fed to the classifier: the last message, lowercased with whitespaces normalized.
+
+    Example:
+        >>> get_features([{"user": "Minh", "content": "Chuyển  300k cho Nam"}])
+        'chuyển 300k cho nam'
+    """
+    return " ".join(messages[-1]['content'].lower().split())
+
+
+def is_reply_to_assistant(messages: List[Dict[str, str]]) -> bool:
+    """
+    Whether the last message answers the assistant, whose meaning depends on the assistant's question.
+
+    Example:
+        >>> is_reply_to_assistant([{"user": "assistant", "content": "Bạn có muốn lập kế hoạch không?"}, {"user": "Minh", "content": "ok"}])
+        True
+    """
+    return len(messages) > 1 and messages[-2]['user'].lower() == 'assistant'
+
+
+def build_classifier():
+    """
+    Char n-gram TF-IDF followed by a logistic regression, small enough to answer in a few milliseconds on CPU.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+
+    return Pipeline([
+        ("tfidf", TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 4), sublinear_tf=True, min_df=1)),
+        ("clf", LogisticRegression(C=100.0, max_iter=1000, class_weight="balanced")),
+    ])
+
+
+def load_samples(path: str) -> List[Dict[str, Any]]:
+    """
+    Load labeled samples from a JSONL file, one `{"messages": [...], "intent": "..."}` per line.
+    """
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(json.loads(line))
+    return samples
+
+
+def train(samples: List[Dict[str, Any]]):
+    classifier = build_classifier()
+    classifier.fit(
+        [get_features(sample['messages']) for sample in samples],
+        [sample['intent'] for sample in samples],
+    )
+    return classifier
+
+
+def save(classifier, path: str = INTENT_CLASSIFIER_PATH) -> None:
+    import joblib
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(classifier, path)
+
+
+def get_classifier():
+    """
+    Load the trained classifier once, or train it on the seed examples when none was saved (e.g. `src` mounted in a container).
+    Returns None when it can be neither loaded nor trained, which disables the fast path.
+    """
+    global _classifier, _classifier_loaded
+    if _classifier_loaded:
+        return _classifier
+    with _classifier_lock:
+        if not _classifier_loaded:
+            if os.path.isfile(INTENT_CLASSIFIER_PATH):
+                try:
+                    import joblib
+
+                    _classifier = joblib.load(INTENT_CLASSIFIER_PATH)
+                    logging.info(f"Loaded intent classifier from {INTENT_CLASSIFIER_PATH}")
+                except Exception as e:
+                    logging.warning(f"Cannot load intent classifier from {INTENT_CLASSIFIER_PATH}: {e}")
+            else:
+                try:
+                    _classifier = train(load_samples(SEED_DATA_PATH))
+                    logging.warning(f"Missing intent classifier at {INTENT_CLASSIFIER_PATH}, trained it on the seed examples")
+                except Exception as e:
+                    logging.warning(f"Missing intent classifier at {INTENT_CLASSIFIER_PATH}, always calling the model: {e}")
+            _classifier_loaded = True
+    return _classifier
+
+
+def predict(messages: List[Dict[str, str]], classifier=None) -> Tuple[Optional[str], float]:
+    """
+    Predict user's intention locally.
+
+    Returns:
+        intent (str): Most likely intention, None if no classifier is available.
+        confidence (float): Probability of the predicted intention.
+    """
+    classifier = classifier if classifier is not None else get_classifier()
+    if classifier is None or len(messages) == 0:
+        return None, 0.0
+    probabilities = classifier.predict_proba([get_features(messages)])[0]
+    best = probabilities.argmax()
+    return classifier.classes_[best], float(probabilities[best])
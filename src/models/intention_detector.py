@@ -2,15 +2,66 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from typing import List, Literal, Dict, Union, Any, Tuple
-from utils.model_api import generate_general_call_chatgpt_api
+from typing import List, Literal, Dict, Union, Any, Tuple, Optional
+from utils.model_api import generate_general_call_chatgpt_api, agenerate_general_call_chatgpt_api
 from utils.logger import setup_logging_display_only, print
+from src.models import intent_classifier
+from src.utils import metrics, tracing
+from src.utils.logger import log_prompt
+import threading
 import logging
+import json
 import re
 
 PROMPT = """This is a user's intention detecting system. This system is able to detect intention of users in conversation history and direct message. English and Vietnamese are supported. There are 6 possible user's intentions: CHECK_BALANCE, VIEW_USER_ACCOUNT_REPORT, TRANSFER, TRANSFER_TO_EACH_USERS, CREATE_CHAT_GROUP, ASK_ASSISTANT, NO_SYSTEM_ACTION"""
 # Minh: Tao muốn chuyển khoản cho Nam 300k.
 # Minh's intention: TRANSFER"""
+INTENTS = ["CHECK_BALANCE", "VIEW_USER_ACCOUNT_REPORT", "TRANSFER", "TRANSFER_TO_EACH_USERS", "CREATE_CHAT_GROUP", "ASK_ASSISTANT", "NO_SYSTEM_ACTION"]
+# what a VIEW_USER_ACCOUNT_REPORT is about, only the user's own account is an action (see `_resolve_intent`)
+REPORT_FLAGS = ["own_account", "other_user", "external_company"]
+OUTPUT_FORMAT = """The intention is output as JSON on one line, with 3 flags telling whether the user wants to view their own account report or mentions the owner of the account (own_account), wants to view the account report of another user they explicitly name (other_user), or wants to view an external report about a company in the world (external_company).
+Lan: Cho tao xem báo cáo tài khoản tháng này
+Lan's intention: {"intent": "VIEW_USER_ACCOUNT_REPORT", "own_account": true, "other_user": false, "external_company": false}
+Lan: Báo cáo tài chính của Apple năm nay thế nào?
+Lan's intention: {"intent": "VIEW_USER_ACCOUNT_REPORT", "own_account": false, "other_user": false, "external_company": true}
+Lan: Chuyển cho Nam 200k
+Lan's intention: {"intent": "TRANSFER", "own_account": false, "other_user": false, "external_company": false}"""
+# the output is constrained by starting the JSON object in the prompt and stopping at its end
+OUTPUT_PREFIX = '{"intent": "'
+INTENT_COMPLETION = dict(temperature=0, top_p=1.0, max_tokens=40, stop=("}",))
+
+# labeled conversations from the model, used to train the local intent classifier
+INTENT_LOG_PATH = os.getenv("INTENT_LOG_PATH")
+_intent_log_lock = threading.Lock()
+metrics.describe('intent_detection_total', 'Intention detections, by source (local classifier or model).')
+
+# cheap keyword rules, used to start parameter extraction before the real intention is known
+KEYWORD_RULES = [
+    ("CREATE_CHAT_GROUP", re.compile(r"(nhóm chat|group chat|chat group|tạo nhóm|tạo group|create (a )?group)")),
+    ("TRANSFER_TO_EACH_USERS", re.compile(r"(chuyển|gửi|transfer|send|give).*(mỗi (người|đứa|cháu|bạn|thành viên)|mọi người|cả nhóm|each|everyone)")),
+    ("TRANSFER", re.compile(r"(chuyển|chuyen|gửi|transfer|send|give|ck)\b.*\d")),
+]
+
+def guess_user_intention(
+        messages: List[Dict[str, str]],
+    ) -> Optional[Literal["TRANSFER", "TRANSFER_TO_EACH_USERS", "CREATE_CHAT_GROUP"]]:
+    """
+    Guess user's intention from the last message with keyword rules only, without calling the model.
+    Only action intentions are guessed, since they are the ones worth starting parameter extraction early.
+
+    Example:
+        >>> guess_user_intention([{"user": "Minh", "content": "Chuyển 300k cho Nam tiền bún đậu"}])
+        'TRANSFER'
+        >>> guess_user_intention([{"user": "Minh", "content": "ok"}])
+    """
+    if len(messages) == 0:
+        return None
+    content = " ".join(messages[-1]['content'].lower().split())
+    for intent, pattern in KEYWORD_RULES:
+        if pattern.search(content):
+            return intent
+    return None
+
 
 def dectect_user_intention(
         messages: List[Dict[str, str]],
@@ -33,73 +84,118 @@ def dectect_user_intention(
     """
     assert len(messages) > 0, "Conversation history must not be empty."
     messages = messages[-5:]
+    intent = _detect_user_intention_locally(messages)
+    if intent is not None:
+        return intent
+
+    model_input = _get_intention_model_input(messages)
+    log_prompt("Model input", model_input)
+    with tracing.span("intent"):
+        output = generate_general_call_chatgpt_api(inputs=model_input, **INTENT_COMPLETION)
+    return _get_intention_from_output(messages, output)
+
+
+async def adectect_user_intention(
+        messages: List[Dict[str, str]],
+    ) -> Literal["CHECK_BALANCE", "VIEW_USER_ACCOUNT_REPORT", "TRANSFER", "TRANSFER_TO_EACH_USERS", "CREATE_CHAT_GROUP", "ASK_ASSISTANT", "NO_SYSTEM_ACTION"]:
+    """
+    Async variant of `dectect_user_intention`.
+    """
+    assert len(messages) > 0, "Conversation history must not be empty."
+    messages = messages[-5:]
+    intent = _detect_user_intention_locally(messages)
+    if intent is not None:
+        return intent
+
+    model_input = _get_intention_model_input(messages)
+    log_prompt("Model input", model_input)
+    with tracing.span("intent"):
+        output = await agenerate_general_call_chatgpt_api(inputs=model_input, **INTENT_COMPLETION)
+    return _get_intention_from_output(messages, output)
+
+
+def _get_intention_from_output(messages: List[Dict[str, str]], output: str) -> str:
+    """
+    Get the intention from the output of the model, shared by the sync and async detection.
+    """
+    log_prompt("Model output", output)
+    intent = _resolve_intent(_parse_intent(output))
+
+    _log_labeled_intention(messages, intent)
+    return intent
+
+
+@tracing.traced("intent_classifier")
+def _detect_user_intention_locally(messages: List[Dict[str, str]]) -> Optional[str]:
+    """
+    Answer with the local classifier when it is confident enough, None means the model has to be called.
+    VIEW_USER_ACCOUNT_REPORT is never answered locally, since it needs the flags of the model (see `_resolve_intent`).
+    Replies to the assistant (e.g. "ok" in the middle of a script) are not either, the classifier only sees the last message.
+    """
+    if intent_classifier.is_reply_to_assistant(messages):
+        logging.info("Reply to the assistant, calling the model")
+        metrics.increment('intent_detection_total', source='model')
+        return None
+    intent, confidence = intent_classifier.predict(messages)
+    if intent is None:
+        metrics.increment('intent_detection_total', source='model')
+        return None
+    if confidence < intent_classifier.INTENT_CLASSIFIER_THRESHOLD or intent == "VIEW_USER_ACCOUNT_REPORT":
+        logging.info(f"Local intent classifier not confident: {intent} ({confidence:.2f}), calling the model")
+        metrics.increment('intent_detection_total', source='model')
+        return None
+    logging.info(f"Local intent classifier: {intent} ({confidence:.2f})")
+    metrics.increment('intent_detection_total', source='local')
+    return intent
+
+
+def _log_labeled_intention(messages: List[Dict[str, str]], intent: str) -> None:
+    if not INTENT_LOG_PATH:
+        return
+    line = json.dumps({"messages": messages, "intent": intent}, ensure_ascii=False)
+    with _intent_log_lock:
+        with open(INTENT_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _get_intention_model_input(messages: List[Dict[str, str]]) -> str:
     conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
     last_user = messages[-1]['user']
-    model_input = f"{PROMPT}\n{conversation}\n{last_user}'s intention: "
-    logging.info(f"Model input: \n{model_input}")
-    output = generate_general_call_chatgpt_api(
-        inputs=model_input,
-        temperature=0,
-        top_p=1.0,
-        max_tokens=12,
-        stop=(r"]",),
-    )
-    intent = " ".join(output.split()).strip()
-    assert intent in ["CHECK_BALANCE", "VIEW_USER_ACCOUNT_REPORT", "TRANSFER", "TRANSFER_TO_EACH_USERS", "CREATE_CHAT_GROUP", "ASK_ASSISTANT", "NO_SYSTEM_ACTION"], f"Invalid intent: {intent}"
+    model_input = f"{PROMPT}\n{OUTPUT_FORMAT}\n---\n{conversation}\n{last_user}'s intention: {OUTPUT_PREFIX}"
+    return model_input
+
+
+def _parse_intent(output: str) -> Dict[str, Any]:
+    """
+    Parse the intention and its flags, the flags default to false for other intentions than VIEW_USER_ACCOUNT_REPORT.
+
+    Example:
+        >>> _parse_intent('VIEW_USER_ACCOUNT_REPORT", "own_account": true, "other_user": false, "external_company": false')
+        {'intent': 'VIEW_USER_ACCOUNT_REPORT', 'own_account': True, 'other_user': False, 'external_company': False}
+    """
+    # the stop sequence is not part of the output
+    output = f"{OUTPUT_PREFIX}{output.strip().rstrip('}')}}}"
+    try:
+        result = json.loads(output)
+    except json.JSONDecodeError:
+        raise AssertionError(f"Invalid intent: {output}")
+    assert isinstance(result, dict) and result.get("intent") in INTENTS, f"Invalid intent: {output}"
+    for flag in REPORT_FLAGS:
+        if result["intent"] == "VIEW_USER_ACCOUNT_REPORT":
+            assert isinstance(result.get(flag), bool), f"Invalid {flag}: {output}"
+        result[flag] = result.get(flag) is True
+    return {key: result[key] for key in ["intent"] + REPORT_FLAGS}
+
 
+def _resolve_intent(result: Dict[str, Any]) -> str:
+    """
+    Keep VIEW_USER_ACCOUNT_REPORT only when the user asks about their own account, and not about another user or a company.
+    """
+    intent = result["intent"]
     if intent == "VIEW_USER_ACCOUNT_REPORT":
-        conversation = "\n".join([f"{' '.join(message['user'].split())}: {' '.join(message['content'].split())}" for message in messages])
-        last_user = messages[-1]['user']
-        model_input = f"""{conversation}
-{last_user}'s intention: {intent}
-
-Critique Request: 
-Is {last_user} want to view his/her own account report or Is he/she mention the owner of the account? []
-Is {last_user} want to view other user's account report and explicitly mention their name? []
-Is {last_user} want to view external report about any companies in the world? []
-
-System should output "Reasoning: " in 2-3 sentences, then output the above checklist "Checklist: " and tick them by [x] or [ ], and then conclude the revision by "Conclusion: " + "Correct" or "Incorrect"
-
---- System's Analyzing ---
-Reasoning:"""
-        logging.info(f"Model input: \n{model_input}")
-        output = generate_general_call_chatgpt_api(
-            inputs=model_input,
-            temperature=0,
-            top_p=1.0,
-            max_tokens=512,
-        )
-        logging.info(f"Model output: \n{output}")
-        out = " ".join(output.split()).strip()
-        conclusion = re.search(r"Conclusion: (.*)", out)
-        tick1 = True
-        # if out.startswith("[ ]") or out.startswith("[]"):
-        if f"Is {last_user} want to view his/her own account report? Is he/she mention the owner of the account? []" in out \
-            or f"Is {last_user} want to view his/her own account report? Is he/she mention the owner of the account? [ ]" in out:
-            tick1 = False
-        tick2 = True
-        # tick2_context = re.search(r"account report and explicitly mention their name\? \[(.*)\]", out)
-        # print(tick2_context)
-        if f"Is {last_user} want to view other user's account report and explicitly mention their name? []" in out \
-            or f"Is {last_user} want to view other user's account report and explicitly mention their name? [ ]" in out:
-            # print(f'group(0): {tick2_context.group(0)}'
-                    # f'group(1): {tick2_context.group(1)}')
-            # tick2 = False if tick2_context.group(0) == " " or tick2_context.group(0) == "" else True
-            tick2 = False
-        tick3 = True
-        # tick3_context = re.search(r"any companies in the world\? \[(.*)\]", out)
-        # print(tick3_context)
-        if f"Is {last_user} want to view external report about any companies in the world? []" in out \
-            or f"Is {last_user} want to view external report about any companies in the world? [ ]" in out:
-            # tick3 = False if tick3_context.group(0) == " " or tick3_context.group(0) == "" else True
-            tick3 = False
-        logging.info(f"tick1: {tick1}, tick2: {tick2}, tick3: {tick3}")
-        if tick1 and not tick2 and not tick3:
-            logging.info(f"Ticked 1st checkbox, unticked 2nd and 3rd checkboxes, conclusion: Correct")
-            intent = "VIEW_USER_ACCOUNT_REPORT"
-        else:
+        logging.info(f"own_account: {result['own_account']}, other_user: {result['other_user']}, external_company: {result['external_company']}")
+        if not result["own_account"] or result["other_user"] or result["external_company"]:
             intent = "NO_SYSTEM_ACTION"
-            
     return intent
 
 
@@ -10,17 +10,23 @@ from langchain.llms import OpenAI
 from langchain.chains import LLMMathChain, LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.tools import tool
-from typing import List, Dict, Any, Union, Literal, Tuple, Optional
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.streaming_stdout_final_only import FinalStreamingStdOutCallbackHandler
+from typing import List, Dict, Any, Union, Literal, Tuple, Optional, Generator
+from queue import Queue
+import logging
+import threading
 from src.stocks import portfolios
 from src.models import translator
+from src.utils import semantic_cache, tracing
+from src.utils.executor import submit
+from src.utils.logger import print
 
-llm = OpenAI(
-    temperature=0,
-    model_name="text-davinci-003",
-    openai_api_key=os.getenv("OPENAI_API_KEYS").split(',')[0],
-)
+# top portfolios change during the day, do not serve them from the semantic cache for long
+TOP_PORTFOLIOS_CACHE_TTL = int(os.getenv("TOP_PORTFOLIOS_CACHE_TTL") or 15 * 60)
 
-tools = load_tools(["serpapi", "llm-math"], llm=llm)
+_agent = None
+_agent_lock = threading.Lock()
 
 # llm_chain = LLMChain(llm=llm, prompt=PromptTemplate(
 #     input_variables=["query"],
@@ -49,24 +55,143 @@ def get_top_portfolios(top_trending: str) -> str:
 #     """Useful for getting current top stocks."""
 #     return "top stocks"
 
-# tools.append(compare_stock)
-tools.append(get_top_portfolios)
-# tools.append(get_top_stocks)
 
-agent = initialize_agent(
-    tools,
-    llm,
-    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    verbose=True,
-    max_iterations=5,
-)
+def get_agent():
+    """
+    Build the LLM, its tools and the agent on first use, so that importing the app stays fast.
+    """
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                llm = OpenAI(
+                    temperature=0,
+                    model_name="text-davinci-003",
+                    # tokens are only forwarded by `stream_ask`, `ask` still gets the whole answer
+                    streaming=True,
+                    openai_api_key=os.getenv("OPENAI_API_KEYS").split(',')[0],
+                )
+                tools = load_tools(["serpapi", "llm-math"], llm=llm)
+                # tools.append(compare_stock)
+                tools.append(get_top_portfolios)
+                # tools.append(get_top_stocks)
+                agent = initialize_agent(
+                    tools,
+                    llm,
+                    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                    verbose=True,
+                    max_iterations=5,
+                )
+                logging.debug(f"Agent prompt: \n{agent.agent.llm_chain.prompt.template}")
+                _agent = agent
+    return _agent
 
-print(agent.agent.llm_chain.prompt.template)
 
 def ask(messages: List[Dict[str, str]]) -> str:
     question = messages[-1]['content']
     print(f"Question: {question}")
-    answer = agent.run(question)
+    cache = semantic_cache.get_semantic_cache()
+    language = translator.detect_language_of(question) if cache is not None else None
+    if cache is not None:
+        answer = cache.get(question, namespace=language)
+        if answer is not None:
+            return answer
+
+    with tracing.span("advisor"):
+        answer = get_agent().run(question, callbacks=[AgentStepsTracingHandler()])
+    return _finalize_answer(question, answer, cache, language)
+
+
+def stream_ask(messages: List[Dict[str, str]]) -> Generator[str, None, str]:
+    """
+    Streaming variant of `ask`. Yields the tokens of the agent's final answer while it is generated,
+    tools returning directly (top portfolios) are yielded at once. Returns the whole answer.
+    """
+    question = messages[-1]['content']
+    print(f"Question: {question}")
+    cache = semantic_cache.get_semantic_cache()
+    language = translator.detect_language_of(question) if cache is not None else None
+    if cache is not None:
+        answer = cache.get(question, namespace=language)
+        if answer is not None:
+            yield answer
+            return answer
+
+    handler = FinalAnswerQueueHandler()
+    future = submit(get_agent().run, question, callbacks=[handler, AgentStepsTracingHandler()])
+    future.add_done_callback(lambda _: handler.tokens.put(None))
+    streamed = []
+    while True:
+        token = handler.tokens.get()
+        if token is None:
+            break
+        streamed.append(token)
+        yield token
+
+    answer = _finalize_answer(question, future.result(), cache, language)
+    if len(streamed) == 0:
+        yield answer
+    return answer
+
+
+class FinalAnswerQueueHandler(FinalStreamingStdOutCallbackHandler):
+    """
+    Put the tokens following "Final Answer:" into a queue instead of printing them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tokens: Queue = Queue()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.append_to_last_tokens(token)
+        if self.check_if_answer_reached():
+            self.answer_reached = True
+            return
+        if self.answer_reached:
+            self.tokens.put(token)
+
+
+class AgentStepsTracingHandler(BaseCallbackHandler):
+    """
+    Time each step of the agent (LLM calls and tools) as a tracing span.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.llm_span = None
+        self.tool_span = None
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.llm_span = tracing.start_span("advisor_llm")
+
+    def on_llm_end(self, response, **kwargs: Any) -> None:
+        if self.llm_span is None:
+            return
+        # streamed completions do not report their usage
+        usage = (response.llm_output or {}).get("token_usage", {})
+        self.llm_span.add_tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        tracing.finish_span(self.llm_span)
+        self.llm_span = None
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        if self.llm_span is not None:
+            tracing.finish_span(self.llm_span)
+            self.llm_span = None
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self.tool_span = tracing.start_span(f"advisor_tool:{serialized.get('name')}")
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        if self.tool_span is not None:
+            tracing.finish_span(self.tool_span)
+            self.tool_span = None
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self.on_tool_end("")
+
+
+def _finalize_answer(question: str, answer: Union[str, Tuple[str, str]], cache, language: Optional[str]) -> str:
     print(f"Type of answer: {type(answer)}")
     if isinstance(answer, tuple) and len(answer) > 0 and answer[0] is not None and answer[0] == 'Get Top Portfolios':
         print(f"Returning top portfolios: ...")
@@ -77,10 +202,13 @@ def ask(messages: List[Dict[str, str]]) -> str:
         #     title = translator.translate(title, src='ENGLISH', dest=translator.detect_language_of(question))
 
         result = f"{title}\n{answer[1]}"
+        if cache is not None:
+            cache.set(question, result, namespace=language, ttl=TOP_PORTFOLIOS_CACHE_TTL)
         return result
 
+    if cache is not None:
+        cache.set(question, answer, namespace=language)
     return answer
 
-
 if __name__ == "__main__":
     print(ask("Tôi muốn đầu tư lướt sóng, bạn có thể tư vấn cho tôi được không?"))
\ No newline at end of file
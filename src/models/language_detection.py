@@ -0,0 +1,175 @@
+import os
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Dict, Optional
+from lingua import Language, LanguageDetector, LanguageDetectorBuilder
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+LANGUAGES = [
+    Language.ENGLISH,
+    # Language.FRENCH, Language.GERMAN, Language.SPANISH,
+    Language.VIETNAMESE, Language.CHINESE, Language.JAPANESE, Language.KOREAN,
+    Language.INDONESIAN, Language.THAI, Language.HINDI, Language.ARABIC,
+    # Language.RUSSIAN, Language.PORTUGUESE, Language.ITALIAN, Language.TURKISH,
+    # Language.DUTCH, Language.POLISH, Language.SWEDISH, Language.DANISH,
+]
+# language of texts in which no language is detected, e.g. numbers or emojis only
+DEFAULT_LANGUAGE = Language.ENGLISH.name
+# only the beginning of long texts (answers) is looked at, their language does not change midway
+LANGUAGE_DETECTION_MAX_CHARS = int(os.getenv("LANGUAGE_DETECTION_MAX_CHARS") or 500)
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE") or 10000)
+# longer texts are only cached for the current request, so that answers do not evict the questions
+LANGUAGE_CACHE_MAX_TEXT = int(os.getenv("LANGUAGE_CACHE_MAX_TEXT") or 300)
+
+# letters with a diacritic only Vietnamese uses, among the Latin-script LANGUAGES (see `_VIETNAMESE_CHARS` in entities.py)
+_VIETNAMESE_CHARS = set(
+    "ăâđêôơưĂÂĐÊÔƠƯ"
+    "ạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ"
+    "ẠẢẤẦẨẪẬẮẰẲẴẶẸẺẼẾỀỂỄỆỈỊỌỎỐỒỔỖỘỚỜỞỠỢỤỦỨỪỬỮỰỲỴỶỸ"
+    "ĩũĨŨ"
+)
+# unicode ranges of the non-Latin scripts of LANGUAGES, a text mostly written in one of them is in its language
+_SCRIPTS = [
+    (0x3040, 0x30FF, Language.JAPANESE.name),  # hiragana, katakana
+    (0x31F0, 0x31FF, Language.JAPANESE.name),
+    (0xAC00, 0xD7AF, Language.KOREAN.name),  # hangul
+    (0x1100, 0x11FF, Language.KOREAN.name),
+    (0x3130, 0x318F, Language.KOREAN.name),
+    (0x4E00, 0x9FFF, Language.CHINESE.name),  # CJK ideographs, also used in Japanese
+    (0x3400, 0x4DBF, Language.CHINESE.name),
+    (0x0E00, 0x0E7F, Language.THAI.name),
+    (0x0900, 0x097F, Language.HINDI.name),  # devanagari
+    (0x0600, 0x06FF, Language.ARABIC.name),
+    (0x0750, 0x077F, Language.ARABIC.name),
+]
+
+metrics.describe('language_detection_total', 'Language detections, by method (request_cache, cache, script, diacritics or lingua).')
+
+_detector: Optional[LanguageDetector] = None
+_detector_lock = threading.Lock()
+_cache: "OrderedDict[str, str]" = OrderedDict()
+_cache_lock = threading.Lock()
+_request_cache: contextvars.ContextVar = contextvars.ContextVar("language_request_cache", default=None)
+
+
+def get_detector() -> LanguageDetector:
+    """
+    Build the lingua detector on first use, loading the models of all LANGUAGES at once.
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                # _detector = LanguageDetectorBuilder.from_all_languages().with_preloaded_language_models().build()
+                _detector = LanguageDetectorBuilder.from_languages(*LANGUAGES).with_preloaded_language_models().build()
+    return _detector
+
+
+def _script_of(char: str) -> Optional[str]:
+    code = ord(char)
+    if code < 0x0600:
+        return None
+    for start, end, language in _SCRIPTS:
+        if start <= code <= end:
+            return language
+    return None
+
+
+def detect_by_script(text: str) -> Optional[str]:
+    """
+    Detect the language from the script of the letters, without lingua.
+    Returns None for Latin text without Vietnamese diacritics, which only lingua can tell apart.
+
+    Example:
+        >>> detect_by_script("Tài khoản của tao còn bao nhiêu tiền?")
+        'VIETNAMESE'
+        >>> detect_by_script("東京に行きたい")
+        'JAPANESE'
+        >>> detect_by_script("Compare Bank of America and Apple") is None
+        True
+    """
+    letters = 0
+    vietnamese = 0
+    scripts: Dict[str, int] = {}
+    for char in text:
+        if not char.isalpha():
+            continue
+        letters += 1
+        if char in _VIETNAMESE_CHARS:
+            vietnamese += 1
+            continue
+        language = _script_of(char)
+        if language is not None:
+            scripts[language] = scripts.get(language, 0) + 1
+
+    non_latin = sum(scripts.values())
+    if non_latin * 2 > letters:
+        # kanji are counted as chinese, any kana makes it japanese
+        if scripts.get(Language.JAPANESE.name):
+            return Language.JAPANESE.name
+        return max(scripts, key=scripts.get)
+    # most Vietnamese words have a diacritic, a few of them are rather a loanword ("crêpe") in another language
+    if vietnamese * 20 >= letters and vietnamese > 0:
+        return Language.VIETNAMESE.name
+    return None
+
+
+def _detect(text: str) -> str:
+    language = detect_by_script(text)
+    if language is not None:
+        metrics.increment('language_detection_total', method='script' if language != Language.VIETNAMESE.name else 'diacritics')
+        return language
+    metrics.increment('language_detection_total', method='lingua')
+    language = get_detector().detect_language_of(text)
+    return language.name if language is not None else DEFAULT_LANGUAGE
+
+
+def start_request_cache() -> None:
+    """
+    Remember the languages detected while handling the current request, including the ones of long texts.
+    """
+    _request_cache.set({})
+
+
+def detect_language(text: str) -> str:
+    """
+    Detect the language of a text, as the name of a lingua `Language`.
+    Non-Latin scripts and Vietnamese diacritics are recognized directly, lingua is only used for the remaining Latin text.
+    Results are cached for the current request (see `start_request_cache`) and, for short texts, in a process-wide LRU.
+
+    Example:
+        >>> detect_language("Tạo kế hoạch ngân sách hàng tháng.")
+        'VIETNAMESE'
+        >>> detect_language("I own Amazon. What is their earning per share?")
+        'ENGLISH'
+    """
+    text = text[:LANGUAGE_DETECTION_MAX_CHARS]
+    request_cache = _request_cache.get()
+    if request_cache is not None and text in request_cache:
+        metrics.increment('language_detection_total', method='request_cache')
+        return request_cache[text]
+
+    cacheable = len(text) <= LANGUAGE_CACHE_MAX_TEXT
+    language = None
+    if cacheable:
+        with _cache_lock:
+            language = _cache.get(text)
+            if language is not None:
+                _cache.move_to_end(text)
+    if language is not None:
+        metrics.increment('language_detection_total', method='cache')
+    else:
+        language = _detect(text)
+        if cacheable:
+            with _cache_lock:
+                _cache[text] = language
+                if len(_cache) > LANGUAGE_CACHE_SIZE:
+                    _cache.popitem(last=False)
+
+    if request_cache is not None:
+        request_cache[text] = language
+    return language
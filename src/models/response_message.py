@@ -1,20 +1,22 @@
 from typing import List, Dict, Any, Union, Literal, Tuple, Optional
 from utils.logger import print
+from src.models.response_templates import format_amount, render
 import logging
 
 def get_response_message(
         params: Dict[str, str],
-        action: Literal['TRANSFER', 'TRANSFER_TO_EACH_USERS', 'CREATE_CHAT_GROUP']
+        action: Literal['TRANSFER', 'TRANSFER_TO_EACH_USERS', 'CREATE_CHAT_GROUP'],
+        language: str = "VIETNAMESE"
     ) -> str:
     """
-    Get response message from assistant.
+    Get response message from assistant, in the language of the user (see `response_templates`).
     """
     if action == 'TRANSFER':
-        return f"Đã chuyển {params['amount']} cho {params['receiver']} với nội dung \"{params['msg']}\"."
+        return render('transfer', language, amount=format_amount(params['amount'], language), receiver=params['receiver'], msg=params['msg'])
     elif action == 'TRANSFER_TO_EACH_USERS':
-        return f"Đã chuyển cho mỗi người trong nhóm {params['amount_each']} với nội dung \"{params['msg']}\"."
+        return render('transfer_to_each_users', language, amount_each=format_amount(params['amount_each'], language), msg=params['msg'])
     elif action == 'CREATE_CHAT_GROUP':
         if params['group_name']:
-            return f"Đã tạo nhóm chat {params['group_name']} thành công."
+            return render('create_chat_group', language, group_name=params['group_name'])
         else:
-            return f"Đã tạo nhóm chat thành công."
\ No newline at end of file
+            return render('create_chat_group_unnamed', language)
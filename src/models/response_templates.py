@@ -0,0 +1,115 @@
+import os
+import re
+import json
+import logging
+import threading
+from typing import Dict, Optional, Set, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+# templates by id and language, built by scripts/build_response_templates.py
+RESPONSE_TEMPLATES_PATH = os.getenv("RESPONSE_TEMPLATES_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "response_templates.json")
+# language of the templates the other ones are translated from, and used when a language is missing
+FALLBACK_LANGUAGE = "ENGLISH"
+# thousands separator, decimal separator and currency format of amounts, by language
+NUMBER_FORMATS: Dict[str, Tuple[str, str, str]] = {
+    "ENGLISH": (",", ".", "{amount} VND"),
+    "VIETNAMESE": (".", ",", "{amount} VND"),
+    "INDONESIAN": (".", ",", "{amount} VND"),
+    "CHINESE": (",", ".", "{amount}越南盾"),
+    "JAPANESE": (",", ".", "{amount}ドン"),
+    "KOREAN": (",", ".", "{amount}동"),
+    "THAI": (",", ".", "{amount} ดอง"),
+    "HINDI": (",", ".", "{amount} VND"),
+    "ARABIC": (",", ".", "{amount} دونغ"),
+}
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+metrics.describe('response_templates_total', 'Rendered response templates, by result (hit, or fallback to FALLBACK_LANGUAGE).')
+
+_templates: Optional[Dict[str, Dict[str, str]]] = None
+_templates_lock = threading.Lock()
+
+
+def get_templates() -> Dict[str, Dict[str, str]]:
+    """
+    Load the template catalog once.
+    """
+    global _templates
+    if _templates is None:
+        with _templates_lock:
+            if _templates is None:
+                with open(RESPONSE_TEMPLATES_PATH, encoding="utf-8") as f:
+                    _templates = json.load(f)
+    return _templates
+
+
+def get_placeholders(template: str) -> Set[str]:
+    """
+    Example:
+        >>> sorted(get_placeholders('Transferred {amount} to {receiver} with the message "{msg}".'))
+        ['amount', 'msg', 'receiver']
+    """
+    return set(PLACEHOLDER.findall(template))
+
+
+def format_number(number: float, language: str) -> str:
+    """
+    Format a number with the separators of the language. Indian languages group digits by lakh and crore.
+
+    Example:
+        >>> format_number(3000000, "VIETNAMESE")
+        '3.000.000'
+        >>> format_number(3000000, "HINDI")
+        '30,00,000'
+    """
+    thousands, decimal, _ = NUMBER_FORMATS.get(language, NUMBER_FORMATS[FALLBACK_LANGUAGE])
+    integer, _, fraction = f"{abs(number):.2f}".partition(".")
+    if language == "HINDI" and len(integer) > 3:
+        head, tail = integer[:-3], integer[-3:]
+        groups = [head[max(i - 2, 0):i] for i in range(len(head), 0, -2)][::-1]
+        integer = ",".join(groups + [tail])
+    else:
+        integer = f"{int(integer):,}"
+    integer = integer.replace(",", thousands)
+    sign = "-" if number < 0 else ""
+    if fraction.strip("0"):
+        return f"{sign}{integer}{decimal}{fraction}"
+    return f"{sign}{integer}"
+
+
+def format_amount(amount, language: str) -> str:
+    """
+    Format an amount in VND for the language, amounts which are not numbers (e.g. missing) are kept as they are.
+
+    Example:
+        >>> format_amount("300000", "ENGLISH")
+        '300,000 VND'
+        >>> format_amount("300000", "JAPANESE")
+        '300,000ドン'
+    """
+    try:
+        number = float(str(amount).replace(",", ""))
+    except ValueError:
+        return str(amount)
+    _, _, currency = NUMBER_FORMATS.get(language, NUMBER_FORMATS[FALLBACK_LANGUAGE])
+    return currency.format(amount=format_number(number, language))
+
+
+def render(template_id: str, language: str, **params) -> str:
+    """
+    Render a template of the catalog in a language, or in FALLBACK_LANGUAGE if the catalog does not have it.
+
+    Example:
+        >>> render("transfer", "ENGLISH", amount=format_amount(300000, "ENGLISH"), receiver="Minh", msg="bún đậu")
+        'Transferred 300,000 VND to Minh with the message "bún đậu".'
+    """
+    templates = get_templates()[template_id]
+    template = templates.get(language)
+    if template is None:
+        logging.warning(f"Missing {language} template for {template_id}, answering in {FALLBACK_LANGUAGE}")
+        template = templates[FALLBACK_LANGUAGE]
+    metrics.increment('response_templates_total', result='hit' if language in templates else 'fallback')
+    return template.format(**params)
@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+# translations of the static texts, built offline by scripts/build_translation_memory.py and committed
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "translation_memory.json")
+
+metrics.describe('translation_memory_total', 'Translations looked up in the translation memory, by result (hit or miss).')
+
+# static text -> its language
+_static_texts: Dict[str, str] = {}
+_static_texts_lock = threading.Lock()
+
+
+def normalize(text: str) -> str:
+    # texts are translated with collapsed whitespace, see `translator._get_translate_model_input`
+    return " ".join(text.split())
+
+
+def register_static_texts(texts: Iterable[str], language: str) -> Iterable[str]:
+    """
+    Declare texts of the app which never change (scripted answers, suggestions), so that their translations are
+    built offline instead of calling the model.
+
+    Returns:
+        texts: The registered texts, unchanged.
+
+    Example:
+        >>> register_static_texts(['Cảm ơn bạn nhiều'], language="VIETNAMESE")
+        ['Cảm ơn bạn nhiều']
+    """
+    with _static_texts_lock:
+        for text in texts:
+            _static_texts[normalize(text)] = language
+    return texts
+
+
+def get_static_texts() -> List[Tuple[str, str]]:
+    """
+    Get the registered static texts, as (text, language).
+    """
+    with _static_texts_lock:
+        return list(_static_texts.items())
+
+
+class TranslationMemory:
+    """
+    Translations by source language, destination language and normalized source text, stored as JSON:
+    `{"VIETNAMESE": {"ENGLISH": {"Cảm ơn bạn nhiều": "Thank you very much"}}}`.
+    """
+
+    def __init__(self, path: str = TRANSLATION_MEMORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._translations: Dict[str, Dict[str, Dict[str, str]]] = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                self._translations = json.load(f)
+
+    def get(self, text: str, src: str, dest: str) -> Optional[str]:
+        return self._translations.get(src.upper(), {}).get(dest.upper(), {}).get(normalize(text))
+
+    def set(self, text: str, src: str, dest: str, translation: str) -> None:
+        with self._lock:
+            self._translations.setdefault(src.upper(), {}).setdefault(dest.upper(), {})[normalize(text)] = translation
+
+    def save(self) -> None:
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._translations, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+    def __len__(self) -> int:
+        return sum(len(texts) for dests in self._translations.values() for texts in dests.values())
+
+
+_memory: Optional[TranslationMemory] = None
+_memory_lock = threading.Lock()
+
+
+def get_translation_memory() -> TranslationMemory:
+    """
+    Load the translation memory once, empty if it was not built.
+    """
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                _memory = TranslationMemory()
+                if len(_memory) == 0:
+                    logging.warning(f"Empty translation memory at {TRANSLATION_MEMORY_PATH}, static texts are translated by the model.")
+                else:
+                    logging.info(f"Loaded {len(_memory)} translations from {TRANSLATION_MEMORY_PATH}")
+    return _memory
+
+
+def get_translation(text: str, src: str, dest: str) -> Optional[str]:
+    """
+    Get the precomputed translation of a text, None if it is not a known static text.
+
+    Example:
+        >>> get_translation("Cảm ơn bạn nhiều", src="VIETNAMESE", dest="ENGLISH")
+        'Thank you very much'
+    """
+    translation = get_translation_memory().get(text, src, dest)
+    metrics.increment('translation_memory_total', result='hit' if translation is not None else 'miss')
+    return translation
@@ -1,49 +1,215 @@
 from typing import List, Dict, Any, Union, Literal, Tuple, Optional
-from lingua import Language, LanguageDetectorBuilder
-from functools import lru_cache
-from src.utils.model_api import generate_general_call_chatgpt_api
-from src.utils.logger import logging, print
-import threading
-
-# detector = LanguageDetectorBuilder.from_all_languages().with_preloaded_language_models().build()
-detector = LanguageDetectorBuilder.from_languages(
-    Language.ENGLISH,
-    # Language.FRENCH, Language.GERMAN, Language.SPANISH,
-    Language.VIETNAMESE, Language.CHINESE, Language.JAPANESE, Language.KOREAN,
-    Language.INDONESIAN, Language.THAI, Language.HINDI, Language.ARABIC,
-    # Language.RUSSIAN, Language.PORTUGUESE, Language.ITALIAN, Language.TURKISH,
-    # Language.DUTCH, Language.POLISH, Language.SWEDISH, Language.DANISH,
-).with_preloaded_language_models().build()
+from src.models.language_detection import detect_language
+from src.models import translation_memory, response_templates
+from src.utils.model_api import generate_general_call_chatgpt_api, agenerate_general_call_chatgpt_api
+from src.utils.logger import logging, print, log_prompt
+from src.utils.executor import submit
+from src.utils import metrics, tracing
+from src.utils.key_scheduler import estimate_tokens
+import asyncio
+import os
+import re
 
+# source tokens translated in one call by `translate_batch`
+TRANSLATE_BATCH_MAX_TOKENS = int(os.getenv("TRANSLATE_BATCH_MAX_TOKENS") or 1024)
+BATCH_LINE = re.compile(r"^\s*(\d+)[.)]\s*(.*)$")
+TRANSLATE_COMPLETION = dict(temperature=0.5, top_p=0.92, cache=True)
+
+metrics.describe('translation_batch_items_total', 'Texts of batched translations, by result (parsed or fallback to a call per text).')
+
+@tracing.traced("language_detection")
 def detect_language_of(text: str) -> str:
-    return detector.detect_language_of(text).name
+    return detect_language(text)
 
-@lru_cache(maxsize=256)
-def translate(text: str, src="vi", dest="en") -> str:
+@tracing.traced("translate")
+def translate(text: str, src="vi", dest="en", memory: bool = True) -> str:
     """
     Translate text to English.
+    Static texts of the app are looked up in the translation memory first.
 
     Args:
         text (str): text to translate
+        memory (bool): look up the translation memory, False to always call the model
         
     Returns:
         str: translated text
     """
+    translation = translation_memory.get_translation(text, src, dest) if memory else None
+    if translation is not None:
+        return translation
+    model_input = _get_translate_model_input(text, src=src, dest=dest)
+    log_prompt("Model input", model_input)
+    output = generate_general_call_chatgpt_api(inputs=model_input, max_tokens=3072, **TRANSLATE_COMPLETION)
+    return _get_translation_from_output(output)
+
+
+@tracing.traced("translate")
+async def atranslate(text: str, src="vi", dest="en", memory: bool = True) -> str:
+    """
+    Async variant of `translate`.
+    """
+    translation = translation_memory.get_translation(text, src, dest) if memory else None
+    if translation is not None:
+        return translation
+    model_input = _get_translate_model_input(text, src=src, dest=dest)
+    log_prompt("Model input", model_input)
+    output = await agenerate_general_call_chatgpt_api(inputs=model_input, max_tokens=3072, **TRANSLATE_COMPLETION)
+    return _get_translation_from_output(output)
+
+
+@tracing.traced("translate_batch")
+def translate_batch(texts: List[str], src="vi", dest="en") -> List[str]:
+    """
+    Translate several texts with one numbered prompt per chunk of TRANSLATE_BATCH_MAX_TOKENS, instead of one call per text.
+    Texts missing from the parsed output are translated one by one. The order of the texts is kept.
+
+    Example:
+        >>> translate_batch(["Cảm ơn bạn nhiều", "5 triệu"], src="VIETNAMESE", dest="ENGLISH")
+        ['Thank you very much', '5 million']
+    """
+    translations, chunks = _lookup_batch(texts, src, dest)
+    futures = [submit(_translate_chunk, [texts[i] for i in chunk], src, dest) for chunk in chunks]
+    missing = _fill_translations(translations, chunks, [future.result() for future in futures])
+
+    futures = [submit(translate, texts[i], src=src, dest=dest) for i in missing]
+    _fill_translations(translations, [[i] for i in missing], [[future.result()] for future in futures])
+    return translations
+
+
+@tracing.traced("translate_batch")
+async def atranslate_batch(texts: List[str], src="vi", dest="en") -> List[str]:
+    """
+    Async variant of `translate_batch`.
+    """
+    translations, chunks = _lookup_batch(texts, src, dest)
+    results = await asyncio.gather(*[_atranslate_chunk([texts[i] for i in chunk], src, dest) for chunk in chunks])
+    missing = _fill_translations(translations, chunks, results)
+
+    results = await asyncio.gather(*[atranslate(texts[i], src=src, dest=dest) for i in missing])
+    _fill_translations(translations, [[i] for i in missing], [[result] for result in results])
+    return translations
+
+
+def _lookup_batch(texts: List[str], src: str, dest: str) -> Tuple[List[Optional[str]], List[List[int]]]:
+    """
+    Get the translations of the texts in the translation memory, and split the indices of the others into chunks
+    of at most TRANSLATE_BATCH_MAX_TOKENS source tokens.
+    """
+    translations = [translation_memory.get_translation(text, src, dest) for text in texts]
+    chunks = []
+    chunk_tokens = 0
+    for i, translation in enumerate(translations):
+        if translation is not None:
+            continue
+        tokens = estimate_tokens(" ".join(texts[i].split()), 0)
+        if len(chunks) == 0 or chunk_tokens + tokens > TRANSLATE_BATCH_MAX_TOKENS:
+            chunks.append([])
+            chunk_tokens = 0
+        chunks[-1].append(i)
+        chunk_tokens += tokens
+    return translations, chunks
+
+
+def _fill_translations(
+        translations: List[Optional[str]],
+        chunks: List[List[int]],
+        results: List[List[Optional[str]]],
+    ) -> List[int]:
+    """
+    Put the translations of each chunk at the indices of its texts, and get the indices still missing a translation.
+
+    Example:
+        >>> translations = ["Hello", None, None]
+        >>> _fill_translations(translations, [[1, 2]], [["Thank you", None]])
+        [2]
+        >>> translations
+        ['Hello', 'Thank you', None]
+    """
+    for chunk, result in zip(chunks, results):
+        for i, translation in zip(chunk, result):
+            translations[i] = translation
+    return [i for i, translation in enumerate(translations) if translation is None]
+
+
+def _translate_chunk(texts: List[str], src: str, dest: str) -> List[Optional[str]]:
+    if len(texts) == 1:
+        return [translate(texts[0], src=src, dest=dest, memory=False)]
+    model_input, max_tokens = _get_batch_translate_model_input(texts, src=src, dest=dest)
+    log_prompt("Model input", model_input)
+    output = generate_general_call_chatgpt_api(inputs=model_input, max_tokens=max_tokens, **TRANSLATE_COMPLETION)
+    return _get_batch_translations_from_output(output, len(texts))
+
+
+async def _atranslate_chunk(texts: List[str], src: str, dest: str) -> List[Optional[str]]:
+    if len(texts) == 1:
+        return [await atranslate(texts[0], src=src, dest=dest, memory=False)]
+    model_input, max_tokens = _get_batch_translate_model_input(texts, src=src, dest=dest)
+    log_prompt("Model input", model_input)
+    output = await agenerate_general_call_chatgpt_api(inputs=model_input, max_tokens=max_tokens, **TRANSLATE_COMPLETION)
+    return _get_batch_translations_from_output(output, len(texts))
+
+
+def _get_translation_from_output(output: str) -> str:
+    log_prompt("Model output", output)
+    return " ".join(output.split())
+
+
+def _get_batch_translations_from_output(output: str, size: int) -> List[Optional[str]]:
+    log_prompt("Model output", output)
+    return _parse_batch_translation(output, size)
+
+
+def _get_batch_translate_model_input(texts: List[str], src: str, dest: str) -> Tuple[str, int]:
+    texts = [" ".join(text.split()) for text in texts]
+    numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(texts, start=1))
+    model_input = f"""Translate each numbered line from {src} into {dest}, keeping the numbers, one line per translation:
+{numbered}
+
+{dest}:
+1."""
+    # translations take about as many tokens as their source, with room for the numbers
+    max_tokens = min(sum(estimate_tokens(text, 0) for text in texts) * 2 + 8 * len(texts), 3072)
+    return model_input, max_tokens
+
+
+def _parse_batch_translation(output: str, size: int) -> List[Optional[str]]:
+    r"""
+    Parse the numbered translations, None for the ones missing or ambiguous.
+
+    Example:
+        >>> _parse_batch_translation(" Thank you\n2. Thank you very much\n3.", 3)
+        ['Thank you', 'Thank you very much', None]
+    """
+    output = output.strip()
+    # the prompt ends with "1.", which the model may or may not repeat
+    if BATCH_LINE.match(output.split("\n", 1)[0]) is None:
+        output = "1. " + output
+    parsed: Dict[int, List[str]] = {}
+    number = None
+    for line in output.splitlines():
+        match = BATCH_LINE.match(line)
+        if match is not None:
+            number = int(match.group(1))
+            parsed.setdefault(number, []).append(match.group(2))
+        elif number is not None and line.strip():
+            # a translation on several lines
+            parsed[number][-1] += " " + line
+    translations = []
+    for number in range(1, size + 1):
+        lines = [" ".join(line.split()) for line in parsed.get(number, [])]
+        translations.append(lines[0] if len(lines) == 1 and lines[0] else None)
+    metrics.increment('translation_batch_items_total', sum(t is not None for t in translations), result='parsed')
+    metrics.increment('translation_batch_items_total', sum(t is None for t in translations), result='fallback')
+    return translations
+
+
+def _get_translate_model_input(text: str, src: str, dest: str) -> str:
     text = " ".join(text.split())
     model_input = f"""Translate from {src} into {dest}:
 {text}
 
 {dest}:"""
-    logging.info(f"Model input: \n{model_input}")
-    output = generate_general_call_chatgpt_api(
-        inputs=model_input,
-        temperature=0.5,
-        top_p=0.92,
-        max_tokens=3072,
-    )
-    logging.info(f"Model output: \n{output}")
-    output = " ".join(output.split())
-    return output
+    return model_input
     
 
 def convert_answer_language_to_same_as_question(question: str, answer: str) -> str:
@@ -58,24 +224,25 @@ def convert_answer_language_to_same_as_question(question: str, answer: str) -> s
     Returns:
         str: answer
     """
-    question_lang = detector.detect_language_of(question).name
-    answer_lang = detector.detect_language_of(answer).name
+    answer, answer_lang, question_lang = _get_answer_languages(question, answer)
+    if answer_lang == question_lang:
+        return answer
+    return translate(answer, src=answer_lang, dest=question_lang)
 
-    answer = translate_currency(answer, src=answer_lang)
-    if question_lang == answer_lang:
-        logging.info(f"Question and answer language are the same ({question_lang}). No need to translate.")
+async def aconvert_answer_language_to_same_as_question(question: str, answer: str) -> str:
+    """
+    Async variant of `convert_answer_language_to_same_as_question`.
+    """
+    answer, answer_lang, question_lang = _get_answer_languages(question, answer)
+    if answer_lang == question_lang:
         return answer
-    else:
-        logging.info(f"Question language: {question_lang}")
-        logging.info(f"Answer language: {answer_lang}")
-        logging.info(f"Translating answer to {question_lang}...")
-        return translate(answer, src=answer_lang, dest=question_lang)
+    return await atranslate(answer, src=answer_lang, dest=question_lang)
 
 def batch_convert_answer_language_to_same_as_question(question: str, answers: List[str]) -> List[str]:
     """
     Convert language of answer to same as question's language.
     If answer language is already matched with question language, return answer unchanged.
-    In parralel
+    Answers are translated together, in one call per source language and chunk (see `translate_batch`).
 
     Args:
         question (str): question
@@ -84,31 +251,84 @@ def batch_convert_answer_language_to_same_as_question(question: str, answers: Li
     Returns:
         List[str]: list of answers
     """
-    question_lang = detector.detect_language_of(question).name
-    answer_langs = [detector.detect_language_of(answer).name for answer in answers]
+    answers, answer_langs, question_lang = _get_answers_languages(question, answers)
+    if question_lang in answer_langs:
+        return answers
+    # one batch per source language, each batch already translates its chunks in parallel
+    batches = _group_by_language(answers, answer_langs)
+    results = [translate_batch(batch, src=answer_lang, dest=question_lang) for answer_lang, batch in batches.items()]
+    return _ungroup_by_language(results, list(batches), answer_langs)
+
+async def abatch_convert_answer_language_to_same_as_question(question: str, answers: List[str]) -> List[str]:
+    """
+    Async variant of `batch_convert_answer_language_to_same_as_question`, answers are translated concurrently.
+    """
+    answers, answer_langs, question_lang = _get_answers_languages(question, answers)
+    if question_lang in answer_langs:
+        return answers
+    # one batch per source language
+    batches = _group_by_language(answers, answer_langs)
+    results = await asyncio.gather(*[atranslate_batch(batch, src=answer_lang, dest=question_lang) for answer_lang, batch in batches.items()])
+    return _ungroup_by_language(results, list(batches), answer_langs)
+
+    
+def _get_answer_languages(question: str, answer: str) -> Tuple[str, str, str]:
+    """
+    Get the answer with its currencies translated, its language and the language of the question.
+    """
+    question_lang = detect_language_of(question)
+    answer_lang = detect_language_of(answer)
+
+    answer = translate_currency(answer, src=answer_lang)
+    if question_lang == answer_lang:
+        logging.info(f"Question and answer language are the same ({question_lang}). No need to translate.")
+    else:
+        logging.info(f"Question language: {question_lang}")
+        logging.info(f"Answer language: {answer_lang}")
+        logging.info(f"Translating answer to {question_lang}...")
+    return answer, answer_lang, question_lang
+
+
+def _get_answers_languages(question: str, answers: List[str]) -> Tuple[List[str], List[str], str]:
+    """
+    Batch variant of `_get_answer_languages`. The answers are not translated when any of them is in the language of the question.
+    """
+    question_lang = detect_language_of(question)
+    answer_langs = [detect_language_of(answer) for answer in answers]
     answers = [translate_currency(answer, src=answer_lang) for answer, answer_lang in zip(answers, answer_langs)]
-    if any([question_lang == answer_lang for answer_lang in answer_langs]):
+    if question_lang in answer_langs:
         logging.info(f"Question and answer language are the same ({question_lang}). No need to translate.")
-        return answers
     else:
         logging.info(f"Question language: {question_lang}")
         logging.info(f"Answer languages: {answer_langs}")
         logging.info(f"Translating answers to {question_lang}...")
-        results = []
-        threads = []
-        for answer, answer_lang in zip(answers, answer_langs):
-            def _translate(answer, answer_lang, results):
-                results.append(translate(answer, src=answer_lang, dest=question_lang))
-            t = threading.Thread(target=_translate, args=(answer, answer_lang, results))
-            threads.append(t)
-            t.start()
-
-        for t in threads:
-            t.join()
-        
-        return results
+    return answers, answer_langs, question_lang
+
+
+def _group_by_language(answers: List[str], answer_langs: List[str]) -> Dict[str, List[str]]:
+    """
+    Example:
+        >>> _group_by_language(["Xin chào", "Hello", "Cảm ơn"], ["VIETNAMESE", "ENGLISH", "VIETNAMESE"])
+        {'VIETNAMESE': ['Xin chào', 'Cảm ơn'], 'ENGLISH': ['Hello']}
+    """
+    batches: Dict[str, List[str]] = {}
+    for answer, answer_lang in zip(answers, answer_langs):
+        batches.setdefault(answer_lang, []).append(answer)
+    return batches
+
+
+def _ungroup_by_language(results: List[List[str]], langs: List[str], answer_langs: List[str]) -> List[str]:
+    """
+    Put the translations of the batches of `_group_by_language` back in the order of the answers.
+
+    Example:
+        >>> _ungroup_by_language([["Hello", "Thank you"], ["Hello"]], ["VIETNAMESE", "ENGLISH"], ["VIETNAMESE", "ENGLISH", "VIETNAMESE"])
+        ['Hello', 'Hello', 'Thank you']
+    """
+    translations = {answer_lang: iter(result) for answer_lang, result in zip(langs, results)}
+    return [next(translations[answer_lang]) for answer_lang in answer_langs]
+
 
-    
 def translate_currency(currency: str, src="ENGLISH") -> str:
     """
     Translate currency to English.
@@ -129,9 +349,25 @@ def translate_currency(currency: str, src="ENGLISH") -> str:
     return currency
         
     
+def detect_user_language(messages: List[Dict[str, str]]) -> str:
+    """
+    Detect the language the user writes in, from their last messages.
+
+    Args:
+        messages (List[Dict[str, str]]): list of messages
+
+    Returns:
+        str: name of the lingua language
+    """
+    messages = [m for m in messages if m['user'].lower() != 'assistant'][-12:]
+    raw_conversation = "\n".join([f"{m['user'].strip()}: {' '.join(m['content'].split())}" for m in messages])
+    user_language = detect_language_of(raw_conversation)
+    logging.info(f"User language: {user_language}")
+    return user_language
+
 def answer_I_dont_know_multilingual(messages: List[Dict[str, str]]):
     """
-    Answer "I don't know" in the same language as the question.
+    Answer "I don't know" in the same language as the question, from the template catalog.
     
     Args:
         messages (List[Dict[str, str]]): list of messages
@@ -139,18 +375,4 @@ def answer_I_dont_know_multilingual(messages: List[Dict[str, str]]):
     Returns:
         str: answer
     """
-    messages = [m for m in messages if m['user'].lower() != 'assistant'][-12:]
-    raw_conversation = "\n".join([f"{m['user'].strip()}: {' '.join(m['content'].split())}" for m in messages])
-    user_language = detector.detect_language_of(raw_conversation).name
-    logging.info(f"User language: {user_language}")
-    if user_language == Language.ENGLISH.name:
-        return "I'm sorry, but I do not understand what you mean. Can you rephrase your question?"
-    elif user_language == Language.VIETNAMESE.name:
-        return "Xin lỗi, tôi không hiểu ý bạn. Bạn có thể nói rõ hơn được không?"
-    elif user_language == Language.CHINESE.name:
-        return "对不起，我不明白你的意思。你能再说一遍吗？"
-    elif user_language == Language.JAPANESE.name:
-        return "すみませんが、私はあなたの意味がわかりません。"
-    else:
-        logging.info(f"Translating answer to {user_language}...")
-        return translate("I don't understand.", src=Language.ENGLISH.name, dest=user_language)
\ No newline at end of file
+    return response_templates.render("i_dont_understand", detect_user_language(messages))
\ No newline at end of file
@@ -1,7 +1,7 @@
 from typing import Literal, Dict, List, Tuple, Union, Any, Optional
 import pandas as pd
 import logging
-import requests
+from src.utils.http_session import get_session
 import os
 from src.expert_system.utils.calculator import format_vnd
 
@@ -20,7 +20,7 @@ def get_top_portfolios(top=10) -> str:
 def _get_top_portfolios(top=10) -> Tuple[str, pd.DataFrame]:
 	endpoint = f'https://www.alphavantage.co/query?function=TOURNAMENT_PORTFOLIO&apikey={API_KEY}'
 	
-	response = requests.get(endpoint)
+	response = get_session().get(endpoint)
 	data = response.json()
 
 	df = pd.DataFrame(data['ranking'])
@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple, Dict, Any
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+COMPLETION_CACHE_BACKEND = os.getenv("COMPLETION_CACHE_BACKEND") or "sqlite"
+COMPLETION_CACHE_PATH = os.getenv("COMPLETION_CACHE_PATH") or "completion_cache.sqlite3"
+COMPLETION_CACHE_REDIS_URL = os.getenv("COMPLETION_CACHE_REDIS_URL") or "redis://localhost:6379/0"
+COMPLETION_CACHE_TTL = int(os.getenv("COMPLETION_CACHE_TTL") or 7 * 24 * 3600)
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES") or 100000)
+
+metrics.describe('completion_cache_total', 'Completion cache lookups, by result (hit or miss).')
+metrics.describe('completion_cache_evictions_total', 'Completion cache entries evicted, by reason (expired or size).')
+
+
+def get_key(
+        prompt: str,
+        model: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: int = 64,
+        stop: Optional[Tuple[str]] = None,
+    ) -> str:
+    """
+    Hash of the normalized completion parameters.
+
+    Example:
+        >>> get_key("Hi", "text-davinci-003", temperature=0, max_tokens=4) == get_key("Hi", "text-davinci-003", temperature=0.0, max_tokens=4, stop=None)
+        True
+    """
+    normalized = {
+        "prompt": prompt,
+        "model": model,
+        "temperature": float(temperature) if temperature is not None else None,
+        "top_p": float(top_p) if top_p is not None else None,
+        "max_tokens": int(max_tokens),
+        "stop": list(stop) if stop is not None else None,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def is_cacheable(temperature: Optional[float] = None, top_p: Optional[float] = None) -> bool:
+    """
+    Only deterministic (temperature=0) calls are cached by default.
+    """
+    return temperature is not None and float(temperature) == 0.0
+
+
+class CompletionCache(ABC):
+    """
+    Completion cache backend, keyed by `get_key`.
+    """
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: str) -> None:
+        ...
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self._get(key)
+        except Exception as e:
+            logging.warning(f"Completion cache lookup failed: {e}")
+            value = None
+        metrics.increment('completion_cache_total', result='hit' if value is not None else 'miss')
+        return value
+
+    def contains(self, key: str) -> bool:
+        """
+        Check for a live entry, without counting a lookup.
+        """
+        try:
+            return self._get(key) is not None
+        except Exception as e:
+            logging.warning(f"Completion cache lookup failed: {e}")
+            return False
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self._set(key, value)
+        except Exception as e:
+            logging.warning(f"Completion cache write failed: {e}")
+
+
+class SQLiteCompletionCache(CompletionCache):
+    """
+    On-disk cache, shared by all workers of the same host. Entries expire after `ttl` seconds,
+    and the least recently used entries are evicted above `max_entries`.
+    """
+
+    # check the size only every few writes, since COUNT(*) scans the table
+    EVICTION_CHECK_INTERVAL = 100
+
+    def __init__(self, path: str, ttl: int = COMPLETION_CACHE_TTL, max_entries: int = COMPLETION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pid = None
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared across fork(), reconnect in each worker process
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed_at ON completions (accessed_at)")
+            self._pid = os.getpid()
+        return self._conn
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT value, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if now - created_at > self.ttl:
+                self.conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                metrics.increment('completion_cache_evictions_total', reason='expired')
+                return None
+            self.conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO completions (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICTION_CHECK_INTERVAL == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        expired = self.conn.execute("DELETE FROM completions WHERE created_at < ?", (now - self.ttl,)).rowcount
+        if expired > 0:
+            metrics.increment('completion_cache_evictions_total', expired, reason='expired')
+        count = self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        if count > self.max_entries:
+            evicted = self.conn.execute(
+                "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            ).rowcount
+            metrics.increment('completion_cache_evictions_total', evicted, reason='size')
+
+
+class RedisCompletionCache(CompletionCache):
+    """
+    Cache shared by all hosts. Entries expire after `ttl` seconds; size-based eviction is left to
+    Redis itself, configure it with `maxmemory` and `maxmemory-policy allkeys-lru`.
+    """
+
+    def __init__(self, url: str, ttl: int = COMPLETION_CACHE_TTL, prefix: str = "completion:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def _set(self, key: str, value: str) -> None:
+        self.client.set(self.prefix + key, value.encode("utf-8"), ex=self.ttl)
+
+
+_cache: Optional[CompletionCache] = None
+_cache_initialized = False
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache() -> Optional[CompletionCache]:
+    """
+    Get the process-wide completion cache, as configured by COMPLETION_CACHE_BACKEND (sqlite, redis or none).
+    """
+    global _cache, _cache_initialized
+    if _cache_initialized:
+        return _cache
+    with _cache_lock:
+        if not _cache_initialized:
+            try:
+                if COMPLETION_CACHE_BACKEND == "sqlite":
+                    _cache = SQLiteCompletionCache(COMPLETION_CACHE_PATH)
+                elif COMPLETION_CACHE_BACKEND == "redis":
+                    _cache = RedisCompletionCache(COMPLETION_CACHE_REDIS_URL)
+                elif COMPLETION_CACHE_BACKEND != "none":
+                    logging.warning(f"Unknown completion cache backend: {COMPLETION_CACHE_BACKEND}, cache disabled.")
+            except ImportError:
+                logging.warning(f"Missing dependency for the {COMPLETION_CACHE_BACKEND} completion cache, cache disabled.")
+            logging.info(f"Completion cache: {_cache.__class__.__name__ if _cache else None}")
+            _cache_initialized = True
+    return _cache
@@ -0,0 +1,194 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS") or 32)
+# max concurrent calls to each upstream, shared by threads and event loops of the process
+UPSTREAM_MAX_CONCURRENCY = {
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY") or 16),
+    "model_api": int(os.getenv("MODEL_API_MAX_CONCURRENCY") or 4),
+}
+
+metrics.describe('executor_pending_tasks', 'Tasks submitted to the shared executor and not finished yet (queued or running).')
+metrics.describe('upstream_in_flight', 'Calls currently running against each upstream.')
+metrics.describe('upstream_queued', 'Calls waiting for a free slot of each upstream.')
+metrics.describe('upstream_calls_total', 'Calls admitted to each upstream.')
+metrics.describe('upstream_queue_wait_seconds_total', 'Total time calls waited for a free slot of each upstream.')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Get the process-wide, bounded worker pool used for all fan-out in the request path,
+    instead of spawning new threads per request. Prefer `submit`, which also tracks the queue.
+    """
+    global _executor, _executor_pid
+    # worker threads do not survive fork(), create a new pool in each worker process
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix="fan-out")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Let the submitted tasks finish and stop the worker threads, on graceful shutdown of the process.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=wait)
+        _executor = None
+
+
+def submit(fn: Callable, *args: Any, **kwargs: Any) -> Future:
+    """
+    Submit a task to the shared executor. The task runs in a copy of the caller's context, so that it
+    inherits context variables like the trace of the request.
+
+    Example:
+        >>> futures = [submit(pow, 2, n) for n in range(4)]
+        >>> [future.result() for future in futures]
+        [1, 2, 4, 8]
+    """
+    metrics.add_gauge('executor_pending_tasks', 1)
+    future = get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    future.add_done_callback(lambda _: metrics.add_gauge('executor_pending_tasks', -1))
+    return future
+
+
+class UpstreamLimiter:
+    """
+    Semaphore bounding the concurrent calls to one upstream, usable from threads (`limit`) and
+    from any event loop (`alimit`) at the same time. Waiters are admitted in FIFO order.
+    """
+
+    def __init__(self, name: str, max_concurrency: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+
+    def _try_acquire(self, waiter: Any) -> bool:
+        with self._lock:
+            if self._in_flight < self.max_concurrency and len(self._waiters) == 0:
+                self._in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            metrics.add_gauge('upstream_queued', 1, upstream=self.name)
+            return False
+
+    def _remove_waiter(self, waiter: Any) -> bool:
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                # already popped by `_release`
+                return False
+            metrics.add_gauge('upstream_queued', -1, upstream=self.name)
+            return True
+
+    def _release(self) -> None:
+        with self._lock:
+            # hand the slot over to the next live waiter, if any
+            while len(self._waiters) > 0:
+                waiter = self._waiters.popleft()
+                metrics.add_gauge('upstream_queued', -1, upstream=self.name)
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                if not future.done():
+                    try:
+                        loop.call_soon_threadsafe(self._wake, future)
+                        return
+                    except RuntimeError:
+                        # the event loop of the waiter is closed
+                        continue
+            self._in_flight -= 1
+
+    def _wake(self, future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+        else:
+            # cancelled after the slot was handed over, pass it on
+            self._release()
+
+    def _admitted(self, waited: float) -> None:
+        metrics.increment('upstream_calls_total', upstream=self.name)
+        metrics.increment('upstream_queue_wait_seconds_total', waited, upstream=self.name)
+        metrics.add_gauge('upstream_in_flight', 1, upstream=self.name)
+
+    def _done(self) -> None:
+        metrics.add_gauge('upstream_in_flight', -1, upstream=self.name)
+        self._release()
+
+    @contextmanager
+    def limit(self):
+        start = time.perf_counter()
+        event = threading.Event()
+        if not self._try_acquire(event):
+            event.wait()
+        self._admitted(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._done()
+
+    @asynccontextmanager
+    async def alimit(self):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self._try_acquire((loop, future)):
+            try:
+                await future
+            except asyncio.CancelledError:
+                # leave the queue, unless the slot was handed over right before the cancellation
+                if not self._remove_waiter((loop, future)) and future.done() and not future.cancelled():
+                    self._release()
+                raise
+        self._admitted(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._done()
+
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(upstream: str) -> UpstreamLimiter:
+    """
+    Get the process-wide limiter of an upstream, configured by UPSTREAM_MAX_CONCURRENCY.
+
+    Example:
+        >>> limiter = get_limiter("model_api")
+        >>> with limiter.limit():
+        ...     limiter._in_flight
+        1
+        >>> limiter._in_flight
+        0
+    """
+    if upstream not in _limiters:
+        with _limiters_lock:
+            if upstream not in _limiters:
+                _limiters[upstream] = UpstreamLimiter(upstream, UPSTREAM_MAX_CONCURRENCY.get(upstream, EXECUTOR_MAX_WORKERS))
+    return _limiters[upstream]
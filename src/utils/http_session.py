@@ -0,0 +1,162 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import tracing
+from src.utils.executor import UPSTREAM_MAX_CONCURRENCY
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT") or 3.05)
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT") or 30)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE") or 10)
+# per-host pool sizes, e.g. "model_api:80=16,www.alphavantage.co=4"
+HTTP_POOL_SIZES = os.getenv("HTTP_POOL_SIZES") or "model_api:80=16,www.alphavantage.co=4"
+# stage of the requests to each host, in the latency metrics and traces
+TRACED_HOSTS = {"www.alphavantage.co": "alpha_vantage"}
+
+
+def parse_pool_sizes(value: str) -> Dict[str, int]:
+    """
+    Example:
+        >>> parse_pool_sizes("model_api:80=16, api.openai.com=32")
+        {'model_api:80': 16, 'api.openai.com': 32}
+    """
+    pool_sizes = {}
+    for item in value.split(","):
+        if "=" in item:
+            host, size = item.split("=", 1)
+            pool_sizes[host.strip()] = int(size)
+    return pool_sizes
+
+
+class PooledSession(requests.Session):
+    """
+    Session keeping keep-alive connections per host, with default connect/read timeouts
+    for calls which do not set their own.
+    """
+
+    def __init__(
+            self,
+            timeout: Tuple[float, float] = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+            pool_size: int = HTTP_POOL_SIZE,
+            pool_sizes: Optional[Dict[str, int]] = None,
+        ):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        # longest prefix wins, so each listed host gets its own pool
+        for host, size in (pool_sizes or {}).items():
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+            self.mount(f"http://{host}", adapter)
+            self.mount(f"https://{host}", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        stage = TRACED_HOSTS.get(urlparse(url).hostname)
+        if stage is None:
+            return super().request(method, url, **kwargs)
+        with tracing.span(stage):
+            return super().request(method, url, **kwargs)
+
+
+_session: Optional[PooledSession] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> PooledSession:
+    """
+    Get the process-wide HTTP session. Use it instead of the module-level `requests.get`/`requests.post`,
+    which open a new connection for every call, e.g. `get_session().get(url, params=params).json()`.
+
+    Example:
+        >>> get_session() is get_session()
+        True
+    """
+    global _session, _session_pid
+    # pooled connections must not be shared across fork(), create a new session in each worker process
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = PooledSession(pool_sizes=parse_pool_sizes(HTTP_POOL_SIZES))
+                _session_pid = os.getpid()
+    return _session
+
+
+def make_openai_session() -> PooledSession:
+    """
+    Create a session for the OpenAI client. The client keeps one session per thread and closes it every few
+    minutes (`MAX_SESSION_LIFETIME_SECS`), so it must not be given the shared one, whose pools the other
+    clients use.
+    """
+    # a thread sends one request at a time
+    return PooledSession(pool_size=1)
+
+
+class _AlphaVantageRequests:
+    """
+    Stand-in for the `requests` module used by the alpha_vantage client, which only calls `requests.get`.
+    """
+
+    def get(self, url, **kwargs):
+        return get_session().get(url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+_async_session = None
+
+
+async def open_async_session() -> None:
+    """
+    Open the aiohttp session of the async OpenAI calls, once the event loop serving the requests runs.
+    Without it, openai opens a new session, and connection, per call.
+    """
+    global _async_session
+    import aiohttp
+
+    # the upstream limiter already bounds the concurrent calls
+    _async_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=UPSTREAM_MAX_CONCURRENCY["openai"]))
+
+
+async def close_async_session() -> None:
+    global _async_session
+    if _async_session is not None:
+        await _async_session.close()
+        _async_session = None
+
+
+def use_async_session() -> None:
+    """
+    Make the async OpenAI calls of the current request use the shared aiohttp session, if it is open.
+    openai reads it from a context variable, so it is set at the start of each request.
+    """
+    if _async_session is not None:
+        import openai
+
+        openai.aiosession.set(_async_session)
+
+
+def install() -> None:
+    """
+    Make the Alpha Vantage client use the shared session, and the OpenAI client pooled sessions of its own.
+    The async OpenAI calls use the aiohttp session of the serving event loop, see `open_async_session`.
+    """
+    import openai
+
+    openai.requestssession = make_openai_session
+    try:
+        from alpha_vantage import alphavantage
+
+        alphavantage.requests = _AlphaVantageRequests()
+    except ImportError:
+        pass
@@ -0,0 +1,255 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+# per-key budgets, default to the text-davinci-003 pay-as-you-go limits
+OPENAI_KEY_RPM = int(os.getenv("OPENAI_KEY_RPM") or 3000)
+OPENAI_KEY_TPM = int(os.getenv("OPENAI_KEY_TPM") or 250000)
+# cooldown of a key after a 429, doubled on each consecutive 429
+OPENAI_KEY_COOLDOWN = float(os.getenv("OPENAI_KEY_COOLDOWN") or 10)
+OPENAI_KEY_MAX_COOLDOWN = float(os.getenv("OPENAI_KEY_MAX_COOLDOWN") or 120)
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE") or 0.5)
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX") or 20)
+
+metrics.describe('openai_key_requests_total', 'OpenAI calls per key, by result (ok, rate_limited, error or cancelled).')
+metrics.describe('openai_key_tokens_total', 'OpenAI tokens used per key.')
+metrics.describe('openai_key_utilization', 'Used fraction of the most constrained budget (requests or tokens) of each key, 1 while cooling down.')
+metrics.describe('openai_key_wait_seconds_total', 'Total time calls waited for a key with enough budget.')
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """
+    Upper-bound guess of the tokens used by a completion, reconciled with the real usage after the call.
+    Vietnamese text takes about one token per 2-3 characters.
+    """
+    return len(prompt) // 2 + max_tokens
+
+
+def backoff_delay(attempt: int, base: float = OPENAI_BACKOFF_BASE, cap: float = OPENAI_BACKOFF_MAX) -> float:
+    """
+    Exponential backoff with full jitter.
+
+    Example:
+        >>> 0 <= backoff_delay(3, base=0.5, cap=20) <= 4
+        True
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    return (
+        type(error).__name__ == "RateLimitError"
+        or getattr(error, "http_status", None) == 429
+        or getattr(error, "status", None) == 429
+    )
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously up to `capacity` per minute. The level may go negative
+    when a call used more than reserved, which delays the next calls accordingly.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        # a request larger than the whole bucket only needs a full bucket
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+
+class KeyState:
+    def __init__(self, key: str, rpm: int, tpm: int):
+        self.key = key
+        self.label = f"...{key[-4:]}"
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        self.consecutive_rate_limits = 0
+
+    def headroom(self) -> float:
+        return min(self.requests.level / self.requests.capacity, self.tokens.level / self.tokens.capacity)
+
+    def time_until_available(self, now: float, estimated_tokens: int) -> float:
+        return max(
+            self.cooldown_until - now,
+            self.requests.time_until(1),
+            self.tokens.time_until(estimated_tokens),
+        )
+
+
+class Lease:
+    """
+    Key reserved for one call. Set `used_tokens` from the response usage, to reconcile the token budget.
+    """
+
+    def __init__(self, key: str, estimated_tokens: int):
+        self.key = key
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens: Optional[int] = None
+
+
+class KeyScheduler:
+    """
+    Route each call to the API key with the most headroom. Each key has a requests and a tokens budget
+    (token buckets), and keys answering 429 are cooled down until they recover.
+
+    Example:
+        >>> scheduler = KeyScheduler(["sk-a", "sk-b"], rpm=60, tpm=1000)
+        >>> with scheduler.lease(estimated_tokens=600) as lease:
+        ...     # call the API with `api_key=lease.key`, then report the usage of the response
+        ...     lease.used_tokens = 100
+        >>> lease.key
+        'sk-a'
+        >>> round(scheduler.states[0].tokens.level)
+        900
+    """
+
+    def __init__(self, keys: List[str], rpm: int = OPENAI_KEY_RPM, tpm: int = OPENAI_KEY_TPM):
+        assert len(keys) > 0, "No API keys"
+        self._lock = threading.Lock()
+        self.states = [KeyState(key, rpm, tpm) for key in keys]
+        self._by_key: Dict[str, KeyState] = {state.key: state for state in self.states}
+
+    def _try_reserve(self, estimated_tokens: int) -> Tuple[Optional[str], float]:
+        """
+        Reserve budget on the key with the most headroom.
+
+        Returns:
+            key (Optional[str]): Reserved key, None if no key has enough budget.
+            wait (float): Seconds until a key should have enough budget, when no key was reserved.
+        """
+        with self._lock:
+            now = time.monotonic()
+            for state in self.states:
+                state.requests.refill(now)
+                state.tokens.refill(now)
+            available = [state for state in self.states if state.time_until_available(now, estimated_tokens) <= 0]
+            if len(available) == 0:
+                return None, min(state.time_until_available(now, estimated_tokens) for state in self.states)
+            chosen = max(available, key=lambda state: state.headroom())
+            chosen.requests.level -= 1
+            chosen.tokens.level -= estimated_tokens
+            for state in self.states:
+                self._report_utilization(state, now)
+            return chosen.key, 0.0
+
+    def acquire(self, estimated_tokens: int) -> str:
+        start = time.perf_counter()
+        key, wait = self._try_reserve(estimated_tokens)
+        while key is None:
+            time.sleep(min(wait, 1.0))
+            key, wait = self._try_reserve(estimated_tokens)
+        metrics.increment('openai_key_wait_seconds_total', time.perf_counter() - start)
+        return key
+
+    async def aacquire(self, estimated_tokens: int) -> str:
+        start = time.perf_counter()
+        key, wait = self._try_reserve(estimated_tokens)
+        while key is None:
+            await asyncio.sleep(min(wait, 1.0))
+            key, wait = self._try_reserve(estimated_tokens)
+        metrics.increment('openai_key_wait_seconds_total', time.perf_counter() - start)
+        return key
+
+    def release(self, lease: Lease, error: Optional[BaseException] = None, cancelled: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            state = self._by_key[lease.key]
+            if cancelled:
+                # the key did not fail, the reservation is kept unless the usage is known
+                if lease.used_tokens is not None:
+                    state.tokens.level += lease.estimated_tokens - lease.used_tokens
+                    metrics.increment('openai_key_tokens_total', lease.used_tokens, key=state.label)
+                metrics.increment('openai_key_requests_total', key=state.label, result='cancelled')
+            elif error is None:
+                state.consecutive_rate_limits = 0
+                if lease.used_tokens is not None:
+                    state.tokens.level += lease.estimated_tokens - lease.used_tokens
+                    metrics.increment('openai_key_tokens_total', lease.used_tokens, key=state.label)
+                metrics.increment('openai_key_requests_total', key=state.label, result='ok')
+            elif is_rate_limited(error):
+                state.consecutive_rate_limits += 1
+                cooldown = _retry_after(error) or min(
+                    OPENAI_KEY_MAX_COOLDOWN,
+                    OPENAI_KEY_COOLDOWN * 2 ** (state.consecutive_rate_limits - 1),
+                )
+                state.cooldown_until = max(state.cooldown_until, now + cooldown)
+                logging.warning(f"API key {state.label} rate limited, cooling down for {cooldown:.1f}s")
+                metrics.increment('openai_key_requests_total', key=state.label, result='rate_limited')
+            else:
+                metrics.increment('openai_key_requests_total', key=state.label, result='error')
+            self._report_utilization(state, now)
+
+    def _report_utilization(self, state: KeyState, now: float) -> None:
+        utilization = 1.0 if state.cooldown_until > now else 1 - max(0.0, state.headroom())
+        metrics.set_gauge('openai_key_utilization', round(utilization, 4), key=state.label)
+
+    @contextmanager
+    def lease(self, estimated_tokens: int):
+        lease = Lease(self.acquire(estimated_tokens), estimated_tokens)
+        try:
+            yield lease
+        except GeneratorExit:
+            # a stream closed by its consumer before the end
+            self.release(lease, cancelled=True)
+            raise
+        except BaseException as e:
+            self.release(lease, e)
+            raise
+        self.release(lease)
+
+    @asynccontextmanager
+    async def alease(self, estimated_tokens: int):
+        lease = Lease(await self.aacquire(estimated_tokens), estimated_tokens)
+        try:
+            yield lease
+        except (GeneratorExit, asyncio.CancelledError):
+            # a closed stream, or a cancelled task (e.g. an ensemble straggler or a client gone)
+            self.release(lease, cancelled=True)
+            raise
+        except BaseException as e:
+            self.release(lease, e)
+            raise
+        self.release(lease)
+
+
+_scheduler: Optional[KeyScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_key_scheduler() -> KeyScheduler:
+    """
+    Get the process-wide scheduler of the OPENAI_API_KEYS.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = KeyScheduler([key.strip() for key in os.getenv("OPENAI_API_KEYS").split(',') if key.strip()])
+    return _scheduler
@@ -1,42 +1,144 @@
+import os
+import copy
+import queue
+import atexit
+import random
 import logging
+import threading
+import contextvars
+from typing import Optional
 from pprint import pformat
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+LOG_LEVEL = (os.getenv("LOG_LEVEL") or "INFO").upper()
+# records waiting to be written, records logged while the queue is full are dropped instead of blocking the request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE") or 10000)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES") or 50 * 2 ** 20)
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT") or 5)
+# share of the requests whose full prompts and completions are logged, see `log_prompt`
+LOG_PROMPT_SAMPLE_RATE = float(os.getenv("LOG_PROMPT_SAMPLE_RATE") or 0.05)
+
+FORMAT = "%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s"
+DATE_FORMAT = "%d-%m-%y %H:%M:%S"
+
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+_capture_prompts: contextvars.ContextVar = contextvars.ContextVar("capture_prompts", default=None)
+
+metrics.describe('log_records_dropped_total', 'Log records dropped because the logging queue was full, by level.')
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler that drops records when the queue is full rather than blocking the request thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the handlers of the listener format the message and the traceback, off the request thread
+        return copy.copy(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('log_records_dropped_total', level=record.levelname)
+
+
+def _setup(*handlers: logging.Handler) -> None:
+    global _listener
+    formatter = logging.Formatter(FORMAT, DATE_FORMAT)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+            handler.close()
+        # request threads only enqueue records, file and console I/O happens in the listener thread
+        root.addHandler(DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE)))
+        root.setLevel(LOG_LEVEL)
+        _listener = QueueListener(root.handlers[0].queue, *handlers, respect_handler_level=True)
+        _listener.start()
 
 
 def setup_logging(filename):
-    stream_handler = logging.StreamHandler()
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-    logging.basicConfig(
-        filename=filename,
-        filemode="a",
-        level=logging.INFO,
-        format='%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-        datefmt="%d-%m-%y %H:%M:%S",
-    )
-    stream_handler.setFormatter(
-        logging.Formatter("%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s", "%d-%m-%y %H:%M:%S")
+    if not filename:
+        # e.g. several worker processes, each rotating the same file would lose records
+        _setup(logging.StreamHandler())
+        return
+    _setup(
+        RotatingFileHandler(filename, mode="a", maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"),
+        logging.StreamHandler(),
     )
-    logging.getLogger().addHandler(stream_handler)
 
 
 def setup_logging_display_only():
-    stream_handler = logging.StreamHandler()
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s",
-        datefmt="%d-%m-%y %H:%M:%S",
-    )
-    stream_handler.setFormatter(
-        logging.Formatter("%(asctime)s,%(msecs)03d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s", "%d-%m-%y %H:%M:%S")
-    )
-    logging.getLogger().addHandler(stream_handler)
+    _setup(logging.StreamHandler())
+
+
+def stop_logging() -> None:
+    """
+    Write the queued records and stop the listener thread.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _restart_after_fork() -> None:
+    global _listener, _listener_lock
+    # the listener thread is not copied by fork(), and the queue may have been locked by it
+    _listener_lock = threading.Lock()
+    if _listener is not None:
+        handlers = _listener.handlers
+        _listener = None
+        _setup(*handlers)
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def start_prompt_capture() -> bool:
+    """
+    Decide whether the full prompts and completions of the current request are logged, so that a sampled
+    request has all of them. Without it, each `log_prompt` call is sampled on its own.
+    """
+    capture = random.random() < LOG_PROMPT_SAMPLE_RATE
+    _capture_prompts.set(capture)
+    return capture
+
+
+def log_prompt(label: str, text: str) -> None:
+    """
+    Log a prompt or a completion in full for a sample of the requests (LOG_PROMPT_SAMPLE_RATE),
+    and only its size at DEBUG level otherwise.
+
+    Example:
+        >>> log_prompt("Model input", "Translate from Vietnamese into English:\\nXin chào")
+    """
+    capture = _capture_prompts.get()
+    if capture is None:
+        capture = random.random() < LOG_PROMPT_SAMPLE_RATE
+    if capture:
+        logging.info("%s: \n%s", label, text, stacklevel=2)
+    else:
+        logging.debug("%s: %d chars", label, len(text), stacklevel=2)
 
 
 def pprint(obj):
-    logging.info(pformat(obj, indent=4))
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(pformat(obj, indent=4), stacklevel=2)
 
 def print(*obj):
-    message = " ".join([str(o) for o in obj])
-    logging.info(message)
\ No newline at end of file
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(" ".join([str(o) for o in obj]), stacklevel=2)
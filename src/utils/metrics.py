@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+from dotenv import load_dotenv
+load_dotenv()
+
+# directory shared by the worker processes, each one writes its metrics there and /metrics renders their sum.
+# Unset, /metrics only shows the metrics of the process serving the scrape
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL") or 5)
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+_gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+_buckets: Dict[str, Tuple[float, ...]] = {}
+_descriptions: Dict[str, str] = {}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def describe(name: str, description: str) -> None:
+    """
+    Set the `# HELP` line of a metric.
+    """
+    _descriptions[name] = description
+
+
+def increment(name: str, value: float = 1.0, **labels: str) -> None:
+    """
+    Increment a counter.
+
+    Example:
+    >>> increment("speculative_action_params_total", result="hit")
+    >>> get("speculative_action_params_total", result="hit")
+    1.0
+    """
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _counters[key] += value
+
+
+def add_gauge(name: str, value: float, **labels: str) -> None:
+    """
+    Add to a gauge, `value` may be negative.
+
+    Example:
+    >>> add_gauge("upstream_in_flight", 1, upstream="openai")
+    >>> add_gauge("upstream_in_flight", -1, upstream="openai")
+    >>> get("upstream_in_flight", upstream="openai")
+    0.0
+    """
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _gauges[key] += value
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS, **labels: str) -> None:
+    """
+    Record a value in a histogram. The buckets are fixed by the first observation of the metric.
+
+    Example:
+    >>> observe("stage_duration_seconds", 0.42, stage="intent")
+    """
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        bounds = _buckets.setdefault(name, tuple(sorted(buckets)))
+        # per bucket counts, then sum and count
+        histogram = _histograms.setdefault(key, [0.0] * (len(bounds) + 2))
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def get(name: str, **labels: str) -> float:
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        if key in _gauges:
+            return _gauges[key]
+        if key in _histograms:
+            return _histograms[key][-1]
+        return _counters.get(key, 0.0)
+
+
+def render_prometheus() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format, summed over the processes writing to METRICS_DIR.
+    """
+    if METRICS_DIR:
+        flush()
+        counters, gauges, histograms, buckets = _load_dir()
+    else:
+        with _lock:
+            counters, gauges, histograms, buckets = dict(_counters), dict(_gauges), {key: list(value) for key, value in _histograms.items()}, dict(_buckets)
+    items = sorted(
+        [(key, value, "counter") for key, value in counters.items()]
+        + [(key, value, "gauge") for key, value in gauges.items()]
+        + [(key, value, "histogram") for key, value in histograms.items()]
+    )
+    lines: List[str] = []
+    last_name = None
+    for (name, labels), value, metric_type in items:
+        if name != last_name:
+            if name in _descriptions:
+                lines.append(f"# HELP {name} {_descriptions[name]}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            last_name = name
+        if metric_type == "histogram":
+            cumulative = 0.0
+            for bound, count in zip(buckets[name], value):
+                cumulative += count
+                lines.append(_render_sample(f"{name}_bucket", labels + (("le", str(bound)),), cumulative))
+            lines.append(_render_sample(f"{name}_bucket", labels + (("le", "+Inf"),), value[-1]))
+            lines.append(_render_sample(f"{name}_sum", labels, value[-2]))
+            lines.append(_render_sample(f"{name}_count", labels, value[-1]))
+            continue
+        lines.append(_render_sample(name, labels, value))
+    return "\n".join(lines) + "\n"
+
+
+def _get_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def flush(gauges: bool = True) -> None:
+    """
+    Write the metrics of this process to METRICS_DIR, if set. Gauges are left out once the process is gone.
+    """
+    if not METRICS_DIR:
+        return
+    with _lock:
+        snapshot = {
+            "counters": [[name, labels, value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, labels, value] for (name, labels), value in _gauges.items()] if gauges else [],
+            "histograms": [[name, labels, value] for (name, labels), value in _histograms.items()],
+            "buckets": _buckets,
+        }
+        data = json.dumps(snapshot)
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _get_path(os.getpid())
+    # the scraping worker must never read a half-written file
+    with open(f"{path}.tmp", "w") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Drop the gauges of an exited worker process, its counters and histograms keep counting in the sum.
+    Called by the gunicorn master, see gunicorn.conf.py.
+    """
+    if not METRICS_DIR or not os.path.isfile(_get_path(pid)):
+        return
+    with open(_get_path(pid)) as f:
+        snapshot = json.load(f)
+    snapshot["gauges"] = []
+    with open(f"{_get_path(pid)}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{_get_path(pid)}.tmp", _get_path(pid))
+
+
+def _load_dir() -> Tuple[Dict, Dict, Dict, Dict]:
+    counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+    gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = defaultdict(float)
+    histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+    buckets: Dict[str, Tuple[float, ...]] = {}
+    for file_name in os.listdir(METRICS_DIR):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, file_name)) as f:
+                snapshot: Dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in snapshot["counters"]:
+            counters[(name, tuple(map(tuple, labels)))] += value
+        for name, labels, value in snapshot["gauges"]:
+            gauges[(name, tuple(map(tuple, labels)))] += value
+        for name, bounds in snapshot["buckets"].items():
+            buckets.setdefault(name, tuple(bounds))
+        for name, labels, value in snapshot["histograms"]:
+            histogram = histograms.setdefault((name, tuple(map(tuple, labels))), [0.0] * len(value))
+            for i, count in enumerate(value):
+                histogram[i] += count
+    return counters, gauges, histograms, buckets
+
+
+def _flush_periodically() -> None:
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _reset_after_fork() -> None:
+    global _lock
+    _lock = threading.Lock()
+    if not METRICS_DIR:
+        return
+    # the parent's metrics are already in its own file, a worker starts from zero not to count them twice
+    _counters.clear()
+    _gauges.clear()
+    _histograms.clear()
+    threading.Thread(target=_flush_periodically, name="metrics-flush", daemon=True).start()
+
+
+def _render_sample(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}"
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
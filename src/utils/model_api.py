@@ -1,83 +1,175 @@
-import requests
 import json
 import os
+import asyncio
 import openai
-from functools import lru_cache, wraps
-from itertools import cycle
-from typing import List, Dict, Any, Union, Literal, Tuple, Optional
+from functools import wraps
+from typing import List, Dict, Any, Union, Literal, Tuple, Optional, Iterator
 from time import sleep
 import logging
 from dotenv import load_dotenv
 load_dotenv()
+from src.utils import completion_cache, key_scheduler, http_session, tracing
+from src.utils.prompt_prefix import split_prompt_prefix
+from src.utils.executor import get_limiter
 
 MODEL_API_URL = "model_api:80"
+# generation is slow, wait longer than the default read timeout
+MODEL_API_READ_TIMEOUT = float(os.getenv("MODEL_API_READ_TIMEOUT") or 120)
+http_session.install()
+COMPLETION_MODEL = "text-davinci-003"
 api_keys = os.getenv("OPENAI_API_KEYS").split(',')
-logging.info(f"api_keys: {api_keys}")
-api_keys_cycle = cycle(api_keys)
+logging.info(f"Using {len(api_keys)} OpenAI API keys")
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES") or 6)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.Timeout,
+                          openai.error.APIConnectionError, openai.error.TryAgain)):
+        return True
+    status = getattr(error, "http_status", None)
+    return isinstance(error, openai.error.APIError) and (status is None or status == 429 or status >= 500)
+
 
 def handle_api_errors(max_retries=3):
+    """
+    Retry transient OpenAI errors (429, 5xx, timeouts) with bounded exponential backoff and jitter.
+    Rate limited keys are cooled down by the key scheduler, so the retry goes to another key.
+    """
     def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                for attempt in range(max_retries):
+                    try:
+                        return await func(*args, **kwargs)
+                    except Exception as e:
+                        if not _is_retryable(e):
+                            raise e
+                        if attempt == max_retries - 1:
+                            raise Exception(f"API usage limit reached. Tried {max_retries} times.") from e
+                        delay = key_scheduler.backoff_delay(attempt)
+                        logging.warning(f"OpenAI error: {e}. Retrying in {delay:.2f}s ({attempt + 1}/{max_retries})")
+                        await asyncio.sleep(delay)
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
+            for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
-                except openai.error.APIError as e:
-                    if e.status == 429:
-                        print("Error: ", e)
-                        print("API usage limit reached. Switching to the next API key.")
-                        return wrapper(*args, **kwargs)
-                    raise e
-            sleep(5)
-            retries = 0
-            while retries < max_retries:
-                try:
-                    return func(*args, **kwargs)
-                except openai.error.APIError as e:
-                    if e.status == 429:
-                        print("Error: ", e)
-                        print("API usage limit reached. Switching to the next API key.")
-                        return wrapper(*args, **kwargs)
-                    raise e
-            raise Exception(f"API usage limit reached. Tried {max_retries * 2} times.")
+                except Exception as e:
+                    if not _is_retryable(e):
+                        raise e
+                    if attempt == max_retries - 1:
+                        raise Exception(f"API usage limit reached. Tried {max_retries} times.") from e
+                    delay = key_scheduler.backoff_delay(attempt)
+                    logging.warning(f"OpenAI error: {e}. Retrying in {delay:.2f}s ({attempt + 1}/{max_retries})")
+                    sleep(delay)
         return wrapper
     return decorator
 
 def generate(inputs: str, temperature: float) -> str:
-    return requests.post(
-        f"http://{MODEL_API_URL}/v1/completions",
-        headers={'Content-Type': 'application/json'},
-        data=json.dumps({
-            'prompt': inputs,
-            "min_tokens": 30,
-            "max_tokens": 96,
-            "temperature": temperature,
-            # "n": int, 
-        })
-    ).json()['choices'][0]['text']
-
-def generate_torchserve(inputs: str, temperature: float) -> str:
-    data = requests.post(
-        f"http://{MODEL_API_URL}/predictions/bloomz-3b",
-        headers={'Content-Type': 'application/json'},
-        data=json.dumps({
-            'prompt': inputs,
-            'echo': True,
-        })
-    ).json()
+    with get_limiter("model_api").limit():
+        response = http_session.get_session().post(
+            f"http://{MODEL_API_URL}/v1/completions",
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps({
+                'prompt': inputs,
+                "min_tokens": 30,
+                "max_tokens": 96,
+                "temperature": temperature,
+                # "n": int, 
+            }),
+            timeout=(http_session.HTTP_CONNECT_TIMEOUT, MODEL_API_READ_TIMEOUT),
+        )
+    return response.json()['choices'][0]['text']
+
+def _get_torchserve_body(
+        inputs: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[Tuple[str]] = None,
+        preset: Optional[Literal["intent", "answer"]] = None,
+        **kwargs: Any,
+    ) -> str:
+    prefix, prompt = split_prompt_prefix(inputs)
+    body = {
+        'prefix': prefix,
+        'prompt': prompt,
+        'temperature': temperature,
+        'max_tokens': max_tokens,
+        'stop': stop,
+        'preset': preset,
+        **kwargs,
+    }
+    return json.dumps({key: value for key, value in body.items() if value is not None})
+
+def generate_torchserve(
+        inputs: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[Tuple[str]] = None,
+        preset: Optional[Literal["intent", "answer"]] = None,
+    ) -> str:
+    """
+    Call the self-hosted model. Without a `preset`, temperature 0 decodes greedily and a positive temperature samples,
+    unset arguments fall back to the preset, then to the defaults of the handler (4-beam search).
+    A registered prompt prefix (see `register_prompt_prefix`) is sent apart, to reuse its cached attention keys/values,
+    which the handler only does for single-beam decoding (a preset or a temperature).
+    Not called by the app yet, which completes with the OpenAI API, so the prefix cache of the handler is dormant.
+
+    Example:
+        >>> generate_torchserve("Tao muốn chuyển khoản cho Nam 300k", preset="intent")  # doctest: +SKIP
+    """
+    with get_limiter("model_api").limit():
+        response = http_session.get_session().post(
+            f"http://{MODEL_API_URL}/predictions/bloomz-3b",
+            headers={'Content-Type': 'application/json'},
+            data=_get_torchserve_body(inputs, temperature, max_tokens, stop, preset, echo=True),
+            timeout=(http_session.HTTP_CONNECT_TIMEOUT, MODEL_API_READ_TIMEOUT),
+        )
+    data = response.json()
     print(f'generate_torchserve: {data}')
     return data['text']
 
-@lru_cache(maxsize=1024)
-@handle_api_errors(max_retries=len(api_keys))
-def generate_general_call_chatgpt_api(
+def stream_generate_torchserve(
         inputs: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[Tuple[str]] = None,
+        preset: Optional[Literal["intent", "answer"]] = None,
+    ) -> Iterator[str]:
+    """
+    Streaming variant of `generate_torchserve`. Yields the completion while it is generated, without the prompt.
+    Beam search decoding falls back to greedy, the handler cannot stream it.
+
+    Example:
+        >>> for delta in stream_generate_torchserve("Tạo kế hoạch ngân sách hàng tháng.", preset="answer"):  # doctest: +SKIP
+        ...     print(delta, end="")
+    """
+    with get_limiter("model_api").limit():
+        response = http_session.get_session().post(
+            f"http://{MODEL_API_URL}/predictions/bloomz-3b",
+            headers={'Content-Type': 'application/json'},
+            data=_get_torchserve_body(inputs, temperature, max_tokens, stop, preset, stream=True),
+            timeout=(http_session.HTTP_CONNECT_TIMEOUT, MODEL_API_READ_TIMEOUT),
+            stream=True,
+        )
+        with response:
+            response.raise_for_status()
+            # one JSON message per line, the last one also has the finish reason and usage
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    text = json.loads(line)['text']
+                    if text:
+                        yield text
+
+def _get_completion_params(
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
         max_tokens: int = 64,
         stop: Optional[Tuple[str]] = None,
-    ) -> str:
+    ) -> Dict[str, Any]:
     params = {}
     # either of temperature or top_p must be specified
     if temperature is not None:
@@ -90,13 +182,169 @@ def generate_general_call_chatgpt_api(
         params['stop'] = stop
 
     params['max_tokens'] = max_tokens
-    res = openai.Completion.create(
-        model="text-davinci-003",
-        prompt=inputs,
-        **params,
-        api_key=next(api_keys_cycle),
-    )
+    return params
+
+def generate_general_call_chatgpt_api(
+        inputs: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: int = 64,
+        stop: Optional[Tuple[str]] = None,
+        cache: Optional[bool] = None,
+    ) -> str:
+    """
+    Call the completion API. Results are kept in the shared completion cache, by default only for deterministic calls (temperature=0).
+    Pass `cache=True` or `cache=False` to override.
+    """
+    params = _get_completion_params(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+    cache_backend, key = _get_cache(inputs, params, cache)
+    if cache_backend is not None:
+        response = cache_backend.get(key)
+        if response is not None:
+            return response
+
+    response = _create_completion(inputs, params)
+    if cache_backend is not None:
+        cache_backend.set(key, response)
+    return response
+
+async def agenerate_general_call_chatgpt_api(
+        inputs: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: int = 64,
+        stop: Optional[Tuple[str]] = None,
+        cache: Optional[bool] = None,
+    ) -> str:
+    """
+    Async variant of `generate_general_call_chatgpt_api`, does not block the event loop while waiting for OpenAI.
+    """
+    params = _get_completion_params(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+    cache_backend, key = _get_cache(inputs, params, cache)
+    if cache_backend is not None:
+        response = cache_backend.get(key)
+        if response is not None:
+            return response
+
+    response = await _acreate_completion(inputs, params)
+    if cache_backend is not None:
+        cache_backend.set(key, response)
+    return response
+
+def stream_general_call_chatgpt_api(
+        inputs: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: int = 64,
+        stop: Optional[Tuple[str]] = None,
+        cache: Optional[bool] = None,
+    ) -> Iterator[str]:
+    """
+    Streaming variant of `generate_general_call_chatgpt_api`, yields the completion as text deltas.
+    A cached completion is yielded at once.
+
+    Example:
+        >>> "".join(stream_general_call_chatgpt_api("Hello", temperature=0)) == generate_general_call_chatgpt_api("Hello", temperature=0)  # doctest: +SKIP
+        True
+    """
+    params = _get_completion_params(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+    cache_backend, key = _get_cache(inputs, params, cache)
+    if cache_backend is not None:
+        response = cache_backend.get(key)
+        if response is not None:
+            yield response
+            return
+
+    chunks = []
+    for chunk in _stream_completion(inputs, params):
+        chunks.append(chunk)
+        yield chunk
+    if cache_backend is not None:
+        cache_backend.set(key, "".join(chunks))
+
+def is_cached(
+        inputs: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        max_tokens: int = 64,
+        stop: Optional[Tuple[str]] = None,
+        cache: Optional[bool] = None,
+    ) -> bool:
+    """
+    Whether the same call to `generate_general_call_chatgpt_api` would be answered from the completion cache.
+    """
+    params = _get_completion_params(temperature=temperature, top_p=top_p, max_tokens=max_tokens, stop=stop)
+    cache_backend, key = _get_cache(inputs, params, cache)
+    return cache_backend is not None and cache_backend.contains(key)
+
+def _get_cache(inputs: str, params: Dict[str, Any], cache: Optional[bool]) -> Tuple[Optional[completion_cache.CompletionCache], Optional[str]]:
+    if cache is None:
+        cache = completion_cache.is_cacheable(temperature=params.get('temperature'), top_p=params.get('top_p'))
+    if not cache:
+        return None, None
+    cache_backend = completion_cache.get_completion_cache()
+    if cache_backend is None:
+        return None, None
+    return cache_backend, completion_cache.get_key(inputs, model=COMPLETION_MODEL, **params)
+
+@handle_api_errors(max_retries=OPENAI_MAX_RETRIES)
+def _create_completion(inputs: str, params: Dict[str, Any]) -> str:
+    estimated_tokens = key_scheduler.estimate_tokens(inputs, params['max_tokens'])
+    with get_limiter("openai").limit(), key_scheduler.get_key_scheduler().lease(estimated_tokens) as lease:
+        res = openai.Completion.create(
+            model=COMPLETION_MODEL,
+            prompt=inputs,
+            **params,
+            api_key=lease.key,
+        )
+        usage = res.get('usage', {})
+        lease.used_tokens = usage.get('total_tokens')
+    tracing.add_tokens(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+    # stop reason
+    logging.info(f"stop reason: {res['choices'][0]['finish_reason']}")
+    response = res['choices'][0]['text']
+    return response
+
+@handle_api_errors(max_retries=OPENAI_MAX_RETRIES)
+async def _acreate_completion(inputs: str, params: Dict[str, Any]) -> str:
+    estimated_tokens = key_scheduler.estimate_tokens(inputs, params['max_tokens'])
+    async with get_limiter("openai").alimit(), key_scheduler.get_key_scheduler().alease(estimated_tokens) as lease:
+        res = await openai.Completion.acreate(
+            model=COMPLETION_MODEL,
+            prompt=inputs,
+            **params,
+            api_key=lease.key,
+        )
+        usage = res.get('usage', {})
+        lease.used_tokens = usage.get('total_tokens')
+    tracing.add_tokens(usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
     # stop reason
     logging.info(f"stop reason: {res['choices'][0]['finish_reason']}")
     response = res['choices'][0]['text']
     return response
+
+def _stream_completion(inputs: str, params: Dict[str, Any]) -> Iterator[str]:
+    # same retry policy as `handle_api_errors`, but only until the first delta was yielded
+    estimated_tokens = key_scheduler.estimate_tokens(inputs, params['max_tokens'])
+    for attempt in range(OPENAI_MAX_RETRIES):
+        started = False
+        try:
+            with get_limiter("openai").limit(), key_scheduler.get_key_scheduler().lease(estimated_tokens) as lease:
+                for res in openai.Completion.create(
+                    model=COMPLETION_MODEL,
+                    prompt=inputs,
+                    **params,
+                    stream=True,
+                    api_key=lease.key,
+                ):
+                    started = True
+                    yield res['choices'][0]['text']
+            return
+        except Exception as e:
+            if started or not _is_retryable(e):
+                raise e
+            if attempt == OPENAI_MAX_RETRIES - 1:
+                raise Exception(f"API usage limit reached. Tried {OPENAI_MAX_RETRIES} times.") from e
+            delay = key_scheduler.backoff_delay(attempt)
+            logging.warning(f"OpenAI error: {e}. Retrying in {delay:.2f}s ({attempt + 1}/{OPENAI_MAX_RETRIES})")
+            sleep(delay)
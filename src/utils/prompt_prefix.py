@@ -0,0 +1,40 @@
+import threading
+from typing import Optional, Set, Tuple
+
+_prefixes: Set[str] = set()
+_prefixes_lock = threading.Lock()
+
+
+def register_prompt_prefix(prefix: str) -> str:
+    """
+    Declare the static beginning of a prompt template. Prompts sent to the self-hosted model starting with it
+    are split into the prefix and the rest, so that the handler can reuse the cached attention keys/values of the prefix.
+
+    Returns:
+        prefix (str): The registered prefix, to build the template with.
+
+    Example:
+        >>> SCRIPT = register_prompt_prefix("A\\n")
+        >>> SCRIPT + "B"
+        'A\\nB'
+    """
+    with _prefixes_lock:
+        _prefixes.add(prefix)
+    return prefix
+
+
+def split_prompt_prefix(prompt: str) -> Tuple[Optional[str], str]:
+    """
+    Split a prompt into its longest registered prefix, if any, and the rest.
+
+    Example:
+        >>> _ = register_prompt_prefix("A\\n")
+        >>> split_prompt_prefix("A\\nB")
+        ('A\\n', 'B')
+        >>> split_prompt_prefix("Hello")
+        (None, 'Hello')
+    """
+    prefix = max((prefix for prefix in _prefixes if prompt.startswith(prefix)), key=len, default=None)
+    if prefix is None:
+        return None, prompt
+    return prefix, prompt[len(prefix):]
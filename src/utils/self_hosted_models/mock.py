@@ -1,24 +1,26 @@
+import asyncio
 import requests
-from flask import jsonify, request
+from quart import jsonify, request
 from .entities import Conversation
 from .prompt_factory import MODE
 from .model_api import generate
 
 def mock_app(app):
     @app.route('/mock/chat', methods=['POST'])
-    def chat_mock():
-        _ = request.json.get('model', 'gpt4all')
-        temperature = request.json.get('temperature', 0.7)
-        messages = request.json.get('messages', [])
-        n_predict = request.json.get('max_num_words', 64)
-        stream = request.json.get('stream', False)
-        stream_json = request.json.get('stream_json', False)
-        userInfo = request.json.get('userInfo', {"status": None})
+    async def chat_mock():
+        body = await request.get_json()
+        _ = body.get('model', 'gpt4all')
+        temperature = body.get('temperature', 0.7)
+        messages = body.get('messages', [])
+        n_predict = body.get('max_num_words', 64)
+        stream = body.get('stream', False)
+        stream_json = body.get('stream_json', False)
+        userInfo = body.get('userInfo', {"status": None})
         if stream:
             return jsonify({'error': 'Stream mode is not supported.'})
         if not messages:
             return jsonify({'error': 'No messages provided.'})
-        logging.info(f"Received request: {request.json}")
+        logging.info(f"Received request: {body}")
 
         # Get chat answer
         conversation = Conversation({'command': MODE['chat'], 'messages': messages, 'userInfo': userInfo})
@@ -47,25 +49,26 @@ def mock_app(app):
         })
 
     @app.route('/mock/detect-intent', methods=['POST'])
-    def detect_intent_mock():
-        _ = request.json.get('model', 'gpt4all')
-        temperature = request.json.get('temperature', 0.7)
-        command = request.json.get('command', 'chat')
-        messages = request.json.get('messages', [])
-        n_predict = request.json.get('max_num_words', 64)
-        stream = request.json.get('stream', False)
-        stream_json = request.json.get('stream_json', False)
-        userInfo = request.json.get('userInfo', {"status": None})
+    async def detect_intent_mock():
+        body = await request.get_json()
+        _ = body.get('model', 'gpt4all')
+        temperature = body.get('temperature', 0.7)
+        command = body.get('command', 'chat')
+        messages = body.get('messages', [])
+        n_predict = body.get('max_num_words', 64)
+        stream = body.get('stream', False)
+        stream_json = body.get('stream_json', False)
+        userInfo = body.get('userInfo', {"status": None})
         if stream:
             return jsonify({'error': 'Stream mode is not supported.'})
         if not messages:
             return jsonify({'error': 'No messages provided.'})
-        logging.info(f"Received request: {request.json}")
+        logging.info(f"Received request: {body}")
         conversation = Conversation({'command': MODE[command], 'messages': messages, 'userInfo': userInfo})
         input = conversation.raw_conversation
         logging.info(f"Input: {input}")
 
-        raw_intent = generate(input, temperature)
+        raw_intent = await asyncio.to_thread(generate, input, temperature)
         
         logging.info(f"Raw_intent: {raw_intent}")
         intent = conversation.extract_intent(raw_intent)
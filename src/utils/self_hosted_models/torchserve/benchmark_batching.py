@@ -0,0 +1,127 @@
+"""
+Throughput of the TorchServe handler (generated tokens/sec) by batch size, on CPU with a tiny causal LM.
+By default the model and tokenizer are built offline with random weights, so it runs in CI without GPU or network.
+
+Usage:
+    python benchmark_batching.py --batch-sizes 1 2 4 8 --max-tokens 32
+    python benchmark_batching.py --model sshleifer/tiny-gpt2
+    python benchmark_batching.py --preset intent --batch-sizes 1
+    python benchmark_batching.py --preset intent --prefix
+"""
+import os
+import sys
+import time
+import argparse
+
+import torch
+from tabulate import tabulate
+from transformers import AutoModelForCausalLM, AutoTokenizer, BloomConfig, BloomForCausalLM, PreTrainedTokenizerFast
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from torchserve_handler import SETUP_CONFIG, TransformersSeqClassifierHandler, apply_precision
+
+PROMPTS = [
+    "Tao muốn chuyển khoản cho Nam 6966 k VND tiền bún đậu",
+    "Tạo kế hoạch ngân sách hàng tháng.",
+    "Mình muốn biết nếu mình tiết kiệm 20 năm thì sẽ có bao nhiêu",
+    "I want to create a chat group with Cuong, Minh, and Tuan.",
+    "Tài khoản của tao còn bao nhiêu tiền?",
+    "Compare Bank of America, Coca Cola, and Apple",
+    "Chuyển mỗi người 100k tiền mừng năm mới.",
+    "I own Amazon. What is their earning per share?",
+]
+# static instructions in front of every prompt, as in the prompts of the app
+PREAMBLE = "Examples:\n" + "\n".join(f"- User: {prompt}" for prompt in PROMPTS) + "\n## Real conversation:\n"
+
+
+def build_tiny_model():
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+
+    tokenizer = Tokenizer(models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.train_from_iterator(PROMPTS * 10, trainers.BpeTrainer(
+        vocab_size=512,
+        special_tokens=["<pad>", "<unk>", "</s>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="</s>", unk_token="<unk>")
+
+    torch.manual_seed(0)
+    # same architecture as bloomz, with nn.Linear layers for int8 quantization
+    model = BloomForCausalLM(BloomConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=256,
+        n_layer=4,
+        n_head=8,
+        eos_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.eos_token_id,
+    ))
+    # never sample EOS, so every request generates its whole budget
+    model.lm_head.register_forward_hook(lambda module, inputs, output: output.index_fill(-1, torch.tensor([tokenizer.eos_token_id]), -1e4))
+    return model, tokenizer
+
+
+def get_handler(model_name=None, precision="fp32") -> TransformersSeqClassifierHandler:
+    if model_name is None:
+        model, tokenizer = build_tiny_model()
+    else:
+        model, tokenizer = AutoModelForCausalLM.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name)
+    handler = TransformersSeqClassifierHandler()
+    handler.setup_config = {**SETUP_CONFIG, "precision": precision}
+    handler.device = torch.device("cpu")
+    handler.model = apply_precision(model, precision, handler.device).eval()
+    handler.tokenizer = tokenizer
+    handler._setup_tokenizer()
+    handler.initialized = True
+    return handler
+
+
+def run_batch(handler, requests):
+    outputs = handler.inference(handler.preprocess(requests))
+    handler.postprocess(outputs)
+    return sum(output["usage"]["completion_tokens"] for output in outputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Pretrained causal LM, a random tiny bloom if not set")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=None, help="Completion budget, 32 or the one of the preset if not set")
+    parser.add_argument("--requests", type=int, default=16, help="Requests served per batch size")
+    parser.add_argument("--preset", default=None, help="Decoding preset of the requests (intent, answer), 4-beam search if not set")
+    parser.add_argument("--prefix", action="store_true", help="Send a static preamble as a cached prompt prefix")
+    args = parser.parse_args()
+
+    handler = get_handler(args.model)
+    requests = [
+        {"body": {
+            "prompt": PROMPTS[i % len(PROMPTS)],
+            "max_tokens": args.max_tokens or (None if args.preset else 32),
+            "preset": args.preset,
+            "prefix": PREAMBLE if args.prefix else None,
+        }}
+        for i in range(args.requests)
+    ]
+    # warm up
+    run_batch(handler, requests[:1])
+
+    rows = []
+    baseline = None
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        tokens = 0
+        for i in range(0, len(requests), batch_size):
+            tokens += run_batch(handler, requests[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        throughput = tokens / elapsed
+        baseline = baseline or throughput
+        latency = elapsed / len(range(0, len(requests), batch_size))
+        rows.append([batch_size, tokens, f"{elapsed:.2f}", f"{latency * 1000:.0f}", f"{throughput:.1f}", f"{throughput / baseline:.2f}x"])
+
+    print(tabulate(rows, headers=["batch size", "tokens", "seconds", "ms/batch", "tokens/sec", "speedup"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-batch logging overhead of the TorchServe handler, by "log_mode" (see setup_config.json), with INFO logs
+written to a file as TorchServe does. Generation is kept short, so that the pre/post-processing dominates.
+
+Usage:
+    python benchmark_logging.py --batch-size 8 --prompt-repeat 8
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+
+from tabulate import tabulate
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_batching import PREAMBLE, PROMPTS, get_handler
+
+
+def time_batches(handler, requests, batch_size):
+    timings = {"preprocess": 0.0, "inference": 0.0, "postprocess": 0.0}
+    for i in range(0, len(requests), batch_size):
+        start = time.perf_counter()
+        input_batch = handler.preprocess(requests[i:i + batch_size])
+        preprocessed = time.perf_counter()
+        outputs = handler.inference(input_batch)
+        inferred = time.perf_counter()
+        handler.postprocess(outputs)
+        timings["preprocess"] += preprocessed - start
+        timings["inference"] += inferred - preprocessed
+        timings["postprocess"] += time.perf_counter() - inferred
+    batches = len(range(0, len(requests), batch_size))
+    return {stage: seconds * 1000 / batches for stage, seconds in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Pretrained causal LM, a random tiny bloom if not set")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=4)
+    parser.add_argument("--prompt-repeat", type=int, default=8, help="Times the preamble is repeated in each prompt")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--log-file", default=os.devnull)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.log_file, level=logging.INFO)
+    handler = get_handler(args.model)
+    requests = [
+        {"body": {
+            "prompt": PREAMBLE * args.prompt_repeat + PROMPTS[i % len(PROMPTS)],
+            "max_tokens": args.max_tokens,
+            "profile": "greedy",
+        }}
+        for i in range(args.requests)
+    ]
+
+    rows = []
+    for log_mode in ["verbose", "structured"]:
+        handler.setup_config["log_mode"] = log_mode
+        # warm up
+        time_batches(handler, requests[:args.batch_size], args.batch_size)
+        timings = time_batches(handler, requests, args.batch_size)
+        rows.append([log_mode, *[f"{timings[stage]:.1f}" for stage in timings], f"{sum(timings.values()):.1f}"])
+
+    print(tabulate(rows, headers=["log mode", "preprocess ms", "inference ms", "postprocess ms", "total ms/batch"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Load time, peak memory, weights size and throughput (generated tokens/sec) of the TorchServe handler on CPU, by
+serving precision (see "precision" in setup_config.json), against the fp32 baseline.
+The model is saved to a model directory and loaded by the handler's `initialize`, as TorchServe does, in a new
+process per precision, so that the peak RSS of one precision does not hide the one of the next.
+By default the model is a tiny bloom with random weights, pass a pretrained one for representative numbers.
+
+Usage:
+    python benchmark_precision.py --precisions fp32 bf16 int8
+    python benchmark_precision.py --model bigscience/bloomz-560m --batch-size 4
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from types import SimpleNamespace
+
+import torch
+from tabulate import tabulate
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_batching import PROMPTS, build_tiny_model, run_batch
+from torchserve_handler import TransformersSeqClassifierHandler
+
+
+def get_model_size(model) -> int:
+    # quantized weights are packed outside of the parameters, the serialized state dict counts them
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def save_model_dir(model_name, model_dir: str) -> None:
+    if model_name is None:
+        model, tokenizer = build_tiny_model()
+    else:
+        model, tokenizer = AutoModelForCausalLM.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name)
+    model.save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+
+
+def benchmark(model_dir: str, precision: str, requests, batch_size: int, results) -> None:
+    """
+    Load the model directory with `initialize` and serve the requests, in a process of its own.
+    """
+    with open(os.path.join(model_dir, "setup_config.json"), "w") as f:
+        json.dump({"mode": "chatbot", "save_mode": "pretrained", "device": "cpu", "precision": precision}, f)
+    ctx = SimpleNamespace(
+        manifest={"model": {"serializedFile": "model.safetensors"}},
+        system_properties={"model_dir": model_dir},
+    )
+    handler = TransformersSeqClassifierHandler()
+    start = time.perf_counter()
+    handler.initialize(ctx)
+    load_time = time.perf_counter() - start
+    load_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    # never sample EOS, so every request generates its whole budget
+    eos_token_id = handler.tokenizer.eos_token_id
+    handler.model.lm_head.register_forward_hook(lambda module, inputs, output: output.index_fill(-1, torch.tensor([eos_token_id]), -1e4))
+    # warm up
+    run_batch(handler, requests[:1])
+
+    start = time.perf_counter()
+    tokens = 0
+    for i in range(0, len(requests), batch_size):
+        tokens += run_batch(handler, requests[i:i + batch_size])
+    throughput = tokens / (time.perf_counter() - start)
+    results.put({
+        "load_time": load_time,
+        "load_rss": load_rss,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "size": get_model_size(handler.model) / 2 ** 20,
+        "throughput": throughput,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=None, help="Pretrained causal LM, a random tiny bloom if not set")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=8, help="Requests served per precision")
+    args = parser.parse_args()
+
+    requests = [
+        {"body": {"prompt": PROMPTS[i % len(PROMPTS)], "max_tokens": args.max_tokens, "profile": "greedy"}}
+        for i in range(args.requests)
+    ]
+
+    # a fresh process per precision, ru_maxrss only ever grows
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    baseline = None
+    with tempfile.TemporaryDirectory() as model_dir:
+        save_model_dir(args.model, model_dir)
+        for precision in args.precisions:
+            results = context.Queue()
+            process = context.Process(target=benchmark, args=(model_dir, precision, requests, args.batch_size, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Benchmark of {precision} failed with exit code {process.exitcode}")
+            result = results.get()
+            baseline = baseline or result
+            rows.append([
+                precision,
+                f"{result['load_time']:.2f}",
+                f"{result['load_rss']:.0f}",
+                f"{result['peak_rss']:.0f}",
+                f"{result['peak_rss'] / baseline['peak_rss']:.2f}x",
+                f"{result['size']:.1f}",
+                f"{result['throughput']:.1f}",
+                f"{result['throughput'] / baseline['throughput']:.2f}x",
+            ])
+
+    print(tabulate(rows, headers=["precision", "load seconds", "RSS after load MB", "peak RSS MB", "peak RSS", "weights MB", "tokens/sec", "speedup"]))
+
+
+if __name__ == "__main__":
+    main()
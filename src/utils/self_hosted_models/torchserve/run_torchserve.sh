@@ -31,6 +31,7 @@ $checkpoint/tokenizer_config.json,\
 $checkpoint/generation_config.json,\
 $checkpoint/special_tokens_map.json,\
 $checkpoint/tokenizer.json,\
+torchserve/setup_config.json,\
 module.zip"
 
 mkdir -p model_store
@@ -1,11 +1,20 @@
 import sys
 import os
 import ast
+import copy
 import json
+import time
+import random
+import functools
+import threading
+import inspect
 import logging
+import resource
 import os
 from abc import ABC
-from typing import Dict, List, Tuple
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import torch
 import transformers
@@ -14,6 +23,10 @@ import transformers
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
 )
 
 import zipfile
@@ -21,6 +34,12 @@ import torch.cuda.amp as amp
 
 from ts.torch_handler.base_handler import BaseHandler
 
+try:
+    # streaming responses, TorchServe >= 0.8
+    from ts.protocol.otf_message_handler import send_intermediate_predict_response
+except ImportError:
+    send_intermediate_predict_response = None
+
 logger = logging.getLogger(__name__)
 logger.info("Transformers version %s", transformers.__version__)
 
@@ -29,12 +48,150 @@ SETUP_CONFIG = {
     "mode": "chatbot",
     "save_mode": "pretrained",
     "max_length": "2176",
+    # "auto" uses the GPU if any, "cpu" forces CPU serving
+    "device": "auto",
+    # "fp32", "bf16" (CPUs with AVX512-BF16/AMX, or GPUs) or "int8" (dynamic quantization of the linear layers, CPU only)
+    "precision": "fp32",
+    # default completion budget of a request without "max_tokens"
+    "max_new_tokens": 512,
+    # decoding profile of a request without "preset", "profile" or "temperature"
+    "decoding_profile": "beam",
+    # "structured": one JSON summary per batch, payloads for a sample of the batches, tensors at DEBUG only,
+    # "verbose": payloads and tensors of every batch at INFO
+    "log_mode": "structured",
+    # fraction of the batches whose prompts and completions are logged in structured mode
+    "log_sample_rate": 0.01,
+    # cached prompt prefixes per worker, at least one per `register_prompt_prefix` of the app (5) so that they do not evict each other,
+    # each one takes 2 * layers * hidden size * tokens values (~1.2 GB for 2k tokens of bloomz-3b in fp32).
+    # Only used by single-beam requests (greedy or sampling profiles, presets), see `_get_usable_prefix`.
+    # The app does not call the handler yet (see `generate_torchserve`), so the cache stays empty until it does
+    "prefix_cache_size": 5,
     # --deprecated
     "FasterTransformer": False,
     "BetterTransformer": False,
 }
 
 
+# `generate` arguments of each decoding profile
+DECODING_PROFILES = {
+    "greedy": {"do_sample": False, "num_beams": 1},
+    "sampling": {"do_sample": True, "num_beams": 1, "temperature": 0.7, "top_p": 0.95},
+    "beam": {"do_sample": False, "num_beams": 4, "early_stopping": True, "repetition_penalty": 2.5, "length_penalty": 1.0},
+}
+
+# named presets, selected by the "preset" of a request, whose own fields take precedence
+DECODING_PRESETS = {
+    # intents and action names are a few tokens on a single line
+    "intent": {"profile": "greedy", "max_new_tokens": 12, "stop": ["\n"]},
+    "answer": {"profile": "sampling", "max_new_tokens": 512, "repetition_penalty": 1.2},
+}
+
+# request fields overriding the `generate` arguments of the profile
+SAMPLING_OPTIONS = ("temperature", "top_p", "top_k")
+DECODING_OPTIONS = SAMPLING_OPTIONS + ("num_beams", "repetition_penalty")
+
+
+def apply_precision(model, precision: str, device: torch.device):
+    """
+    Convert a loaded fp32 model to the serving precision of the setup config.
+    int8 dynamically quantizes the weights of the `nn.Linear` layers, activations are quantized on the fly.
+    """
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        if device.type != "cpu":
+            logger.warning(f"int8 dynamic quantization only runs on CPU, keeping fp32 on {device}")
+            return model
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision != "fp32":
+        logger.warning(f"Unknown precision {precision}, keeping fp32")
+    return model
+
+
+class PrefixCache:
+    """
+    LRU cache of the attention keys/values (`past_key_values`) of static prompt prefixes,
+    so that their prefill is computed once per worker instead of on every request.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get(self, prefix: str):
+        entry = self._entries.get(prefix)
+        if entry is not None:
+            self._entries.move_to_end(prefix)
+        return entry
+
+    def put(self, prefix: str, entry) -> None:
+        self._entries[prefix] = entry
+        self._entries.move_to_end(prefix)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+def repeat_past_key_values(past_key_values: DynamicCache, batch_size: int) -> DynamicCache:
+    """
+    Repeat the cached keys/values of a single sequence for a batch, without modifying them,
+    since the model updates a `DynamicCache` in place.
+    """
+    past_key_values = copy.deepcopy(past_key_values)
+    past_key_values.batch_repeat_interleave(batch_size)
+    return past_key_values
+
+
+class BatchBudgetStoppingCriteria(StoppingCriteria):
+    """
+    Stop a batched `generate` once every sequence has produced EOS or one of its stop sequences, or used its own
+    `max_new_tokens`, instead of running every sequence up to the longest budget of the batch.
+    """
+
+    # stop sequences are searched in the last tokens only, not to decode the whole completion at each step
+    STOP_WINDOW = 16
+
+    def __init__(
+            self,
+            prompt_length: int,
+            max_new_tokens: List[int],
+            eos_token_id: int,
+            num_beams: int = 1,
+            stop: Optional[List[List[str]]] = None,
+            tokenizer=None,
+        ):
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_id = eos_token_id
+        self.num_beams = num_beams
+        self.stop = stop or [[] for _ in max_new_tokens]
+        self.tokenizer = tokenizer
+        # beams are reordered at each step, so only the rows of greedy and sampled sequences are tracked
+        self.stopped = set()
+
+    def _has_stop_sequence(self, row: int, new_tokens: torch.LongTensor) -> bool:
+        stop = self.stop[row // self.num_beams]
+        if len(stop) == 0 or self.tokenizer is None:
+            return False
+        if row in self.stopped:
+            return True
+        tail = self.tokenizer.decode(new_tokens[-self.STOP_WINDOW:], skip_special_tokens=True)
+        if any(sequence in tail for sequence in stop):
+            if self.num_beams == 1:
+                self.stopped.add(row)
+            return True
+        return False
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        new_tokens = input_ids[:, self.prompt_length:]
+        finished = (new_tokens == self.eos_token_id).any(dim=1)
+        for row in range(input_ids.shape[0]):
+            if finished[row] or new_tokens.shape[1] >= self.max_new_tokens[row // self.num_beams]:
+                continue
+            if not self._has_stop_sequence(row, new_tokens[row]):
+                return False
+        return True
+
+
 class TransformersSeqClassifierHandler(BaseHandler, ABC):
     """
     Transformers handler class for sequence, token classification and question answering.
@@ -43,6 +200,11 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
     def __init__(self):
         super(TransformersSeqClassifierHandler, self).__init__()
         self.initialized = False
+        # log levels and timings of the batch being handled, a worker handles one batch at a time
+        self.payload_log_level = logging.DEBUG
+        self.tensor_log_level = logging.DEBUG
+        self.batch_stats = {}
+        self.prefix_cache = PrefixCache(SETUP_CONFIG["prefix_cache_size"])
 
     def initialize(self, ctx):
         """In this initialize function, the BERT model is loaded and
@@ -63,20 +225,23 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
         #     if torch.cuda.is_available() and properties.get("gpu_id") is not None
         #     else "cpu"
         # )
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
         # with zipfile.ZipFile(model_dir + "/module.zip", "r") as zip_ref:
         #     zip_ref.extractall(model_dir)
 
-        # read configs for the mode, model_name, etc. from setup_config.json
+        # read configs for the mode, model_name, etc. from setup_config.json, over the defaults
+        self.setup_config = dict(SETUP_CONFIG)
         setup_config_path = os.path.join(model_dir, "setup_config.json")
         if os.path.isfile(setup_config_path):
             with open(setup_config_path) as setup_config_file:
-                self.setup_config = json.load(setup_config_file)
+                self.setup_config.update(json.load(setup_config_file))
         else:
             logger.warning("Missing the setup_config.json file.")
 
-        self.setup_config = SETUP_CONFIG
+        use_cuda = torch.cuda.is_available() and self.setup_config["device"] != "cpu"
+        self.device = torch.device("cuda" if use_cuda else "cpu")
+        self.prefix_cache = PrefixCache(self.setup_config["prefix_cache_size"])
+        precision = self.setup_config["precision"]
+        load_start = time.perf_counter()
 
         # Loading the shared object of compiled Faster Transformer Library if Faster Transformer is set
         if self.setup_config["FasterTransformer"]:
@@ -90,7 +255,15 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
             self.model = torch.jit.load(model_pt_path, map_location=self.device)
         elif self.setup_config["save_mode"] == "pretrained":
             if self.setup_config["mode"] == "chatbot":
-                self.model = AutoModelForCausalLM.from_pretrained(model_dir, device_map='auto')
+                if use_cuda:
+                    self.model = AutoModelForCausalLM.from_pretrained(model_dir, device_map='auto')
+                else:
+                    # load bf16 weights directly, not to hold a fp32 copy
+                    self.model = AutoModelForCausalLM.from_pretrained(
+                        model_dir,
+                        torch_dtype=torch.bfloat16 if precision == "bf16" else torch.float32,
+                        low_cpu_mem_usage=True,
+                    )
 
             else:
                 logger.warning("Missing the operation mode.")
@@ -109,6 +282,7 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
                         "HuggingFace Optimum is not supporting this model,for the list of supported models, please refer to this doc,https://huggingface.co/docs/optimum/bettertransformer/overview"
                     )
             self.model.to(self.device)
+            self.model = apply_precision(self.model, precision, self.device)
 
         else:
             logger.warning("Missing the checkpoint or state_dict.")
@@ -118,104 +292,204 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
         print("self.setup_config", self.setup_config)
         print("self.setup_config['model_name']", self.setup_config["model_name"])
         self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._setup_tokenizer()
 
         self.model.eval()
         logger.info("Transformer model from path %s loaded successfully", model_dir)
+        logger.info(
+            f"Loaded in {precision} on {self.device} in {time.perf_counter() - load_start:.1f}s, "
+            f"peak memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+        )
 
         self.initialized = True
 
+    def _set_log_levels(self):
+        if self.setup_config.get("log_mode", "structured") == "verbose":
+            self.payload_log_level = self.tensor_log_level = logging.INFO
+            return
+        sampled = random.random() < float(self.setup_config.get("log_sample_rate", 0))
+        self.payload_log_level = logging.INFO if sampled else logging.DEBUG
+        self.tensor_log_level = logging.DEBUG
+
+    def _autocast(self):
+        # CPU models already run in their serving precision, fp16 autocast is for GPUs only
+        return amp.autocast() if self.device.type == "cuda" else nullcontext()
+
+    def _setup_tokenizer(self):
+        # decoder-only models continue from the last position, so batches are padded on the left
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
     def preprocess(self, requests):
-        """Basic text preprocessing, based on the user's chocie of application mode.
+        """Tokenize the whole batch at once, left-padded to its longest prompt.
         Args:
-            requests (str): The Input data in the form of text is passed on to the preprocess
-            function.
+            requests (list): The batch of requests assembled by TorchServe (up to `batchSize`,
+            waiting at most `maxBatchDelay`, see config.properties).
         Returns:
-            list : The preprocess function returns a list of Tensor for the size of the word tokens.
+            dict : Batched `input_ids` and `attention_mask`, and the parsed request bodies.
         """
-        input_ids_batch = []
-        attention_mask_batch = []
+        start = time.perf_counter()
+        self._set_log_levels()
+        max_length = self.setup_config["max_length"]
+        bodies = []
         for idx, data in enumerate(requests):
             input_text = data.get("data")
             if input_text is None:
                 input_text = data.get("body")
             if isinstance(input_text, (bytes, bytearray)):
                 input_text = input_text.decode("utf-8")
+            # JSON bodies are already decoded by TorchServe, raw ones are not
+            question_context = json.loads(input_text) if isinstance(input_text, str) else input_text
+            bodies.append(question_context)
+
+        # a registered prefix is sent apart (see `get_prefix`), the model still sees the whole prompt
+        prompts = [(body.get("prefix") or "") + body.get("prompt", "") for body in bodies]
+        if logger.isEnabledFor(self.payload_log_level):
+            logger.log(self.payload_log_level, f"Received requests: {bodies}")
+        inputs = self.tokenizer(
+            prompts,
+            return_tensors="pt",
+            padding=True,
+            max_length=int(max_length),
+            truncation=True,
+        )
 
-            max_length = self.setup_config["max_length"]
-            logger.info("Received text: '%s'", input_text)
-            # preprocessing text for sequence_classification, token_classification or text_generation
-            # question_context = ast.literal_eval(input_text)
-            logging.info(f"input_text: {input_text}")
-            logging.info(f"input_text type: {type(input_text)}")
-            # question_context = json.loads(input_text)
-            question_context = input_text
-
-            # temperature = question_context.get("temperature", 0.7)
-            prompt = question_context.get("prompt", "")
-            # num_beams = question_context.get("num_beams", 1)
-            # min_tokens = question_context.get("min_tokens", 30)
-            # max_tokens = question_context.get("max_tokens", 4096)
-
-            logging.info(f"Received request: {question_context}")
-
-            text = prompt
-
-            # Get chat answer
-            logging.info(f"Input: {text}")
-
-            logger.info(f"Final input into model {text}")
-            inputs = self.tokenizer(
-                text,
-                return_tensors="pt",
-                max_length=int(max_length),
-                truncation=True,
-            )
-
-            input_ids = inputs["input_ids"].to(self.device)
-            attention_mask = inputs["attention_mask"].to(self.device)
-
-            decoded_text = self.tokenizer.batch_decode(input_ids)
-            logger.info(f"Decoded text after tokenizer: {decoded_text}")
-            logger.info(f"input_ids {input_ids}")
-            logger.info(f"attention_mask {attention_mask}")
-            logger.info(f"input_ids.shape {input_ids.shape}")
-            logger.info(f"attention_mask.shape {attention_mask.shape}")
-            logger.info(f"Total words of original text {len(text.split())}")
-            logger.info(
-                f"Total words of processed text {len(decoded_text[0].split())}"
-            )
-            logger.info(f"Total tokens of processed text {input_ids.shape[1]}")
-
-            input_ids_batch.append(input_ids)
-            attention_mask_batch.append(attention_mask)
-
-        logger.info(f"----- Done preprocessing ------")
-        logger.info(f"input_ids_batch {input_ids_batch}")
-        logger.info(f"attention_mask_batch {attention_mask_batch}")
-        return (input_ids_batch, attention_mask_batch)
+        input_ids = inputs["input_ids"].to(self.device)
+        attention_mask = inputs["attention_mask"].to(self.device)
+
+        # decoding and printing whole tensors costs more than tokenizing, only do it when the level is enabled
+        if logger.isEnabledFor(self.tensor_log_level):
+            decoded_text = self.tokenizer.batch_decode(input_ids, skip_special_tokens=True)
+            logger.log(self.tensor_log_level, f"Decoded text after tokenizer: {decoded_text}")
+            logger.log(self.tensor_log_level, f"input_ids {input_ids}")
+            logger.log(self.tensor_log_level, f"attention_mask {attention_mask}")
+
+        self.batch_stats = {
+            "batch_size": len(bodies),
+            "prompt_chars": [len(prompt) for prompt in prompts],
+            "prompt_tokens": attention_mask.sum(dim=1).tolist(),
+            "padded_length": input_ids.shape[1],
+            "preprocess_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        return {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "prompts": prompts,
+            "bodies": bodies,
+        }
+
+    def get_decoding(self, body: Dict[str, Any]) -> Tuple[Dict[str, Any], int, List[str]]:
+        """Resolve the decoding of a request, from its "preset", "profile", "temperature" and other
+        `DECODING_OPTIONS`, "max_tokens" (or "max_new_tokens"), "min_tokens" and "stop".
+        Without a profile, temperature 0 decodes greedily and a positive temperature samples.
+        Args:
+            body (dict): The request body
+        Returns:
+            dict : The `generate` arguments shared by the requests decoded together
+            int : The completion budget of the request
+            list : The stop sequences of the request
+        """
+        preset = DECODING_PRESETS.get(body.get("preset"), {})
+        if body.get("preset") is not None and len(preset) == 0:
+            logger.warning(f"Unknown decoding preset {body.get('preset')}")
+        options = {**preset, **{name: value for name, value in body.items() if value is not None}}
+
+        profile = options.get("profile")
+        if profile is None and options.get("temperature") is not None:
+            profile = "sampling" if float(options["temperature"]) > 0 else "greedy"
+        if profile not in DECODING_PROFILES:
+            if profile is not None:
+                logger.warning(f"Unknown decoding profile {profile}")
+            profile = self.setup_config.get("decoding_profile", "beam")
+
+        generate_kwargs = dict(DECODING_PROFILES[profile])
+        for name in DECODING_OPTIONS:
+            # sampling options would only make `generate` warn on greedy and beam decoding
+            if name in options and (profile == "sampling" or name not in SAMPLING_OPTIONS):
+                generate_kwargs[name] = options[name]
+        if options.get("stream", False) and generate_kwargs["num_beams"] > 1:
+            # streamers do not support beam search
+            generate_kwargs = {**DECODING_PROFILES["greedy"], "repetition_penalty": generate_kwargs.get("repetition_penalty", 1.0)}
+        if options.get("min_tokens"):
+            generate_kwargs["min_new_tokens"] = int(options["min_tokens"])
+
+        max_new_tokens = int(
+            options.get("max_tokens") or options.get("max_new_tokens") or self.setup_config["max_new_tokens"]
+        )
+        stop = options.get("stop") or []
+        if isinstance(stop, str):
+            stop = [stop]
+        return generate_kwargs, max_new_tokens, list(stop)
 
     def inference(self, input_batch):
-        """Predict the class (or classes) of the received text using the
-        serialized transformers checkpoint.
+        """Generate the completions of the batch, with a single `generate` call per decoding
+        (see `get_decoding`). Each sequence stops at its own EOS, stop sequence or `max_tokens`,
+        and a `generate` call stops when all of its sequences did. Requests with "stream" are generated
+        on their own, their text is sent while it is generated (see `_stream`).
         Args:
-            input_batch (list): List of Text Tensors from the pre-process function is passed here
+            input_batch (dict): Batched tensors from the pre-process function
         Returns:
-            list : It returns a list of the predicted value for the input text
+            list : It returns a list of the generated completions with their token counts
         """
-        input_ids_batch, attention_mask_batch = input_batch
-
-        inferences: List[str]
-
-        with torch.inference_mode(), amp.autocast():
-            inferences = self.model.generate(
-                input_ids=input_ids_batch,
-                attention_mask=attention_mask_batch,
-                max_length=4096,
-                num_beams=4,
-                early_stopping=True,
-                repetition_penalty=2.5,
-                length_penalty=1.0,
+        inference_start = time.perf_counter()
+        bodies = input_batch["bodies"]
+        decodings = [self.get_decoding(body) for body in bodies]
+        groups = {}
+        for row, (generate_kwargs, _, _) in enumerate(decodings):
+            prefix = self._get_usable_prefix(input_batch, row, generate_kwargs)
+            # streamed requests are generated one by one, a `TextIteratorStreamer` follows a single sequence
+            stream_row = row if bodies[row].get("stream", False) else None
+            groups.setdefault((stream_row, prefix, tuple(sorted(generate_kwargs.items()))), []).append(row)
+
+        inferences = [None] * len(bodies)
+        for (stream_row, prefix, _), rows in groups.items():
+            generate_kwargs = decodings[rows[0]][0]
+            max_new_tokens = [decodings[row][1] for row in rows]
+            stop = [decodings[row][2] for row in rows]
+            input_ids = input_batch["input_ids"][rows]
+            attention_mask = input_batch["attention_mask"][rows]
+            past_key_values = None
+            if prefix is not None:
+                input_ids, attention_mask, past_key_values = self._get_prefix_inputs(prefix, input_ids, attention_mask)
+            else:
+                # drop the left padding of longer prompts decoded in other groups
+                first_column = int((attention_mask.sum(dim=0) > 0).nonzero()[0, 0])
+                input_ids = input_ids[:, first_column:]
+                attention_mask = attention_mask[:, first_column:]
+            prompt_length = input_ids.shape[1]
+            logger.debug(f"Decoding {len(rows)} requests with {generate_kwargs}, max_new_tokens {max_new_tokens}, cached prefix {prefix is not None}")
+
+            start = time.perf_counter()
+            generate = functools.partial(
+                self._generate, input_ids, attention_mask, past_key_values, generate_kwargs, max_new_tokens, stop,
             )
+            sent = ""
+            if stream_row is None:
+                outputs = generate()
+            else:
+                outputs, sent = self._stream(generate, stream_row, stop[0])
+
+            for index, row in enumerate(rows):
+                inferences[row] = self._get_completion(
+                    outputs[index, prompt_length:],
+                    max_new_tokens[index],
+                    stop[index],
+                    prompt=input_batch["prompts"][row],
+                    prompt_tokens=int(attention_mask[index].sum()),
+                    echo=bodies[row].get("echo", False) and stream_row is None,
+                )
+            if stream_row is not None:
+                # the last message only carries the text not sent yet
+                completion = inferences[stream_row]["text"]
+                if not completion.startswith(sent):
+                    logger.warning("Streamed text differs from the completion")
+                inferences[stream_row]["text"] = completion[len(sent):] if completion.startswith(sent) else ""
+            elapsed = time.perf_counter() - start
+            generated = sum(inferences[row]["usage"]["completion_tokens"] for row in rows)
+            logger.debug(f"Generated {generated} tokens in {elapsed:.2f}s, {generated / elapsed:.1f} tokens/sec")
+            self.batch_stats["generate_calls"] = self.batch_stats.get("generate_calls", 0) + 1
+            self.batch_stats["cached_prefix_rows"] = self.batch_stats.get("cached_prefix_rows", 0) + (len(rows) if prefix is not None else 0)
 
         # inferences = self._generate(
         #     dict(input_ids=input_ids_batch, attention_mask=attention_mask_batch),
@@ -230,12 +504,207 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
         #     verbose=True,
         # )
 
-        inferences = self.tokenizer.batch_decode(inferences, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+        if logger.isEnabledFor(self.payload_log_level):
+            logger.log(self.payload_log_level, f"Generated text chatbot: '{inferences}'")
+        completion_tokens = [inference["usage"]["completion_tokens"] for inference in inferences]
+        inference_seconds = time.perf_counter() - inference_start
+        self.batch_stats.update({
+            "completion_tokens": completion_tokens,
+            "finish_reasons": [inference["finish_reason"] for inference in inferences],
+            "inference_ms": round(inference_seconds * 1000, 1),
+            "tokens_per_sec": round(sum(completion_tokens) / inference_seconds, 1),
+        })
+        return inferences
+
+    def _generate(
+            self,
+            input_ids: torch.LongTensor,
+            attention_mask: torch.LongTensor,
+            past_key_values: Optional[DynamicCache],
+            generate_kwargs: Dict[str, Any],
+            max_new_tokens: List[int],
+            stop: List[List[str]],
+            streamer: Optional[TextIteratorStreamer] = None,
+        ) -> torch.LongTensor:
+        with torch.inference_mode(), self._autocast():
+            if past_key_values is not None:
+                generate_kwargs = {**generate_kwargs, "past_key_values": past_key_values}
+            return self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max(max_new_tokens),
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=StoppingCriteriaList([
+                    BatchBudgetStoppingCriteria(
+                        input_ids.shape[1],
+                        max_new_tokens,
+                        self.tokenizer.eos_token_id,
+                        generate_kwargs["num_beams"],
+                        stop,
+                        self.tokenizer,
+                    ),
+                ]),
+                streamer=streamer,
+                **generate_kwargs,
+            )
 
-        logging.info(
-            "Generated text chatbot: '%s'", inferences
+    def _stream(self, generate: Callable, row: int, stop: List[str]) -> Tuple[torch.LongTensor, str]:
+        """Run `generate` in a thread and send the decoded text of the request while it is generated, as
+        TorchServe intermediate responses, one JSON line {"text": ...} each.
+        Text which may be the beginning of a stop sequence is held back until it is not.
+        Args:
+            generate (Callable): `_generate` of the request, without the streamer
+            row (int): Index of the request in the batch
+            stop (list): The stop sequences of the request
+        Returns:
+            tensor : The generated sequence
+            str : The text already sent
+        """
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True, clean_up_tokenization_spaces=True,
         )
-        return inferences
+        result = {}
+
+        def run():
+            try:
+                result["outputs"] = generate(streamer=streamer)
+            except BaseException as e:
+                result["error"] = e
+                streamer.end()
+
+        thread = threading.Thread(target=run, name="generate")
+        thread.start()
+        text = ""
+        sent = 0
+        holdback = max([len(sequence) for sequence in stop], default=1) - 1
+        for delta in streamer:
+            text += delta
+            stop_positions = [text.find(sequence) for sequence in stop if sequence in text]
+            end = min(stop_positions) if len(stop_positions) > 0 else len(text) - holdback
+            if end > sent and self._send_intermediate(row, text[sent:end]):
+                sent = end
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["outputs"], text[:sent]
+
+    def _send_intermediate(self, row: int, text: str) -> bool:
+        if send_intermediate_predict_response is None or self.context is None:
+            # the whole text is returned with the final response instead
+            return False
+        send_intermediate_predict_response(
+            [json.dumps({"text": text}, ensure_ascii=False) + "\n"],
+            {0: self.context.request_ids[row]},
+            "Intermediate Prediction success",
+            200,
+            self.context,
+        )
+        return True
+
+    def get_prefix(self, prefix: str) -> Tuple[torch.LongTensor, Optional[DynamicCache]]:
+        """Get the tokens of a static prompt prefix and the attention keys/values of all of them but the last,
+        computed on the first request using the prefix, then cached (see `PrefixCache`).
+        Args:
+            prefix (str): The prefix text, registered by the app with `register_prompt_prefix`
+        Returns:
+            tensor : The prefix tokens
+            past_key_values : The cached keys/values of the prefix tokens but the last, which is left
+            to process with the rest of the prompt
+        """
+        entry = self.prefix_cache.get(prefix)
+        if entry is not None:
+            return entry
+        prefix_ids = self.tokenizer(prefix, return_tensors="pt")["input_ids"][0].to(self.device)
+        past_key_values = None
+        if len(prefix_ids) > 1:
+            with torch.inference_mode(), self._autocast():
+                # legacy tuples of keys/values are deprecated
+                past_key_values = self.model(input_ids=prefix_ids[None, :-1], past_key_values=DynamicCache(), use_cache=True).past_key_values
+        logger.info(f"Cached the attention keys/values of a prefix of {len(prefix_ids)} tokens")
+        entry = (prefix_ids, past_key_values)
+        self.prefix_cache.put(prefix, entry)
+        return entry
+
+    def _get_usable_prefix(self, input_batch, row: int, generate_kwargs: Dict[str, Any]) -> Optional[str]:
+        prefix = input_batch["bodies"][row].get("prefix")
+        # `generate` does not expand the given keys/values for beam search
+        if not prefix or generate_kwargs["num_beams"] != 1:
+            return None
+        prefix_ids, past_key_values = self.get_prefix(prefix)
+        input_ids = input_batch["input_ids"][row][input_batch["attention_mask"][row].bool()]
+        # the prefix may be tokenized differently at its boundary with the rest of the prompt
+        if past_key_values is None or len(input_ids) <= len(prefix_ids) or not torch.equal(input_ids[:len(prefix_ids)], prefix_ids):
+            return None
+        return prefix
+
+    def _get_prefix_inputs(
+            self,
+            prefix: str,
+            input_ids: torch.LongTensor,
+            attention_mask: torch.LongTensor,
+        ) -> Tuple[torch.LongTensor, torch.LongTensor, DynamicCache]:
+        """Build the `generate` inputs of prompts sharing a cached prefix. The rest of the prompts is
+        prefilled from the cached keys/values, except for its last token which `generate` processes itself.
+        Prompts are padded between the prefix and their rest, which the attention mask hides.
+        """
+        prefix_ids, past_key_values = self.get_prefix(prefix)
+        cached_length = len(prefix_ids) - 1
+        rests = [ids[mask.bool()][cached_length:] for ids, mask in zip(input_ids, attention_mask)]
+        rest_length = max(len(rest) for rest in rests)
+        rest_ids = torch.full((len(rests), rest_length), self.tokenizer.pad_token_id, dtype=input_ids.dtype, device=self.device)
+        rest_mask = torch.zeros((len(rests), rest_length), dtype=attention_mask.dtype, device=self.device)
+        for index, rest in enumerate(rests):
+            rest_ids[index, rest_length - len(rest):] = rest
+            rest_mask[index, rest_length - len(rest):] = 1
+
+        input_ids = torch.cat([prefix_ids[None, :-1].expand(len(rests), -1), rest_ids], dim=1)
+        attention_mask = torch.cat([torch.ones_like(input_ids[:, :cached_length]), rest_mask], dim=1)
+        past_key_values = repeat_past_key_values(past_key_values, len(rests))
+        if rest_length > 1:
+            kwargs = {}
+            if "position_ids" in inspect.signature(self.model.forward).parameters:
+                kwargs["position_ids"] = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)[:, cached_length:-1]
+            with torch.inference_mode(), self._autocast():
+                past_key_values = self.model(
+                    input_ids=rest_ids[:, :-1],
+                    attention_mask=attention_mask[:, :-1],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    **kwargs,
+                ).past_key_values
+        return input_ids, attention_mask, past_key_values
+
+    def _get_completion(
+            self,
+            new_tokens: torch.LongTensor,
+            max_new_tokens: int,
+            stop: List[str],
+            prompt: str,
+            prompt_tokens: int,
+            echo: bool = False,
+        ) -> Dict[str, Any]:
+        new_tokens = new_tokens[:max_new_tokens]
+        finish_reason = "length"
+        # finished sequences are padded until the whole batch is done
+        eos_positions = (new_tokens == self.tokenizer.eos_token_id).nonzero()
+        if len(eos_positions) > 0:
+            new_tokens = new_tokens[:eos_positions[0, 0]]
+            finish_reason = "stop"
+        completion = self.tokenizer.decode(new_tokens, skip_special_tokens=True, clean_up_tokenization_spaces=True)
+        completion_tokens = len(new_tokens)
+        stop_positions = [completion.find(sequence) for sequence in stop if sequence in completion]
+        if len(stop_positions) > 0:
+            completion = completion[:min(stop_positions)]
+            completion_tokens = len(self.tokenizer(completion, add_special_tokens=False)["input_ids"])
+            finish_reason = "stop"
+        return {
+            "text": prompt + completion if echo else completion,
+            "finish_reason": finish_reason,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            },
+        }
 
     def postprocess(self, inference_output):
         """Post Process Function converts the predicted response into Torchserve readable format.
@@ -244,17 +713,19 @@ class TransformersSeqClassifierHandler(BaseHandler, ABC):
         Returns:
             (list): Returns a list of the Predictions and Explanations.
         """
+        start = time.perf_counter()
         inferences = inference_output
 
         response = []
         for out in inferences:
             response.append(
-                json.dumps({
-                    "text": out,
-                },
-                ensure_ascii=False,)
+                json.dumps(out, ensure_ascii=False)
             )
-        logger.info("Batch Response: '%s'", response)
+        if logger.isEnabledFor(self.payload_log_level):
+            logger.log(self.payload_log_level, f"Batch Response: '{response}'")
+        if logger.isEnabledFor(logging.INFO):
+            self.batch_stats["postprocess_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            logger.info(json.dumps({"event": "batch", **self.batch_stats}))
         return response
 
     def get_insights(self, input_batch, text, target):
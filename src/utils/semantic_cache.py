@@ -0,0 +1,108 @@
+import os
+import time
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+SEMANTIC_CACHE = (os.getenv("SEMANTIC_CACHE") or "false").lower() == "true"
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL") or "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or 0.92)
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL") or 24 * 3600)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES") or 10000)
+
+metrics.describe('semantic_cache_total', 'Semantic answer cache lookups, by result (hit or miss).')
+
+
+class SemanticCache:
+    """
+    Answer cache matching questions by meaning instead of exact text.
+    Questions are embedded with a local sentence-transformers model and compared by cosine similarity
+    against a brute-force in-memory index. Entries only match within the same namespace (e.g. the question language),
+    and expire after their own TTL.
+    """
+
+    def __init__(
+            self,
+            model_name: str = SEMANTIC_CACHE_MODEL,
+            threshold: float = SEMANTIC_CACHE_THRESHOLD,
+            max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._embeddings = np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self._namespaces: List[str] = []
+        self._answers: List[str] = []
+        self._expires_at = np.zeros((0,), dtype=np.float64)
+
+    def _embed(self, text: str) -> np.ndarray:
+        return self.model.encode([" ".join(text.split())], normalize_embeddings=True)[0].astype(np.float32)
+
+    def get(self, question: str, namespace: str = "") -> Optional[str]:
+        embedding = self._embed(question)
+        with self._lock:
+            self._drop_expired()
+            answer = None
+            if len(self._answers) > 0:
+                similarities = self._embeddings @ embedding
+                similarities[[n != namespace for n in self._namespaces]] = -1
+                best = int(similarities.argmax())
+                if similarities[best] >= self.threshold:
+                    logging.info(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+                    answer = self._answers[best]
+        metrics.increment('semantic_cache_total', result='hit' if answer is not None else 'miss')
+        return answer
+
+    def set(self, question: str, answer: str, namespace: str = "", ttl: int = SEMANTIC_CACHE_TTL) -> None:
+        embedding = self._embed(question)
+        with self._lock:
+            self._embeddings = np.vstack([self._embeddings, embedding[None, :]])
+            self._namespaces.append(namespace)
+            self._answers.append(answer)
+            self._expires_at = np.append(self._expires_at, time.time() + ttl)
+            if len(self._answers) > self.max_entries:
+                # drop the oldest entries
+                self._keep(np.arange(len(self._answers) - self.max_entries, len(self._answers)))
+
+    def _drop_expired(self) -> None:
+        alive = self._expires_at > time.time()
+        if not alive.all():
+            self._keep(np.flatnonzero(alive))
+
+    def _keep(self, indices: np.ndarray) -> None:
+        self._embeddings = self._embeddings[indices]
+        self._namespaces = [self._namespaces[i] for i in indices]
+        self._answers = [self._answers[i] for i in indices]
+        self._expires_at = self._expires_at[indices]
+
+
+_cache: Optional[SemanticCache] = None
+_cache_initialized = False
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    Get the process-wide semantic cache, None if disabled (SEMANTIC_CACHE) or sentence-transformers is not installed.
+    """
+    global _cache, _cache_initialized
+    if _cache_initialized:
+        return _cache
+    with _cache_lock:
+        if not _cache_initialized:
+            if SEMANTIC_CACHE:
+                try:
+                    _cache = SemanticCache()
+                except ImportError:
+                    logging.warning("sentence-transformers is not installed. Proceeding without semantic cache")
+            _cache_initialized = True
+    return _cache
@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from functools import wraps
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+load_dotenv()
+
+from src.utils import metrics
+
+# add the per-request trace to every response, not only to requests with the X-Trace header
+TRACE_RESPONSE_HEADER = (os.getenv("TRACE_RESPONSE_HEADER") or "false").lower() == "true"
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+metrics.describe('stage_duration_seconds', 'Duration of each stage of the chat pipeline.')
+metrics.describe('stage_tokens_total', 'Completion API tokens used by each stage (including its nested stages), by kind (prompt or completion).')
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"]):
+        self.name = name
+        self.parent = parent
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started_at = time.perf_counter()
+        self.duration: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add_tokens(self, prompt_tokens: int, completion_tokens: int) -> None:
+        # nested spans may finish concurrently in executor threads
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+
+class Trace:
+    """
+    Spans finished while handling one request.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self) -> str:
+        """
+        Render the spans as a Server-Timing header, in start order, with the total duration last.
+
+        Example:
+            >>> trace = start_trace()
+            >>> with span("intent"):
+            ...     add_tokens(623, 3)
+            >>> with span("category"):
+            ...     pass
+            >>> trace.server_timing()
+            'intent;dur=...;desc="tokens 623/3", category;dur=..., total;dur=...'
+            >>> end_trace()
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.started_at)
+        entries = []
+        for span in spans:
+            entry = f"{span.name};dur={span.duration * 1000:.1f}"
+            if span.prompt_tokens or span.completion_tokens:
+                entry += f';desc="tokens {span.prompt_tokens}/{span.completion_tokens}"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def start_trace() -> Trace:
+    """
+    Record the spans of the current request, until `end_trace`. Tasks submitted with `executor.submit`
+    and asyncio tasks inherit the trace.
+    """
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def end_trace() -> None:
+    _current_trace.set(None)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Time a stage of the pipeline, as `stage_duration_seconds{stage=name}` and in the trace of the request, if any.
+    Completion API tokens used inside are added to the span with `add_tokens`.
+
+    Example:
+        >>> with span("intent") as current:
+        ...     add_tokens(623, 3)  # from the usage of a completion
+        >>> current.completion_tokens, current.duration > 0
+        (3, True)
+    """
+    current = Span(name, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        _finish(current)
+
+
+def start_span(name: str) -> Span:
+    """
+    Start a span to finish with `finish_span`, for stages delimited by callbacks rather than a block.
+    The span is not made current, so nested stages are not attributed to it.
+    """
+    return Span(name, _current_span.get())
+
+
+def finish_span(current: Span) -> None:
+    _finish(current)
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running a sync or async function in a `span`.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_tokens(prompt_tokens: int, completion_tokens: int) -> None:
+    """
+    Add the usage of a completion API call to the innermost span.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.add_tokens(prompt_tokens, completion_tokens)
+
+
+def _finish(current: Span) -> None:
+    current.duration = time.perf_counter() - current.started_at
+    metrics.observe('stage_duration_seconds', current.duration, buckets=STAGE_BUCKETS, stage=current.name)
+    if current.prompt_tokens or current.completion_tokens:
+        metrics.increment('stage_tokens_total', current.prompt_tokens, stage=current.name, kind='prompt')
+        metrics.increment('stage_tokens_total', current.completion_tokens, stage=current.name, kind='completion')
+    if current.parent is not None:
+        current.parent.add_tokens(current.prompt_tokens, current.completion_tokens)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(current)
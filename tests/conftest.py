@@ -0,0 +1,5 @@
+import os
+
+# the OpenAI client is configured at import, the tests never call it
+os.environ.setdefault("OPENAI_API_KEYS", "test")
+os.environ.setdefault("COMPLETION_CACHE_BACKEND", "none")
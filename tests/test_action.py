@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.models import action
+
+NAM = {"receiver": "Nam", "amount": "300000", "msg": "bún đậu"}
+LAN = {"receiver": "Lan", "amount": "300000", "msg": "bún đậu"}
+MESSAGES = [{"user": "Minh", "content": "Chuyển 300k cho Nam tiền bún đậu"}]
+
+
+@pytest.fixture(autouse=True)
+def no_model(monkeypatch):
+    monkeypatch.setattr(action, "is_cached", lambda *args, **kwargs: False)
+    monkeypatch.setattr(action, "_categorize", lambda messages, params: "FOOD")
+
+    async def acategorize(messages, params):
+        return "FOOD"
+    monkeypatch.setattr(action, "_acategorize", acategorize)
+
+
+def extractions(monkeypatch, results):
+    """
+    Make the ensemble members return `results` in turn, an exception fails the member and `...` blocks it until the test ends.
+    """
+    results = iter(results)
+    lock = threading.Lock()
+    release = threading.Event()
+    calls = []
+
+    def extract(messages, action_name):
+        with lock:
+            result = next(results)
+            calls.append(result)
+        if result is ...:
+            release.wait(5)
+            return LAN
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def aextract(messages, action_name):
+        with lock:
+            result = next(results)
+            calls.append(result)
+        if result is ...:
+            await asyncio.sleep(5)
+            return LAN
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(action, "_extract_action_params", extract)
+    monkeypatch.setattr(action, "_aextract_action_params", aextract)
+    return calls, release
+
+
+def test_majority_vote_exits_after_2_of_3():
+    vote = action.MajorityVote(ensemble_size=3)
+    vote.add(NAM)
+    assert vote.winner is None
+    vote.add(dict(reversed(list(NAM.items()))))
+    assert vote.winner == NAM
+    # later results do not change the winner
+    vote.add(LAN)
+    assert vote.result() == NAM
+
+
+def test_majority_vote_without_majority_returns_the_most_common():
+    vote = action.MajorityVote(ensemble_size=5)
+    for result in [NAM, LAN, NAM, "Bạn muốn chuyển cho ai?", None]:
+        vote.add(result)
+    assert vote.winner is None
+    assert vote.result() == NAM
+
+
+def test_majority_vote_without_results_raises():
+    vote = action.MajorityVote(ensemble_size=3)
+    vote.add(None)
+    with pytest.raises(Exception, match="Cannot get action params"):
+        vote.result()
+
+
+def test_ensemble_does_not_wait_for_the_straggler(monkeypatch):
+    calls, release = extractions(monkeypatch, [NAM, NAM, ...])
+    try:
+        params = action.ensemble_get_action_params(MESSAGES, "TRANSFER")
+    finally:
+        release.set()
+    assert params == {**NAM, "category": "FOOD"}
+
+
+def test_async_ensemble_cancels_the_straggler(monkeypatch):
+    calls, _ = extractions(monkeypatch, [NAM, ..., NAM])
+
+    async def run():
+        params = await action.aensemble_get_action_params(MESSAGES, "TRANSFER")
+        # the cancelled straggler is the only other task left
+        others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.sleep(0)
+        return params, [task.cancelled() for task in others]
+
+    params, cancelled = asyncio.run(run())
+    assert params == {**NAM, "category": "FOOD"}
+    assert all(cancelled)
+
+
+def test_ensemble_ignores_failed_members(monkeypatch):
+    extractions(monkeypatch, [ValueError("invalid JSON"), NAM, NAM])
+    assert action.ensemble_get_action_params(MESSAGES, "TRANSFER") == {**NAM, "category": "FOOD"}
+
+
+def test_ensemble_without_majority_returns_the_most_common(monkeypatch):
+    extractions(monkeypatch, [NAM, LAN, ValueError("invalid JSON")])
+    assert action.ensemble_get_action_params(MESSAGES, "TRANSFER")["receiver"] in ("Nam", "Lan")
+
+
+def test_ensemble_with_every_member_failed_raises(monkeypatch):
+    extractions(monkeypatch, [ValueError("invalid JSON")] * 3)
+    with pytest.raises(Exception, match="Cannot get action params"):
+        action.ensemble_get_action_params(MESSAGES, "TRANSFER")
+
+
+def test_cached_extraction_runs_a_single_member(monkeypatch):
+    monkeypatch.setattr(action, "is_cached", lambda *args, **kwargs: True)
+    calls, _ = extractions(monkeypatch, [NAM, NAM, NAM])
+    assert action.ensemble_get_action_params(MESSAGES, "TRANSFER") == {**NAM, "category": "FOOD"}
+    assert len(calls) == 1
+
+    calls, _ = extractions(monkeypatch, [LAN, NAM, NAM])
+    assert asyncio.run(action.aensemble_get_action_params(MESSAGES, "TRANSFER")) == {**LAN, "category": "FOOD"}
+    assert len(calls) == 1
+
+
+def test_questions_get_no_category(monkeypatch):
+    question = "Bạn muốn chuyển bao nhiêu tiền cho Nam?"
+    extractions(monkeypatch, [question, question, NAM])
+    assert action.ensemble_get_action_params(MESSAGES, "TRANSFER") == question
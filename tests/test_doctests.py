@@ -0,0 +1,26 @@
+import doctest
+import importlib
+
+import pytest
+
+# modules whose examples run offline, the other ones call the model
+MODULES = [
+    "src.models.intent_classifier",
+    "src.models.response_templates",
+    "src.models.translation_memory",
+    "src.models.translator",
+    "src.utils.completion_cache",
+    "src.utils.executor",
+    "src.utils.http_session",
+    "src.utils.key_scheduler",
+    "src.utils.logger",
+    "src.utils.metrics",
+    "src.utils.prompt_prefix",
+    "src.utils.tracing",
+]
+
+
+@pytest.mark.parametrize("name", MODULES)
+def test_doctests(name):
+    result = doctest.testmod(importlib.import_module(name), optionflags=doctest.ELLIPSIS)
+    assert result.failed == 0
@@ -0,0 +1,49 @@
+import asyncio
+
+from src.utils.executor import UpstreamLimiter, submit
+
+
+def test_submit_runs_in_the_context_of_the_caller():
+    import contextvars
+    request_id = contextvars.ContextVar("request_id", default=None)
+    request_id.set("abc")
+    assert submit(request_id.get).result() == "abc"
+
+
+def test_alimit_bounds_the_concurrency():
+    limiter = UpstreamLimiter("test", max_concurrency=2)
+    running = []
+    peak = []
+
+    async def call():
+        async with limiter.alimit():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*[call() for _ in range(6)])
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    assert limiter._in_flight == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    limiter = UpstreamLimiter("test", max_concurrency=1)
+
+    async def run():
+        async with limiter.alimit():
+            waiter = asyncio.ensure_future(limiter.alimit().__aenter__())
+            await asyncio.sleep(0)
+            assert len(limiter._waiters) == 1
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert len(limiter._waiters) == 0
+        # the slot is free again, not handed over to the cancelled waiter
+        assert limiter._in_flight == 0
+        async with limiter.alimit():
+            assert limiter._in_flight == 1
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from src.models import intent_classifier, intention_detector
+
+
+class FixedClassifier:
+    """
+    Classifier predicting the same probabilities for any text.
+    """
+
+    def __init__(self, probabilities):
+        self.classes_ = np.array(list(probabilities))
+        self.probabilities = np.array(list(probabilities.values()))
+
+    def predict_proba(self, texts):
+        return np.array([self.probabilities for _ in texts])
+
+
+TRANSFER = [{"user": "Minh", "content": "Chuyển 300k cho Nam tiền bún đậu"}]
+REPLY = [
+    {"user": "assistant", "content": "Bạn có muốn lập kế hoạch chi tiêu không?"},
+    {"user": "Minh", "content": "ok"},
+]
+
+
+@pytest.fixture
+def classifier(monkeypatch):
+    def use(probabilities):
+        monkeypatch.setattr(intent_classifier, "get_classifier", lambda: FixedClassifier(probabilities))
+    return use
+
+
+def test_is_reply_to_assistant():
+    assert intent_classifier.is_reply_to_assistant(REPLY)
+    assert not intent_classifier.is_reply_to_assistant(TRANSFER)
+    # a conversation between users, the last message does not answer the assistant
+    assert not intent_classifier.is_reply_to_assistant([{"user": "Nam", "content": "Đi ăn không?"}, {"user": "Minh", "content": "ok"}])
+    assert intent_classifier.is_reply_to_assistant([{"user": "Assistant", "content": "..."}, {"user": "Minh", "content": "có"}])
+
+
+def test_confident_intention_is_answered_locally(classifier):
+    classifier({"TRANSFER": 0.95, "NO_SYSTEM_ACTION": 0.05})
+    assert intention_detector._detect_user_intention_locally(TRANSFER) == "TRANSFER"
+
+
+def test_reply_to_assistant_calls_the_model(classifier):
+    classifier({"NO_SYSTEM_ACTION": 0.99, "TRANSFER": 0.01})
+    assert intention_detector._detect_user_intention_locally(REPLY) is None
+
+
+def test_unconfident_intention_calls_the_model(classifier):
+    classifier({"TRANSFER": 0.6, "NO_SYSTEM_ACTION": 0.4})
+    assert intention_detector._detect_user_intention_locally(TRANSFER) is None
+
+
+def test_account_report_calls_the_model(classifier):
+    # the flags telling whose report it is only come from the model
+    classifier({"VIEW_USER_ACCOUNT_REPORT": 0.99, "NO_SYSTEM_ACTION": 0.01})
+    assert intention_detector._detect_user_intention_locally([{"user": "Minh", "content": "Xem báo cáo tài khoản"}]) is None
+
+
+def test_missing_classifier_calls_the_model(monkeypatch):
+    monkeypatch.setattr(intent_classifier, "get_classifier", lambda: None)
+    assert intention_detector._detect_user_intention_locally(TRANSFER) is None
+
+
+def test_seed_classifier():
+    samples = intent_classifier.load_samples(intent_classifier.SEED_DATA_PATH)
+    classifier = intent_classifier.train(samples)
+    intent, _ = intent_classifier.predict(TRANSFER, classifier=classifier)
+    assert intent == "TRANSFER"
+    intent, _ = intent_classifier.predict([{"user": "Minh", "content": "Tạo nhóm chat với Nam và Lan"}], classifier=classifier)
+    assert intent == "CREATE_CHAT_GROUP"
+
+
+def test_missing_model_is_trained_on_the_seed(monkeypatch, tmp_path):
+    monkeypatch.setattr(intent_classifier, "INTENT_CLASSIFIER_PATH", str(tmp_path / "missing.joblib"))
+    monkeypatch.setattr(intent_classifier, "_classifier", None)
+    monkeypatch.setattr(intent_classifier, "_classifier_loaded", False)
+    assert intent_classifier.get_classifier() is not None
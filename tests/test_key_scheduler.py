@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from src.utils import key_scheduler, metrics
+from src.utils.key_scheduler import KeyScheduler, TokenBucket
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(60)
+    bucket.level = 0
+    bucket.updated_at = 100.0
+    bucket.refill(110.0)
+    assert bucket.level == pytest.approx(10)
+    bucket.refill(1000.0)
+    assert bucket.level == 60
+
+
+def test_token_bucket_time_until():
+    bucket = TokenBucket(60)
+    assert bucket.time_until(10) == 0
+    bucket.level = -5
+    assert bucket.time_until(10) == pytest.approx(15)
+    # more than the whole bucket only needs a full bucket
+    bucket.level = 0
+    assert bucket.time_until(1000) == pytest.approx(60)
+
+
+def test_lease_picks_the_key_with_the_most_headroom():
+    scheduler = KeyScheduler(["sk-a", "sk-b"], rpm=60, tpm=1000)
+    with scheduler.lease(estimated_tokens=600) as lease:
+        lease.used_tokens = 100
+    with scheduler.lease(estimated_tokens=600) as lease:
+        # sk-a has used 100 of its 1000 tokens, sk-b none
+        assert lease.key == "sk-b"
+
+
+def test_lease_reconciles_the_used_tokens():
+    scheduler = KeyScheduler(["sk-a"], rpm=60, tpm=1000)
+    with scheduler.lease(estimated_tokens=600) as lease:
+        assert scheduler.states[0].tokens.level == pytest.approx(400, abs=1)
+        lease.used_tokens = 100
+    assert scheduler.states[0].tokens.level == pytest.approx(900, abs=1)
+
+
+class RateLimitError(Exception):
+    headers = {"retry-after": "30"}
+
+
+def test_rate_limited_key_cools_down():
+    scheduler = KeyScheduler(["sk-a", "sk-b"], rpm=60, tpm=1000)
+    with pytest.raises(RateLimitError):
+        with scheduler.lease(estimated_tokens=10) as lease:
+            limited = lease.key
+            raise RateLimitError()
+    state = scheduler._by_key[limited]
+    assert state.consecutive_rate_limits == 1
+    for _ in range(3):
+        with scheduler.lease(estimated_tokens=10) as lease:
+            assert lease.key != limited
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= key_scheduler.backoff_delay(attempt, base=0.5, cap=2) <= 2
+
+
+def test_closed_stream_is_not_an_error():
+    scheduler = KeyScheduler(["sk-a"], rpm=60, tpm=1000)
+
+    def stream():
+        with scheduler.lease(estimated_tokens=600):
+            yield "Xin"
+            yield " chào"
+
+    errors = metrics.get('openai_key_requests_total', key='...sk-a', result='error')
+    cancelled = metrics.get('openai_key_requests_total', key='...sk-a', result='cancelled')
+    deltas = stream()
+    next(deltas)
+    deltas.close()
+    assert metrics.get('openai_key_requests_total', key='...sk-a', result='error') == errors
+    assert metrics.get('openai_key_requests_total', key='...sk-a', result='cancelled') == cancelled + 1
+    state = scheduler.states[0]
+    assert state.consecutive_rate_limits == 0
+    # the usage is unknown, the reservation is kept
+    assert state.tokens.level == pytest.approx(400, abs=1)
+
+
+def test_cancelled_call_is_not_an_error(monkeypatch):
+    released = []
+    scheduler = KeyScheduler(["sk-a"], rpm=60, tpm=1000)
+    monkeypatch.setattr(scheduler, "release", lambda lease, error=None, cancelled=False: released.append((error, cancelled)))
+
+    async def call():
+        async with scheduler.alease(estimated_tokens=10):
+            await asyncio.sleep(5)
+
+    async def run():
+        task = asyncio.ensure_future(call())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+    assert released == [(None, True)]
@@ -0,0 +1,46 @@
+import sys
+import logging
+import queue
+from logging.handlers import QueueListener
+
+from src.utils.logger import DroppingQueueHandler
+
+
+class Recorder(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def test_records_are_formatted_by_the_listener():
+    records = queue.Queue()
+    handler = DroppingQueueHandler(records)
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "%s: %d chars", ("Model input", 42), None)
+    handler.handle(record)
+    queued = records.get_nowait()
+    # enqueued as logged, not formatted in the request thread
+    assert queued.msg == "%s: %d chars"
+    assert queued.args == ("Model input", 42)
+    assert queued is not record
+
+    recorder = Recorder()
+    listener = QueueListener(records, recorder)
+    listener.start()
+    try:
+        raise ValueError("invalid JSON")
+    except ValueError:
+        handler.handle(logging.LogRecord("test", logging.ERROR, __file__, 1, "Failed", (), sys.exc_info()))
+    listener.stop()
+    assert recorder.lines[0].startswith("ERROR Failed\nTraceback")
+    assert recorder.lines[0].endswith("ValueError: invalid JSON")
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+    handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "first", (), None))
+    handler.handle(logging.LogRecord("test", logging.INFO, __file__, 1, "second", (), None))
+    assert handler.queue.qsize() == 1
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from src.utils import metrics
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def write_snapshot(metrics_dir, pid, counters=(), gauges=(), histograms=(), buckets=None):
+    # snapshot of another worker process, as written by its `flush`
+    with open(os.path.join(metrics_dir, f"{pid}.json"), "w") as f:
+        json.dump({"counters": list(counters), "gauges": list(gauges), "histograms": list(histograms), "buckets": buckets or {}}, f)
+
+
+def test_flush_writes_the_metrics_of_the_process(metrics_dir):
+    metrics.increment("test_flush_total", result="ok")
+    metrics.set_gauge("test_flush_in_flight", 3)
+    metrics.flush()
+    assert os.listdir(metrics_dir) == [f"{os.getpid()}.json"]
+    with open(metrics_dir / f"{os.getpid()}.json") as f:
+        snapshot = json.load(f)
+    assert ["test_flush_total", [["result", "ok"]], 1.0] in snapshot["counters"]
+    assert ["test_flush_in_flight", [], 3] in snapshot["gauges"]
+
+    metrics.flush(gauges=False)
+    with open(metrics_dir / f"{os.getpid()}.json") as f:
+        assert json.load(f)["gauges"] == []
+
+
+def test_flush_without_metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", None)
+    monkeypatch.chdir(tmp_path)
+    metrics.flush()
+    assert os.listdir(tmp_path) == []
+
+
+def test_load_dir_sums_the_processes(metrics_dir):
+    labels = [["upstream", "openai"]]
+    write_snapshot(
+        metrics_dir, 101,
+        counters=[["calls_total", labels, 2]],
+        gauges=[["in_flight", labels, 1]],
+        histograms=[["duration_seconds", [], [1, 0, 0.05, 1]]],
+        buckets={"duration_seconds": [0.1, 1.0]},
+    )
+    write_snapshot(
+        metrics_dir, 102,
+        counters=[["calls_total", labels, 3], ["errors_total", [], 1]],
+        gauges=[["in_flight", labels, 2]],
+        histograms=[["duration_seconds", [], [0, 1, 0.5, 1]]],
+        buckets={"duration_seconds": [0.1, 1.0]},
+    )
+    # half-written and unrelated files are skipped
+    (metrics_dir / "103.json").write_text('{"counters": [')
+    (metrics_dir / "104.json.tmp").write_text("{}")
+
+    counters, gauges, histograms, buckets = metrics._load_dir()
+    key = ("upstream", "openai"),
+    assert counters == {("calls_total", key): 5, ("errors_total", ()): 1}
+    assert gauges == {("in_flight", key): 3}
+    assert histograms == {("duration_seconds", ()): [1, 1, 0.55, 2]}
+    assert buckets == {"duration_seconds": (0.1, 1.0)}
+
+
+def test_mark_process_dead_keeps_the_counters(metrics_dir):
+    write_snapshot(metrics_dir, 101, counters=[["calls_total", [], 2]], gauges=[["in_flight", [], 1]])
+    metrics.mark_process_dead(101)
+    # unknown workers are ignored
+    metrics.mark_process_dead(999)
+    counters, gauges, _, _ = metrics._load_dir()
+    assert counters == {("calls_total", ()): 2}
+    assert gauges == {}
+    assert sorted(os.listdir(metrics_dir)) == ["101.json"]
+
+
+def test_render_prometheus_sums_the_processes(metrics_dir):
+    write_snapshot(
+        metrics_dir, 101,
+        counters=[["test_render_total", [["result", "ok"]], 2]],
+        histograms=[["test_render_seconds", [], [1, 1, 0.55, 2]]],
+        buckets={"test_render_seconds": [0.1, 1.0]},
+    )
+    metrics.increment("test_render_total", result="ok")
+    text = metrics.render_prometheus()
+    assert 'test_render_total{result="ok"} 3.0' in text
+    assert "# TYPE test_render_seconds histogram" in text
+    assert 'test_render_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_render_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_render_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_render_seconds_count 2" in text
@@ -0,0 +1,43 @@
+import pytest
+
+from src.models import response_templates
+
+
+@pytest.mark.parametrize("number, language, expected", [
+    (3000000, "ENGLISH", "3,000,000"),
+    (3000000, "VIETNAMESE", "3.000.000"),
+    (3000000, "HINDI", "30,00,000"),
+    (123456789, "HINDI", "12,34,56,789"),
+    (999, "HINDI", "999"),
+    (1234.5, "VIETNAMESE", "1.234,50"),
+    (-1500, "ENGLISH", "-1,500"),
+    # unknown languages use the separators of the fallback language
+    (1500, "KLINGON", "1,500"),
+])
+def test_format_number(number, language, expected):
+    assert response_templates.format_number(number, language) == expected
+
+
+def test_format_amount():
+    assert response_templates.format_amount("300000", "VIETNAMESE") == "300.000 VND"
+    assert response_templates.format_amount(300000, "KOREAN") == "300,000동"
+    # not a number, e.g. a missing amount
+    assert response_templates.format_amount("ba trăm nghìn", "ENGLISH") == "ba trăm nghìn"
+
+
+def test_render():
+    assert response_templates.render(
+        "transfer", "VIETNAMESE", amount=response_templates.format_amount(300000, "VIETNAMESE"), receiver="Nam", msg="bún đậu",
+    ) == 'Đã chuyển 300.000 VND cho Nam với nội dung "bún đậu".'
+
+
+def test_render_falls_back_to_english(monkeypatch):
+    monkeypatch.setattr(response_templates, "_templates", {"transfer": {"ENGLISH": "Sent {amount}."}})
+    assert response_templates.render("transfer", "VIETNAMESE", amount="1") == "Sent 1."
+
+
+def test_catalog_templates_have_the_same_placeholders():
+    for template_id, templates in response_templates.get_templates().items():
+        expected = response_templates.get_placeholders(templates[response_templates.FALLBACK_LANGUAGE])
+        for language, template in templates.items():
+            assert response_templates.get_placeholders(template) == expected, (template_id, language)
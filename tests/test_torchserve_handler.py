@@ -0,0 +1,124 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("ts")
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "utils", "self_hosted_models", "torchserve"))
+from benchmark_batching import PREAMBLE, PROMPTS, get_handler
+from torchserve_handler import DECODING_PROFILES, SETUP_CONFIG, TransformersSeqClassifierHandler
+
+
+@pytest.fixture
+def handler():
+    handler = TransformersSeqClassifierHandler()
+    handler.setup_config = dict(SETUP_CONFIG)
+    return handler
+
+
+def test_get_decoding_defaults_to_the_setup_config(handler):
+    generate_kwargs, max_new_tokens, stop = handler.get_decoding({"prompt": "A"})
+    assert generate_kwargs == DECODING_PROFILES[SETUP_CONFIG["decoding_profile"]]
+    assert max_new_tokens == SETUP_CONFIG["max_new_tokens"]
+    assert stop == []
+
+
+def test_get_decoding_from_temperature(handler):
+    assert handler.get_decoding({"temperature": 0})[0] == DECODING_PROFILES["greedy"]
+    generate_kwargs, _, _ = handler.get_decoding({"temperature": 0.3, "top_p": 0.9})
+    assert generate_kwargs == {**DECODING_PROFILES["sampling"], "temperature": 0.3, "top_p": 0.9}
+
+
+def test_get_decoding_preset_is_overridden_by_the_request(handler):
+    generate_kwargs, max_new_tokens, stop = handler.get_decoding({"preset": "intent", "max_tokens": 20, "stop": "}"})
+    assert generate_kwargs == DECODING_PROFILES["greedy"]
+    assert max_new_tokens == 20
+    assert stop == ["}"]
+    assert handler.get_decoding({"preset": "intent"})[1:] == (12, ["\n"])
+
+
+def test_get_decoding_drops_sampling_options_of_greedy_and_beam(handler):
+    generate_kwargs, _, _ = handler.get_decoding({"profile": "beam", "temperature": 0.7, "top_k": 50, "num_beams": 2})
+    assert generate_kwargs == {**DECODING_PROFILES["beam"], "num_beams": 2}
+
+
+def test_get_decoding_streams_greedily(handler):
+    generate_kwargs, _, _ = handler.get_decoding({"profile": "beam", "stream": True})
+    assert generate_kwargs == {**DECODING_PROFILES["greedy"], "repetition_penalty": DECODING_PROFILES["beam"]["repetition_penalty"]}
+
+
+def test_get_decoding_unknown_profile_and_preset(handler):
+    generate_kwargs, max_new_tokens, _ = handler.get_decoding({"profile": "nucleus", "preset": "poem", "min_tokens": 4})
+    assert generate_kwargs == {**DECODING_PROFILES[SETUP_CONFIG["decoding_profile"]], "min_new_tokens": 4}
+    assert max_new_tokens == SETUP_CONFIG["max_new_tokens"]
+
+
+@pytest.fixture(scope="module")
+def tiny_handler():
+    # random tiny bloom which never generates EOS, see `build_tiny_model`
+    return get_handler()
+
+
+def generate(handler, bodies):
+    return handler.inference(handler.preprocess([{"body": body} for body in bodies]))
+
+
+def test_batched_greedy_matches_unbatched(tiny_handler):
+    bodies = [{"prompt": prompt, "profile": "greedy", "max_tokens": 8} for prompt in PROMPTS[:4]]
+    batched = generate(tiny_handler, bodies)
+    assert tiny_handler.batch_stats["generate_calls"] == 1
+    for body, output in zip(bodies, batched):
+        assert output == generate(tiny_handler, [body])[0]
+        assert output["usage"]["completion_tokens"] == 8
+        assert output["finish_reason"] == "length"
+
+
+def test_per_row_max_tokens(tiny_handler):
+    bodies = [{"prompt": prompt, "profile": "greedy", "max_tokens": max_tokens} for prompt, max_tokens in zip(PROMPTS, [2, 8, 5])]
+    outputs = generate(tiny_handler, bodies)
+    assert [output["usage"]["completion_tokens"] for output in outputs] == [2, 8, 5]
+    for body, output in zip(bodies, outputs):
+        assert output["text"] == generate(tiny_handler, [body])[0]["text"]
+
+
+def test_stop_sequences(tiny_handler):
+    body = {"prompt": PROMPTS[0], "profile": "greedy", "max_tokens": 16}
+    text = generate(tiny_handler, [body])[0]["text"]
+    stop = text[len(text) // 2:len(text) // 2 + 3]
+    expected = text[:text.find(stop)]
+    outputs = generate(tiny_handler, [{**body, "stop": [stop]}, {"prompt": PROMPTS[1], "profile": "greedy", "max_tokens": 16}])
+    assert outputs[0]["text"] == expected
+    assert outputs[0]["finish_reason"] == "stop"
+    assert outputs[0]["usage"]["completion_tokens"] < 16
+    # the other row of the batch is not stopped
+    assert outputs[1]["finish_reason"] == "length"
+    assert outputs[1]["usage"]["completion_tokens"] == 16
+
+
+def test_streamed_request_returns_the_whole_text_without_torchserve(tiny_handler):
+    body = {"prompt": PROMPTS[0], "profile": "greedy", "max_tokens": 8}
+    tiny_handler.context = None
+    assert generate(tiny_handler, [{**body, "stream": True}])[0]["text"] == generate(tiny_handler, [body])[0]["text"]
+
+
+def test_streamed_request_sends_the_text_while_generated(tiny_handler, monkeypatch):
+    body = {"prompt": PROMPTS[0], "profile": "greedy", "max_tokens": 8}
+    sent = []
+    monkeypatch.setattr(tiny_handler, "_send_intermediate", lambda row, text: sent.append(text) or True)
+    final = generate(tiny_handler, [{**body, "stream": True}])[0]["text"]
+    assert len(sent) > 0
+    # the final response only carries the text not sent yet
+    assert "".join(sent) + final == generate(tiny_handler, [body])[0]["text"]
+
+
+def test_cached_prefix_matches_uncached(tiny_handler):
+    bodies = [{"prompt": prompt, "preset": "intent", "max_tokens": 8, "stop": []} for prompt in PROMPTS[:3]]
+    uncached = generate(tiny_handler, [{**body, "prompt": PREAMBLE + body["prompt"]} for body in bodies])
+    assert tiny_handler.batch_stats.get("cached_prefix_rows", 0) == 0
+    for _ in range(2):
+        # the first batch computes the prefix, the second one reuses it
+        cached = generate(tiny_handler, [{**body, "prefix": PREAMBLE} for body in bodies])
+        assert tiny_handler.batch_stats["cached_prefix_rows"] == len(bodies)
+        assert [output["text"] for output in cached] == [output["text"] for output in uncached]
+        assert [output["usage"] for output in cached] == [output["usage"] for output in uncached]
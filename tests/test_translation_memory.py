@@ -0,0 +1,13 @@
+# importing the modules registers their static texts
+from src.models import ask_assistant, translator  # noqa: F401
+from src.models.language_detection import LANGUAGES
+from src.models.translation_memory import TranslationMemory, get_static_texts
+
+
+def test_static_texts_are_translated_into_every_language():
+    memory = TranslationMemory()
+    missing = [
+        (dest, text) for text, src in get_static_texts() for dest in [language.name for language in LANGUAGES]
+        if dest != src and memory.get(text, src, dest) is None
+    ]
+    assert missing == [], "run scripts/build_translation_memory.py"
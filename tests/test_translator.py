@@ -0,0 +1,29 @@
+import pytest
+
+from src.models import translator
+
+
+def test_parse_batch_translation_without_repeated_first_number():
+    assert translator._parse_batch_translation(" Thank you\n2. Thank you very much\n3.", 3) == ["Thank you", "Thank you very much", None]
+
+
+def test_parse_batch_translation_with_repeated_first_number():
+    assert translator._parse_batch_translation("1. Hello\n2) Goodbye", 2) == ["Hello", "Goodbye"]
+
+
+def test_parse_batch_translation_joins_wrapped_lines():
+    assert translator._parse_batch_translation("1. Transferred 300,000 VND\n   to Nam\n2. Done", 2) == ["Transferred 300,000 VND to Nam", "Done"]
+
+
+@pytest.mark.parametrize("output", [
+    # a number given twice is ambiguous
+    "1. Hello\n2. Goodbye\n2. Bye",
+    # a number missing
+    "1. Hello\n3. Bye",
+])
+def test_parse_batch_translation_missing_or_ambiguous(output):
+    assert translator._parse_batch_translation(output, 2)[1] is None
+
+
+def test_parse_batch_translation_ignores_extra_numbers():
+    assert translator._parse_batch_translation("1. Hello\n2. Goodbye\n3. Extra", 2) == ["Hello", "Goodbye"]